@@ -1,7 +1,5 @@
 #!/usr/bin/bash
 
-for (( ; ; ))
-do
-  ./ffm.py -a
-  sleep 600
-done
+# One resident crawler instead of a fresh ffm.py every 600 s.
+# Control it with ./ffm.py --control run|pause|resume|status|stop.
+./ffm.py -a --daemon 600
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks of the page parsers on the saved pages in tests/.
+
+Each case runs one FanfictionScraper entry point on one saved page,
+already parsed. The "parse" case of a page times html.fromstring and
+every scrape of that page with fresh parsers, as a run does. A case
+is run a few times to warm up and then timed over repeated runs.
+
+Memory is measured in a separate pass, so that tracing does not skew
+the timings: the peak traced during one run and the blocks the run
+left allocated (its tree and records). That is a count of the blocks
+retained, net of those freed, not of every allocation the run made.
+tracemalloc only sees Python allocations, not libxml2's own.
+
+    python -m dyrm.benchmark run -o before.json
+    python -m dyrm.benchmark run -o after.json
+    python -m dyrm.benchmark compare before.json after.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import tracemalloc
+from lxml import html, etree
+from dyrm.ffgetter import FanfictionScraper
+
+# Scraper entry points to time on each saved page
+PAGE_SCRAPES = {
+    "test_story_eyes.php": (
+        "get_month_story_rows", "get_titles", "get_month_caption",
+        "get_month_menu", "get_monthly_visits"),
+    "test_legacy.php": ("get_legacy", "get_legacy_titles"),
+    "part_favs.php": ("get_legacy_part",),
+    "test_chapter_page.php": (
+        "get_chapters_mcap", "get_chapters_rows", "get_chapters_visits"),
+    "test_chapter_single.php": ("get_chapter_single",),
+    "user_fav.php": ("get_users",),
+    "user_prof.php": ("get_user_country",),
+}
+
+PAGES_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests")
+
+
+def page_cases(pages_dir=PAGES_DIR, match=None):
+    """ (name, function) for every case, or those with match in the name """
+    cases = []
+    for page, scrapes in sorted(PAGE_SCRAPES.items()):
+        with open(os.path.join(pages_dir, page), 'rb') as page_file:
+            content = page_file.read()
+        tree = html.fromstring(content)
+        scraper = FanfictionScraper()
+        for scrape in scrapes:
+            cases.append((
+                "{0}:{1}".format(page, scrape),
+                lambda method=getattr(scraper, scrape), tree=tree:
+                method(tree)))
+
+        def parse(content=content, scrapes=scrapes):
+            page_tree = html.fromstring(content)
+            fresh = FanfictionScraper()
+            return [getattr(fresh, name)(page_tree) for name in scrapes]
+        cases.append(("{0}:parse".format(page), parse))
+    if match:
+        cases = [case for case in cases if match in case[0]]
+    return cases
+
+
+def time_case(func, warmup=3, repeat=30):
+    """ Run times in microseconds, after warming up """
+    for _ in range(warmup):
+        func()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        func()
+        times.append((time.perf_counter_ns() - start) / 1000)
+    return times
+
+
+def measure_memory(func):
+    """
+    (peak bytes, blocks retained) traced over one run. The blocks are
+    those the result still holds: allocations less frees, per file.
+    """
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        start, _ = tracemalloc.get_traced_memory()
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    blocks = sum(
+        stat.count_diff for stat in after.compare_to(before, 'filename'))
+    del result
+    return peak - start, blocks
+
+
+def summarise(times):
+    """ Percentiles of the run times """
+    deciles = statistics.quantiles(times, n=10, method='inclusive')
+    return dict(
+        runs=len(times),
+        min_us=round(min(times), 1),
+        p50_us=round(statistics.median(times), 1),
+        p90_us=round(deciles[8], 1),
+        max_us=round(max(times), 1))
+
+
+def run_benchmarks(pages_dir=PAGES_DIR, match=None, warmup=3, repeat=30):
+    """ Benchmark every case, as a dictionary fit for JSON """
+    results = {}
+    for name, func in page_cases(pages_dir, match):
+        result = summarise(time_case(func, warmup, repeat))
+        result['peak_bytes'], result['live_blocks'] = measure_memory(func)
+        results[name] = result
+    return dict(
+        python=platform.python_version(),
+        lxml=".".join(str(part) for part in etree.LXML_VERSION),
+        machine=platform.machine(),
+        warmup=warmup, repeat=repeat, cases=results)
+
+
+def compare(baseline, current, threshold=0.10, field='p50_us'):
+    """
+    (case, old, new, ratio, flag) for the cases in both runs. The
+    flag is "slower" where new is over old by more than the
+    threshold, "faster" where it is under by as much, or "".
+    """
+    rows = []
+    old_cases = baseline['cases']
+    for name, result in sorted(current['cases'].items()):
+        if name not in old_cases:
+            continue
+        old = old_cases[name][field]
+        new = result[field]
+        ratio = new / old if old else 1.0
+        flag = ""
+        if ratio > 1.0 + threshold:
+            flag = "slower"
+        elif ratio < 1.0 - threshold:
+            flag = "faster"
+        rows.append((name, old, new, ratio, flag))
+    return rows
+
+
+def print_results(results):
+    """ One line per case """
+    print("{0:<42} {1:>10} {2:>10} {3:>10} {4:>8}".format(
+        "case", "p50 us", "p90 us", "peak KiB", "retained"))
+    for name, result in sorted(results['cases'].items()):
+        print("{0:<42} {1:10.1f} {2:10.1f} {3:10,d} {4:8,d}".format(
+            name, result['p50_us'], result['p90_us'],
+            result['peak_bytes'] // 1024, result['live_blocks']))
+
+
+def print_comparison(rows, field):
+    """ One line per case, regressions marked """
+    print("{0:<42} {1:>10} {2:>10} {3:>7}".format(
+        "case", "old " + field, "new " + field, "ratio"))
+    for name, old, new, ratio, flag in rows:
+        print("{0:<42} {1:10.1f} {2:10.1f} {3:7.2f} {4}".format(
+            name, old, new, ratio, flag))
+
+
+def main(argv=None):
+    """ Run or compare benchmarks; exit status 1 on a regression """
+    parser = argparse.ArgumentParser(prog="python -m dyrm.benchmark")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="time the parsers")
+    run.add_argument("-o", "--out", help="save the results as JSON here")
+    run.add_argument("-p", "--pages", default=PAGES_DIR,
+                     help="folder of saved pages")
+    run.add_argument("-k", "--match", help="only cases with this in the name")
+    run.add_argument("-w", "--warmup", type=int, default=3)
+    run.add_argument("-r", "--repeat", type=int, default=30)
+    run.add_argument("-b", "--baseline", help="compare with this baseline")
+    run.add_argument("-t", "--threshold", type=float, default=0.10)
+    cmp_parser = commands.add_parser("compare", help="compare two results")
+    cmp_parser.add_argument("baseline")
+    cmp_parser.add_argument("current")
+    cmp_parser.add_argument("-t", "--threshold", type=float, default=0.10)
+    cmp_parser.add_argument(
+        "-f", "--field", default="p50_us",
+        choices=["min_us", "p50_us", "p90_us", "peak_bytes", "live_blocks"],
+        help="live_blocks is the count of blocks a run retains")
+    args = parser.parse_args(argv)
+
+    field = getattr(args, 'field', 'p50_us')
+    if args.command == "run":
+        current = run_benchmarks(
+            args.pages, args.match, args.warmup, args.repeat)
+        print_results(current)
+        if args.out:
+            with open(args.out, 'w') as out_file:
+                json.dump(current, out_file, indent=1, sort_keys=True)
+        if not args.baseline:
+            return 0
+        baseline_path = args.baseline
+    else:
+        baseline_path = args.baseline
+        with open(args.current, 'r') as current_file:
+            current = json.load(current_file)
+    with open(baseline_path, 'r') as baseline_file:
+        baseline = json.load(baseline_file)
+    rows = compare(baseline, current, args.threshold, field)
+    print_comparison(rows, field)
+    return 1 if any(row[4] == "slower" for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
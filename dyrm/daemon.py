@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+"""
+Resident crawler that runs a crawl cycle every so often.
+
+Unlike a shell loop around ffm.py, the process stays up between
+cycles, so the imports, compiled parsers, database engines, cookie
+jar and the keep-alive connections to the sites are set up once.
+
+It is controlled by signals (SIGUSR1 runs a cycle now, SIGUSR2
+pauses or resumes, SIGTERM and SIGINT stop it) or by one-line
+commands on a localhost socket: run, pause, resume, status, stop.
+Each command gets the status back as a line of JSON. A stop lets
+the running cycle finish, so its writes are committed, first.
+"""
+
+import json
+import time
+import signal
+import logging
+import datetime
+import threading
+import socketserver
+import socket
+
+DEFAULT_CONTROL_PORT = 8631
+
+
+class CrawlDaemon:
+    """ Run cycle() every interval seconds until stopped """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, cycle, interval=600.0):
+        self.cycle = cycle
+        self.interval = interval
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.requested = False
+        self.paused = False
+        self.running = False
+        self.runs = 0
+        self.next_run = time.monotonic()
+        self.last_start = None
+        self.last_end = None
+        self.last_error = None
+
+    def run_now(self):
+        """ Run a cycle as soon as the current one, if any, is done """
+        self.requested = True
+        self.wake.set()
+
+    def pause(self):
+        """ Skip the scheduled cycles; run_now still runs one """
+        self.paused = True
+        self.wake.set()
+
+    def resume(self):
+        """ Go back to the schedule """
+        self.paused = False
+        self.wake.set()
+
+    def stop(self):
+        """ Stop after the running cycle, if any """
+        self.stopping.set()
+        self.wake.set()
+
+    def status(self):
+        """ State of the daemon, as a dictionary fit for JSON """
+        state = "idle"
+        if self.stopping.is_set():
+            state = "stopping"
+        elif self.running:
+            state = "running"
+        elif self.paused:
+            state = "paused"
+        return dict(
+            state=state, runs=self.runs,
+            next_run=max(0.0, round(self.next_run - time.monotonic(), 1)),
+            last_start=self.last_start, last_end=self.last_end,
+            last_error=self.last_error)
+
+    def command(self, name):
+        """ Carry out a control command, returning the status """
+        actions = dict(
+            run=self.run_now, pause=self.pause, resume=self.resume,
+            stop=self.stop, status=lambda: None)
+        action = actions.get(name)
+        if action is None:
+            return dict(error="unknown command {0!r}".format(name))
+        action()
+        return self.status()
+
+    def run_cycle(self):
+        """ One cycle; a failure is logged and the daemon carries on """
+        logger = logging.getLogger(__name__)
+        self.running = True
+        self.last_start = "{0:%Y-%m-%d %H:%M:%S}".format(
+            datetime.datetime.now())
+        try:
+            self.cycle()
+            self.last_error = None
+        except (Exception, SystemExit) as exc:
+            # pylint: disable=broad-except
+            self.last_error = repr(exc)
+            logger.error("crawl cycle failed: %r", exc)
+        finally:
+            self.running = False
+            self.runs += 1
+            self.last_end = "{0:%Y-%m-%d %H:%M:%S}".format(
+                datetime.datetime.now())
+
+    def serve(self):
+        """ Run cycles on schedule or on request until stopped """
+        while not self.stopping.is_set():
+            self.wake.wait(max(0.0, self.next_run - time.monotonic()))
+            self.wake.clear()
+            if self.stopping.is_set():
+                break
+            due = time.monotonic() >= self.next_run
+            if self.requested or (due and not self.paused):
+                self.requested = False
+                self.run_cycle()
+                self.next_run = time.monotonic() + self.interval
+            elif due:
+                self.next_run = time.monotonic() + self.interval
+
+
+class ControlHandler(socketserver.StreamRequestHandler):
+    """ One command line in, one line of JSON status out """
+
+    def handle(self):
+        name = self.rfile.readline(256).decode('utf-8', 'replace').strip()
+        reply = self.server.daemon_ref.command(name)
+        self.wfile.write((json.dumps(reply) + "\n").encode('utf-8'))
+
+
+def serve_control(daemon, port=DEFAULT_CONTROL_PORT):
+    """ Answer control commands on a localhost port, in a thread """
+    server = socketserver.ThreadingTCPServer(
+        ("127.0.0.1", port), ControlHandler)
+    server.daemon_threads = True
+    server.daemon_ref = daemon
+    thread = threading.Thread(
+        target=server.serve_forever, name="control", daemon=True)
+    thread.start()
+    return server
+
+
+def send_command(name, port=DEFAULT_CONTROL_PORT, timeout=5.0):
+    """ Send a command to a running daemon and return its reply """
+    with socket.create_connection(("127.0.0.1", port), timeout) as conn:
+        conn.sendall((name + "\n").encode('utf-8'))
+        reply = conn.makefile('rb').readline()
+    return json.loads(reply.decode('utf-8'))
+
+
+def install_signals(daemon):
+    """ Control the daemon by signal, where the platform has them """
+    handlers = dict(
+        SIGUSR1=daemon.run_now,
+        SIGUSR2=lambda: (daemon.resume if daemon.paused else daemon.pause)(),
+        SIGTERM=daemon.stop, SIGINT=daemon.stop)
+    for name, handler in handlers.items():
+        signum = getattr(signal, name, None)
+        if signum is not None:
+            signal.signal(
+                signum, lambda _signum, _frame, act=handler: act())
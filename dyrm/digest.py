@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+
+"""
+Digests of the change log: daily, weekly and monthly summaries
+built with SQL aggregate and window queries over the changes table,
+so nobody has to replay the report logs.
+"""
+
+import datetime
+import logging
+from collections import namedtuple
+from sqlalchemy import func, and_
+from dyrm.readme_db import ReadMeDb, Runs, Changes, Stories
+from dyrm.reportgen import print_divider
+
+PERIODS = {
+    'daily': datetime.timedelta(days=1),
+    'weekly': datetime.timedelta(days=7),
+    'monthly': datetime.timedelta(days=30)}
+
+Mover = namedtuple(
+    'Mover', ['rank', 'ref', 'title', 'chap', 'country', 'delta'])
+
+NewFav = namedtuple(
+    'NewFav', ['stamp', 'ref', 'title', 'field', 'code', 'alias', 'country'])
+
+Digest = namedtuple(
+    'Digest',
+    ['period', 'since', 'until', 'runs', 'totals',
+     'stories', 'chapters', 'countries', 'new_countries', 'new_favs'])
+
+
+class DigestBuilder:
+    """ Build digests of the changes logged in a ReadMeDb """
+
+    def __init__(self, read_db, top=10):
+        self.session = read_db.session
+        self.top = top
+
+    def build(self, period='daily', until=None, ref=None):
+        """
+        Summarise the changes of the period ending at until (default now),
+        optionally for just one story.
+        """
+        if until is None:
+            until = datetime.datetime.now()
+        since = until - PERIODS[period]
+        return Digest(
+            period=period, since=since, until=until,
+            runs=self.count_runs(since, until),
+            totals=self.get_totals(since, until, ref),
+            stories=self.get_top_stories(since, until, ref),
+            chapters=self.get_top_chapters(since, until, ref),
+            countries=self.get_top_countries(since, until, ref),
+            new_countries=self.get_new_countries(since, until, ref),
+            new_favs=self.get_new_favs(since, until, ref))
+
+    def in_period(self, query, since, until, ref=None):
+        """ Restrict a query on Changes to the runs of a period """
+        query = query.join(Runs, Runs.run == Changes.run).filter(
+            Runs.started >= since, Runs.started < until)
+        if ref is not None:
+            query = query.filter(Changes.ref == ref)
+        return query
+
+    def count_runs(self, since, until):
+        """ Number of runs in the period """
+        return self.session.query(func.count(Runs.run)).filter(
+            Runs.started >= since, Runs.started < until).scalar()
+
+    def get_totals(self, since, until, ref=None):
+        """ Count and net delta of changes by level and field """
+        query = self.session.query(
+            Changes.level, Changes.field,
+            func.count(Changes.num), func.sum(Changes.delta))
+        query = self.in_period(query, since, until, ref)
+        return query.group_by(
+            Changes.level, Changes.field).order_by(
+                Changes.level, Changes.field).all()
+
+    def ranked(self, query, delta, *group):
+        """ Group, rank by the summed delta and keep the top few """
+        return query.group_by(*group).order_by(
+            delta.desc()).limit(self.top).all()
+
+    def get_top_stories(self, since, until, ref=None):
+        """ Stories with the most new views """
+        delta = func.sum(Changes.delta)
+        query = self.session.query(
+            func.rank().over(order_by=delta.desc()), Changes.ref,
+            func.max(Stories.title), delta).outerjoin(
+                Stories, Stories.ref == Changes.ref).filter(
+                    Changes.level == 'story', Changes.field == 'views')
+        query = self.in_period(query, since, until, ref)
+        return [
+            Mover(rank, sref, title, 0, "", total)
+            for rank, sref, title, total in
+            self.ranked(query, delta, Changes.ref)]
+
+    def get_top_chapters(self, since, until, ref=None):
+        """ Chapters with the most new views """
+        delta = func.sum(Changes.delta)
+        query = self.session.query(
+            func.rank().over(order_by=delta.desc()),
+            Changes.ref, func.max(Stories.title), Changes.chap,
+            delta).outerjoin(
+                Stories, Stories.ref == Changes.ref).filter(
+                    Changes.level == 'chapter', Changes.field == 'views')
+        query = self.in_period(query, since, until, ref)
+        return [
+            Mover(rank, sref, title, chap, "", total)
+            for rank, sref, title, chap, total in
+            self.ranked(query, delta, Changes.ref, Changes.chap)]
+
+    def get_top_countries(self, since, until, ref=None):
+        """ Countries with the most new views, overall or for a story """
+        level = 'country' if ref is None else 'story_country'
+        delta = func.sum(Changes.delta)
+        query = self.session.query(
+            func.rank().over(order_by=delta.desc()),
+            Changes.country, delta).filter(
+                Changes.level == level, Changes.field == 'views')
+        query = self.in_period(query, since, until, ref)
+        return [
+            Mover(rank, ref or 0, "", 0, country, total)
+            for rank, country, total in
+            self.ranked(query, delta, Changes.country)]
+
+    def get_new_countries(self, since, until, ref=None):
+        """ Countries first seen in the period, overall or for a story """
+        level = 'country' if ref is None else 'story_country'
+        first_seen = func.min(Runs.started)
+        query = self.session.query(
+            Changes.country, first_seen).join(
+                Runs, Runs.run == Changes.run).filter(
+                    Changes.level == level, Changes.country != "")
+        if ref is not None:
+            query = query.filter(Changes.ref == ref)
+        return query.group_by(Changes.country).having(
+            and_(first_seen >= since, first_seen < until)).order_by(
+                first_seen).all()
+
+    def get_new_favs(self, since, until, ref=None):
+        """ Favs and follows added in the period """
+        query = self.session.query(
+            Runs.started, Changes.ref, Stories.title, Changes.field,
+            Changes.code, Changes.entity, Changes.country).outerjoin(
+                Stories, Stories.ref == Changes.ref).filter(
+                    Changes.level == 'user',
+                    Changes.field.in_(['fav added', 'follow added']))
+        query = self.in_period(query, since, until, ref)
+        return [
+            NewFav(*row) for row in query.order_by(Runs.started).all()]
+
+
+def print_digest(digest):
+    """ Write a digest to the log """
+    logger = logging.getLogger(__name__)
+    logger.info(
+        "{} digest {:%Y-%m-%d %H:%M} to {:%Y-%m-%d %H:%M}, {} runs".format(
+            digest.period.capitalize(), digest.since, digest.until,
+            digest.runs))
+    print_divider()
+    for level, field, count, total in digest.totals:
+        logger.info(
+            "%s %s: %d changes, net %d" % (level, field, count, total))
+    print_divider()
+    logger.info("Top stories")
+    for mover in digest.stories:
+        logger.info("%d. '%s' views +%d" % (
+            mover.rank, mover.title, mover.delta))
+    logger.info("Top chapters")
+    for mover in digest.chapters:
+        logger.info("%d. '%s' chapter %d views +%d" % (
+            mover.rank, mover.title, mover.chap, mover.delta))
+    logger.info("Top countries")
+    for mover in digest.countries:
+        logger.info("%d. '%s' views +%d" % (
+            mover.rank, mover.country, mover.delta))
+    print_divider()
+    for country, first_seen in digest.new_countries:
+        logger.info("New country '{}' on {:%Y-%m-%d}".format(
+            country, first_seen))
+    for fav in digest.new_favs:
+        logger.info("'{}' {} '{}' from '{}' ({:d})".format(
+            fav.title, fav.field, fav.alias, fav.country, fav.code))
+    print_divider()
+
+
+def main(db="dbs/readme.db", period='daily', ref=None, top=10):
+    """ Print a digest of the changes logged in the database """
+    with ReadMeDb(db, echo=False) as read_db:
+        digest = DigestBuilder(read_db, top=top).build(period, ref=ref)
+        print_digest(digest)
+    return digest
+
+
+# Print the daily digest.
+if __name__ == "__main__":
+    main()
@@ -6,14 +6,33 @@ up to date on the hits their stories are getting,
 specialized in this case for an archive of our own (ao3)
 """
 
+import re
 import sys
 import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from lxml import etree
+from sqlalchemy.exc import SQLAlchemyError
 import dyrm.read_firefox_cookies as read_firefox_cookies
 from dyrm.eprint import eprint
-from dyrm.ffgetter import PageGetter
+from dyrm.ffgetter import PageGetter, uncomma
+from dyrm.throttle import HostThrottle
+from dyrm.sites import AO3_URL
 from dyrm.readme_db import ReadMeDb
+from dyrm.instruments import Instruments, current, timed
+from dyrm.instruments import export_prometheus
 from dyrm.reportgen import ReportGen
+from dyrm.monthdiff import diff_snapshot
+
+# Politeness limits for archiveofourown.org, across all workers.
+AO3_MIN_INTERVAL = 3.0
+AO3_MAX_CONCURRENT = 3
+AO3_USER = "RockSunner"
+
+AO3_FIELDS = ('hits', 'kudos', 'comments', 'bookmarks')
+
+Ao3Rec = namedtuple(
+    'Ao3Rec', ['ref', 'title', 'hits', 'kudos', 'comments', 'bookmarks'])
 
 
 def RepresentsInt(s):
@@ -27,81 +46,150 @@ def RepresentsInt(s):
 class Ao3Scraper:
     """ Encapsulates the scraping of data from ao3 """
 
+    # Works are listed as <li class="work blurb group" id="work_NNN">.
+    find_works = etree.XPath(
+        '//li[contains(concat(" ", normalize-space(@class), " "), " work ")]')
+    work_id_pattern = re.compile(r"^work_([0-9]+)$")
+    work_href_pattern = re.compile(r"^/works/([0-9]+)$")
+
     def __init__(self):
-        self.find_stats = etree.XPath('//dl[@class = "stats"]')
-        self.find_hits = etree.XPath('dd[@class = "hits"]')
-        self.find_kudos = etree.XPath('dd[@class = "kudos"]')
-        self.find_comments = etree.XPath('dd[@class = "comments"]')
-        self.find_bookmarks = etree.XPath('dd[@class = "bookmarks"]')
-        self.find_headers = etree.XPath(
-            '//div[@class ="header module"]/h4[@class = "heading"]/a[contains(@href,"works")]')
+        self.find_navigation = etree.XPath(
+            '//ol[@class = "pagination actions"]/li/a')
 
+    @timed('parse')
     def parse_tree(self, tree, recs):
-        stats = self.find_stats(tree)
-        headers = self.find_headers(tree)
-
-        for header, stat_block in zip(headers, stats):
-            title = header.text_content()
-            ref = int(header.get("href")[7:])
-            hit_list = self.find_hits(stat_block)
-            if hit_list:
-                hits = int(hit_list[0].text_content())
-            else:
-                hits = 0
-            kudo_list = self.find_kudos(stat_block)
-            if kudo_list:
-                kudos = int(kudo_list[0].text_content())
-            else:
-                kudos = 0
-            comment_list = self.find_comments(stat_block)
-            if comment_list:
-                comments = int(comment_list[0].text_content())
-            else:
-                comments = 0
-            bookmark_list = self.find_bookmarks(stat_block)
-            if bookmark_list:
-                bookmarks = int(bookmark_list[0].text_content())
-            else:
-                bookmarks = 0
-            recs.append({
-                "title": title,
-                "ref": ref,
-                "hits": hits, "kudos": kudos,
-                "comments": comments, "bookmarks": bookmarks})
+        """ Add a record for each work blurb on a listing page """
+        for blurb in self.find_works(tree):
+            rec = self.parse_blurb(blurb)
+            if rec:
+                recs.append(rec)
         return recs
 
-
-def compare_ao3_rec(db_rec, current_rec, report_gen):
+    def parse_blurb(self, blurb):
+        """
+        Get the id, title and stats of one work in a single walk
+        over its links and <dd> values. Stats the blurb does not
+        show count as zero, and only affect this one work.
+        """
+        ref = 0
+        match = self.work_id_pattern.match(blurb.get("id", ""))
+        if match:
+            ref = int(match.group(1))
+        title = None
+        stats = dict.fromkeys(AO3_FIELDS, 0)
+        for elem in blurb.iter('a', 'dd'):
+            if elem.tag == 'dd':
+                field = elem.get("class")
+                if field in stats:
+                    stats[field] = uncomma(elem.text_content())
+            elif title is None:
+                match = self.work_href_pattern.match(elem.get("href", ""))
+                if match:
+                    title = elem.text_content()
+                    ref = ref or int(match.group(1))
+        if title is None:
+            return None
+        return Ao3Rec(ref=ref, title=title, **stats)
+
+    @timed('parse')
+    def get_page_count(self, tree):
+        """ Number of pages in the listing, from the pagination links """
+        pages = [
+            int(link.text_content()) for link in self.find_navigation(tree)
+            if RepresentsInt(link.text_content())]
+        return max(pages + [1])
+
+
+def crawl_works(pgetter, works_page, workers=AO3_MAX_CONCURRENT):
+    """
+    Get the records from every page of a works listing.
+    Page 1 gives the page count; the other pages are then fetched
+    and parsed by a pool of workers (the getter's throttle keeps
+    them polite) and merged back in page order.
     """
-    Find all the numeric differences between the old db rec
-    and the current rec we scraped from the site
+    scraper = Ao3Scraper()
+    tree = pgetter.get_page(works_page)
+    recs = scraper.parse_tree(tree, [])
+    page_count = scraper.get_page_count(tree)
+    del tree
+    instruments = current()
+
+    def get_page_recs(page):
+        """ Fetch and parse one page, in a worker thread """
+        with instruments.active():
+            return scraper.parse_tree(
+                pgetter.get_page(works_page, {"page": page}), [])
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for page_recs in pool.map(get_page_recs, range(2, page_count + 1)):
+            recs.extend(page_recs)
+    return recs
+
+
+def update_ao3_stories(recs, read_db, report_gen):
     """
-    tests = [
-        'hits', 'kudos',
-        'comments', 'bookmarks', 'ref']
-    current_dict = current_rec
-    db_dict = db_rec.__dict__
-    changed = []
-    for value_key in tests:
-        if report_gen.compare_and_print(
-                current_rec["title"],
-                value_key,
-                current_dict,
-                db_dict) > 0:
-            setattr(db_rec, value_key, current_dict[value_key])
-            changed.append(value_key)
-    return changed
-
-
-def main(db="dbs/readme.db"):
+    Compare the scraped works with every stored work, read in one
+    query, and write back only the new, renamed or changed ones in
+    one upsert. Returns the ChangeSet of the stats that moved.
+    """
+    stored = read_db.get_ao3_values()
+    current = dict((rec.ref, rec) for rec in recs)
+
+    # Rows migrated from the title-keyed table get their work id now.
+    # Only they are matched by title; the work id is the identity.
+    placeholders = {}
+    for ref, values in sorted(stored.items()):
+        if ref <= 0:
+            placeholders.setdefault(values[0], []).append(ref)
+    for rec in recs:
+        if rec.ref not in stored and placeholders.get(rec.title):
+            old_ref = placeholders[rec.title].pop()
+            read_db.rekey_ao3_story(old_ref, rec.ref)
+            stored[rec.ref] = stored.pop(old_ref)
+
+    changes = diff_snapshot(
+        current,
+        dict((ref, values[1:]) for ref, values in stored.items()),
+        AO3_FIELDS)
+    for change in changes:
+        title = current[change.key].title
+        report_gen.report_change(
+            title, 'ao3', change, entity=title, ref=change.key)
+
+    to_write = set(changes.changed_keys())
+    for rec in recs:
+        if rec.ref not in stored:
+            to_write.add(rec.ref)
+        elif stored[rec.ref][0] != rec.title:
+            report_gen.line_to_report(
+                rec.title, "'{}' renamed from '{}'".format(
+                    rec.title, stored[rec.ref][0]))
+            to_write.add(rec.ref)
+    read_db.upsert_ao3_stories([current[ref] for ref in sorted(to_write)])
+    return changes
+
+
+def main(
+        db="dbs/readme.db", user=AO3_USER, cookie_jar=None, session=None,
+        throttle=None, base_url=AO3_URL, instruments=None,
+        metrics_file=None):
     """
     Main reader for ao3. Start with first page, then see how many pages.
     Get stats on each page.
     Compare with old stats, if any. Report deltas.
+    A tenant run passes in its own cookie_jar, and a session and
+    throttle shared with the other tenants of the process, and a
+    benchmark the base_url of a stand-in server.
+    The timings of the run are saved with it, and metrics_file gets
+    the latest runs in the Prometheus text format.
     """
 
-    firefox_profile_folder = read_firefox_cookies.get_profile_folder()
-    cjar = read_firefox_cookies.get_cookie_jar(firefox_profile_folder)
+    # pylint: disable=too-many-arguments, too-many-locals
+
+    cjar = cookie_jar
+    if cjar is None:
+        firefox_profile_folder = read_firefox_cookies.get_profile_folder()
+        cjar = read_firefox_cookies.get_cookie_jar(firefox_profile_folder)
 
     if cjar is False:
         sys.exit()
@@ -110,41 +198,34 @@ def main(db="dbs/readme.db"):
     logging.getLogger(
         'urllib3.connectionpool').setLevel(logging.ERROR)
 
+    if instruments is None:
+        instruments = Instruments()
     try:
-        works_page = "https://archiveofourown.org/users/RockSunner/works"
-        with PageGetter(cookie_jar=cjar) as pgetter:
-            # Note: will need to be able to plug in a name.
-            tree = pgetter.get_page(works_page)
-            find_navigation = \
-                etree.XPath('//ol[@class = "pagination actions"]/li/a')
-            page_nums = find_navigation(tree)
-            keys = []
-            for res in page_nums:
-                res_t = res.text_content()
-                if RepresentsInt(res_t):
-                    keys.append(int(res_t))
-                else:
-                    break
-
-            scraper = Ao3Scraper()
-            recs = []
-
-            scraper.parse_tree(tree, recs)
-
-            for key in keys:
-                payload = {"page": key}
-                tree = pgetter.get_page(works_page, payload)
-                scraper.parse_tree(tree, recs)
+        works_page = "{0}/users/{1}/works".format(base_url, user)
+        if throttle is None:
+            throttle = HostThrottle(AO3_MIN_INTERVAL, AO3_MAX_CONCURRENT)
+        with instruments.active(), PageGetter(
+                session=session, cookie_jar=cjar,
+                throttle=throttle) as pgetter:
+            with instruments.phase("works"):
+                recs = crawl_works(pgetter, works_page)
 
             report_gen = ReportGen("A03")
             with ReadMeDb(db, echo=False) as read_db:
-                for rec in recs:
-                    story = read_db.get_or_create_ao3_story(rec["title"])
-                    changed = compare_ao3_rec(story, rec, report_gen)
-                    if "kudos" in changed:
-                        eprint("Could look up kudos here")
+                with instruments.watch(read_db), \
+                        instruments.phase("update"):
+                    changes = update_ao3_stories(recs, read_db, report_gen)
+                if any(change.field == 'kudos' for change in changes):
+                    eprint("Could look up kudos here")
                 report_gen.print_report()
+                run = read_db.log_changes(report_gen.events(), source="ao3")
+                if instruments.enabled:
+                    read_db.log_metrics(run, instruments.rows())
                 read_db.set_commit_flag()
+                if metrics_file:
+                    read_db.session.flush()
+                    export_prometheus(read_db, metrics_file)
+            instruments.report()
 
             pgetter.stop_sleep()
 
@@ -152,7 +233,9 @@ def main(db="dbs/readme.db"):
             eprint("ConnectionRefused to archiveofourown.org", exc)
     except ConnectionAbortedError as exc:
             eprint("Connection problem", exc)
-    except Exception as exc:
+    except SQLAlchemyError as exc:
+        eprint("Database error, the ao3 changes were not saved", exc)
+    except OSError as exc:
         eprint("Cannot connect to archiveofourown.org", exc)
 
 
@@ -7,6 +7,7 @@ up to date on the hits their stories are getting.
 
 import sys
 import logging
+import datetime
 # import dyrm.read_firefox_cookies
 from dyrm.eprint import eprint
 from dyrm.ffgetter import PageGetter, FanfictionGetter, FanfictionScraper
@@ -41,30 +42,34 @@ def do_legacy_story_page(getter, read_db, scraper=None, report_gen=None):
     return favs_to_update, follows_to_update
 
 
-def compare_legacy_recs(db_rec, current_rec, read_db, report_gen):
+def compare_legacy_recs(db_dict, current_rec, read_db, report_gen):
     """
-    Find all the numeric differences between the old db rec
-    and the current rec we scraped from the site
+    Find all the numeric differences between the stored counts
+    and the current rec we scraped from the site. The db record
+    is only loaded for a story that changed.
     """
     tests = [
         'chaps', 'reviews',
         'views', 'c2s', 'favs', 'alerts']
     current_dict = current_rec._asdict()
-    if not db_rec:
+    db_rec = None
+    if db_dict is None:
         db_rec = read_db.create_empty_legacy(current_rec.ref)
-    db_dict = db_rec.__dict__
+        db_dict = {}
     for value_key in tests:
         if report_gen.compare_and_print(
                 current_rec.title,
                 value_key,
                 current_dict,
-                db_dict, extra="legacy "):
+                db_dict, level="legacy"):
+            if db_rec is None:
+                db_rec = read_db.get_or_create_legacy(current_rec.ref)
             setattr(db_rec, value_key, current_dict[value_key])
 
 
 def compare_legacy_recs_to_db(legacy_recs, read_db, report_gen):
     """ Query the database for old information, and compare to the latest """
-    legacy_query_dict = read_db.get_legacy_table_dict()
+    legacy_query_dict = read_db.get_legacy_values()
     legacy_rec_dict = dict((x.ref, x) for x in legacy_recs)
     fav_counts = read_db.get_fav_counts()
     fav_dict = dict((x[0], x[1]) for x in fav_counts)
@@ -80,8 +85,9 @@ def compare_legacy_recs_to_db(legacy_recs, read_db, report_gen):
     favs_to_update = []
     follows_to_update = []
     for key in legacy_rec_dict.keys():
-        rec = legacy_query_dict.get(key, None)
-        if rec is not None:
+        # The stored counts are now the current ones
+        if key in legacy_query_dict:
+            rec = legacy_rec_dict[key]
             favs = fav_dict.get(key, 0)
             follows = follow_dict.get(key, 0)
             if rec.favs != favs:
@@ -213,14 +219,13 @@ def report_ff_change(
     """ Message to log """
     if web_dict is None:
         web_dict = {}
-    message = "'{0}' {1} ".format(title, detail)
+    unknown = []
     for code in user_set:
         user = read_db.get_or_create_user(code, "Unknown")
-        # This times out too much. Make a separate utility
-        # to run periodically.
-        # if user.country == "Unknown":
-        #     country = getter.get_user_country(code)
-        #     user.country = country
+        # Looking the country up here times out too much, so queue
+        # it for update_user_countries to do later.
+        if user.country == "Unknown":
+            unknown.append(code)
         if user.aliases:
             alias = user.aliases[0].name
         else:
@@ -228,12 +233,13 @@ def report_ff_change(
             if alias != "New User":
                 read_db.get_or_create_alias(code, alias)
 
-        user_part =\
-            "'{0}' from '{1}' ({2:d})".format(alias, user.country, code)
-        report_gen.line_to_report(title, message + user_part)
+        report_gen.report_user(
+            title, detail, alias, user.country, code, ref=ref)
 
         ff_details_to_db(detail, ref, code, read_db.session)
 
+    read_db.enqueue_countries(unknown, datetime.datetime.now())
+
 
 def check_fav_follow_changes(
         favs_to_update, follows_to_update, read_db, getter, report_gen):
@@ -329,6 +335,7 @@ def main(db="dbs/readme.db"):
                     read_db, getter, report_gen)
 
                 report_gen.print_report()
+                read_db.log_changes(report_gen.events(), source="legacy")
                 read_db.set_commit_flag()
 
             pgetter.stop_sleep()
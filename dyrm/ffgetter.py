@@ -4,6 +4,7 @@
 Page getter for Fanfiction.net
 """
 import re
+import time
 import datetime
 from collections import namedtuple
 import threading
@@ -13,6 +14,9 @@ import requests
 import traceback
 import logging
 from dyrm.eprint import eprint
+from dyrm.records import RecordTable
+from dyrm.instruments import current, timed
+from dyrm.sites import FFN_URL
 
 # Separate page getter from information scraper.
 # Law of Demeter, and easier mocking when we just want to
@@ -25,14 +29,25 @@ def sleeper():
 
 
 class PageGetter:
-    """ Encapsulate a http page getter with a built-in delay """
+    """
+    Encapsulate a http page getter with a built-in delay.
+    With a HostThrottle, the throttle spaces out the requests
+    instead, and get_page may be called from several threads.
+    Each get is timed by the instruments, those of the thread that
+    made the getter if none are given.
+    """
 
     # pylint: disable=too-many-instance-attributes
 
     # Sleeping thread
     old_sleeper = None
 
-    def __init__(self, session=None, cookie_jar=None, delay=8.0, timeout=18.0):
+    def __init__(
+            self, session=None, cookie_jar=None, delay=8.0, timeout=18.0,
+            throttle=None, instruments=None):
+
+        # pylint: disable=too-many-arguments
+
         if session is None:
             self.session = requests.Session()
             self.is_own_session = True
@@ -44,6 +59,8 @@ class PageGetter:
         self.cjar = cookie_jar
         self.delay = delay
         self.timeout = timeout
+        self.throttle = throttle
+        self.instruments = instruments or current()
         self.response = None
 
     def __enter__(self):
@@ -68,58 +85,91 @@ class PageGetter:
         if payload is None:
             payload = {}
 
+        start = time.perf_counter()
+        if self.throttle is not None:
+            with self.throttle:
+                return self.fetch_tree(
+                    page, payload, time.perf_counter() - start)
+
         # Make sure we have waited long enough before going for a new page.
         active_count = threading.active_count();
         if active_count > 1 and self.old_sleeper is not None:
             self.old_sleeper.join()
             self.old_sleeper = None
+        wait = time.perf_counter() - start
 
         # Start a sleeper so we can delay our access to the
         # next page. Need to wait about 7 seconds to obey the rules.
         self.old_sleeper = threading.Timer(self.delay, sleeper)
         self.old_sleeper.start()
+        return self.fetch_tree(page, payload, wait)
+
+    def fetch_tree(self, page, payload, wait=0.0):
+        """
+        Fetch a page right away and parse it. Wait is how long the
+        get waited for its turn, for the instruments.
+        """
 
         # Try to make connections less noisy here.
         logging.getLogger(
             'urllib3.connectionpool').setLevel(logging.ERROR)
 
+        instruments = self.instruments
+        start = time.perf_counter()
         try:
-            self.response = self.session.get(
+            response = self.session.get(
                 page,
                 timeout=self.timeout,
                 cookies=self.cjar,
                 params=payload)
         except requests.exceptions.Timeout as exc:
+            instruments.page(
+                page, wait, time.perf_counter() - start, 0.0, 0, 'timeout')
             eprint("Page:", page, "Payload:", payload)
             eprint("Timeout problem", exc)
             raise ConnectionAbortedError('Timeout')
         except Exception:
+            instruments.page(
+                page, wait, time.perf_counter() - start, 0.0, 0, 'error')
             logger = logging.getLogger(__name__)
             logger.error(traceback.format_exc())
             raise ConnectionAbortedError('Catch-all')
-
-        if self.response.status_code != requests.codes.ok:
-            raise ConnectionRefusedError(self.response)
+        self.response = response
+        if instruments.enabled:
+            # Elapsed runs to the parsed headers; the body is read after
+            ttfb = response.elapsed.total_seconds()
+            instruments.page(
+                page, wait, ttfb,
+                max(0.0, time.perf_counter() - start - ttfb),
+                len(response.content), response.status_code)
+
+        if response.status_code != requests.codes.ok:
+            raise ConnectionRefusedError(response)
 
         # Check for logged out page.
-        if 'You must be logged in' in self.response.text:
+        if 'You must be logged in' in response.text:
             raise ConnectionRefusedError('Not logged in')
 
-        return html.fromstring(self.response.content)
+        with instruments.timer('parse', 'html'):
+            return html.fromstring(response.content)
 
 
 class FanfictionGetter:
-    """ Encapsulate a connection to fanfiction.net """
+    """
+    Encapsulate a connection to fanfiction.net, or to a stand-in
+    for it at base_url.
+    """
 
-    def __init__(self, pgetter):
+    def __init__(self, pgetter, base_url=FFN_URL):
         self.pgetter = pgetter
+        self.base_url = base_url
 
     def get_old_story_eyes_tree(self, month, year):
         """
             Load the old story eyes tree (monthly story info),
             which also works for individual stories and chapters.
         """
-        page = 'https://www.fanfiction.net/stats/story_eyes.php'
+        page = self.base_url + '/stats/story_eyes.php'
         payload = {'month': month, 'year': year}
         old_story_eyes_tree = self.pgetter.get_page(page, payload)
         return old_story_eyes_tree
@@ -129,33 +179,33 @@ class FanfictionGetter:
             Load the story eyes tree (monthly story info),
             which also works for individual stories and chapters.
         """
-        page = 'https://www.fanfiction.net/stats/story_eyes.php'
+        page = self.base_url + '/stats/story_eyes.php'
         story_eyes_tree = self.pgetter.get_page(page, payload)
         return story_eyes_tree
 
     def get_legacy_tree(self):
         """ Get the legacy story page """
-        page = 'https://www.fanfiction.net/stats/story.php'
+        page = self.base_url + '/stats/story.php'
         payload = {}
         legacy_tree = self.pgetter.get_page(page, payload)
         return legacy_tree
 
     def get_legacy_part(self, ref, part):
         """ Get the legacy part stats (fav or follow) page for a story """
-        page = 'https://www.fanfiction.net/stats/part.php'
+        page = self.base_url + '/stats/part.php'
         payload = {'storyid': ref, 'part': part}
         return self.pgetter.get_page(page, payload)
 
     def get_comment_tree(self, ref):
         """ Get opening comments page for a story """
-        page = 'https://www.fanfiction.net/' + ref
+        page = self.base_url + '/' + ref
         return self.pgetter.get_page(page)
 
     def get_chapters_tree(self, ref, payload=None):
         """
             Get chapters for one story. Payload can specify the date.
         """
-        page = 'https://www.fanfiction.net/stats/story_eyes_story.php'
+        page = self.base_url + '/stats/story_eyes_story.php'
         if payload is None:
             payload = {'storyid': ref}
         else:
@@ -166,7 +216,7 @@ class FanfictionGetter:
     def get_chapter_single(self, ch_ref, month=None, year=None):
         """ Get a single chapter page """
 
-        page = 'https://www.fanfiction.net/stats/story_eyes_chapter.php'
+        page = self.base_url + '/stats/story_eyes_chapter.php'
         payload = {
             'storytextid': ch_ref}
         if month:
@@ -179,7 +229,7 @@ class FanfictionGetter:
     def get_favme(self):
         """ Get user favs page """
 
-        page = 'https://www.fanfiction.net/stats/user.php'
+        page = self.base_url + '/stats/user.php'
         payload = {'action': 'favs'}
         tree = self.pgetter.get_page(page, payload)
         return tree
@@ -187,14 +237,14 @@ class FanfictionGetter:
     def get_followme(self):
         """ Get user alerts page """
 
-        page = 'https://www.fanfiction.net/stats/user.php'
+        page = self.base_url + '/stats/user.php'
         payload = {'action': 'alerts'}
         tree = self.pgetter.get_page(page, payload)
         return tree
 
     def get_user_profile_tree(self, code):
         """ Get the user profile page """
-        page = "https://www.fanfiction.net/u/" + str(code)
+        page = self.base_url + "/u/" + str(code)
         tree = self.pgetter.get_page(page)
         return tree
 
@@ -211,11 +261,22 @@ class FanfictionGetter:
 
 
 class FanfictionScraper:
-    """ Encapsulate scraping of data from fanfiction.net """
+    """
+    Encapsulate scraping of data from fanfiction.net. The calls that
+    parse a page are timed by the instruments of the thread, if any.
+    """
 
     # pylint: disable=too-many-instance-attributes
+    # pylint: disable=attribute-defined-outside-init
 
     def __init__(self):
+        self.release()
+
+    def release(self):
+        """
+        Start over with fresh parsers. The old ones hold the elements
+        they found on the last page, which keeps its whole tree alive.
+        """
         self.month_story_rows_parser = MonthStoryRowsParser()
         self.month_chapter_rows_parser = MonthChapterRowsParser()
         self.month_caption_parser = MonthCaptionParser()
@@ -226,6 +287,7 @@ class FanfictionScraper:
         self.user_prof_parser = UserProfParser()
         self.user_comment_parser = UserCommentParser()
 
+    @timed('parse')
     def get_month_story_rows(self, eyes_tree):
         """ Get rows for all stories from the monthly story table """
 
@@ -249,16 +311,19 @@ class FanfictionScraper:
             (x.ref, TitleRec(ref=x.ref, title=x.title))
             for x in month_story_rows)
 
+    @timed('parse')
     def get_month_menu(self, eyes_tree):
         """ Get menu of months """
         self.month_menu_parser.set_tree(eyes_tree)
         return self.month_menu_parser.get_menu()
 
+    @timed('parse')
     def get_month_latest(self, eyes_tree):
         """ Get latest month on menu """
         self.month_menu_parser.set_tree(eyes_tree)
         return self.month_menu_parser.get_month_latest()
 
+    @timed('parse')
     def get_month_caption(self, eyes_tree):
         """ Get caption of monthly page """
         self.month_caption_parser.set_tree(eyes_tree)
@@ -270,26 +335,31 @@ class FanfictionScraper:
         month_caption = self.get_month_caption(eyes_tree)
         return month_caption.month, month_caption.year
 
+    @timed('parse')
     def get_comments(self, comment_tree):
         """ Get comment rows from page """
         self.user_comment_parser.set_tree(comment_tree)
         return self.user_comment_parser.get_comments()
 
+    @timed('parse')
     def get_legacy(self, legacy_tree):
         """ Get rows of legacy table """
         self.legacy_parser.set_tree(legacy_tree)
         return self.legacy_parser.get_rows()
 
+    @timed('parse')
     def get_legacy_titles(self, legacy_tree):
         """ Get title records from legacy table """
         self.legacy_parser.set_tree(legacy_tree)
         return self.legacy_parser.get_titles()
 
+    @timed('parse')
     def get_legacy_part(self, part_tree):
         """ Get rows of favs or follows, with user codes """
         self.user_parser.set_tree(part_tree)
         return self.user_parser.get_users()
 
+    @timed('parse')
     def get_monthly_visits(self, eyes_tree):
         """ Get number of montly visits """
         self.visitor_parser.set_tree(eyes_tree)
@@ -297,6 +367,7 @@ class FanfictionScraper:
         by_country = self.visitor_parser.get_visits(1)
         return by_date, by_country
 
+    @timed('parse')
     def get_chapters_mcap(self, chap_tree):
         """ Get month caption for chapters of one story """
 
@@ -304,6 +375,7 @@ class FanfictionScraper:
         self.month_caption_parser.set_tree(chap_tree)
         return self.month_caption_parser.get_caption()
 
+    @timed('parse')
     def get_chapters_visits(self, chap_tree):
         """ Get visitors for chapters of one story """
 
@@ -313,6 +385,7 @@ class FanfictionScraper:
         by_country = self.visitor_parser.get_visits(1)
         return by_date, by_country
 
+    @timed('parse')
     def get_chapters_rows(self, chap_tree):
         """ Get table rows for chapters of one story """
 
@@ -321,6 +394,7 @@ class FanfictionScraper:
         mparse2.set_tree(chap_tree)
         return mparse2.get_rows()
 
+    @timed('parse')
     def get_chapter_single(self, single_tree):
         """ Get visitor tables for a single chapter """
 
@@ -329,12 +403,14 @@ class FanfictionScraper:
         by_country = self.visitor_parser.get_visits(1)
         return by_country
 
+    @timed('parse')
     def get_users(self, user_tree):
         """ Get the user names and ids from a table of favs or follows """
 
         self.user_parser.set_tree(user_tree)
         return self.user_parser.get_users()
 
+    @timed('parse')
     def get_user_country(self, user_ptree):
         """ Get the country from the flag on the user page, if any """
         self.user_prof_parser.set_tree(user_ptree)
@@ -386,14 +462,14 @@ class LegacyTableParser:
 
     def get_rows(self):
         """ Get a record from the table row """
-        recs = []
+        recs = RecordTable(LegacyRec, text_fields=('title',))
         for row in self.rows:
             href1 = row[0][0].get("href")
             href = 0
             match = re.search(self.storyid_pattern, href1)
             if match:
                 href = int(match.group(1))
-            rec = LegacyRec(
+            recs.append(
                 ref=href,
                 title=row[0].text_content().strip(),
                 words=uncomma(row[1].text_content()),
@@ -403,7 +479,6 @@ class LegacyTableParser:
                 c2s=uncomma(row[5].text_content()),
                 favs=uncomma(row[6].text_content()),
                 alerts=uncomma(row[7].text_content()))
-            recs.append(rec)
         return recs
 
 
@@ -439,21 +514,21 @@ class VisitorChartParser:
         Extract categories, views, and visitor counts from
         script embedded xml
         """
+        recs = RecordTable(VisCounter, text_fields=('cat',))
         if num >= len(self.charts):
-            return []
+            return recs
 
         script = self.charts[num]
-        cats = []
-        views = []
-        visitors = []
         match = re.search(self.xml_pattern, script.text_content())
         if match:
             chart_xml = match.group(1)
             chart_tree = etree.fromstring(chart_xml.replace('\\', ''))
-            cats = [item.get("label") for item in chart_tree[0]]
-            views = [uncomma(item.get("value")) for item in chart_tree[1]]
-            visitors = [uncomma(item.get("value")) for item in chart_tree[2]]
-        return [VisCounter(*item) for item in zip(cats, views, visitors)]
+            for row in zip(
+                    (item.get("label") for item in chart_tree[0]),
+                    (uncomma(item.get("value")) for item in chart_tree[1]),
+                    (uncomma(item.get("value")) for item in chart_tree[2])):
+                recs.append(*row)
+        return recs
 
 
 MonthMenuRec = namedtuple(
@@ -541,17 +616,16 @@ class MonthStoryRowsParser:
             return False
         combined = zip(self.story_rows, self.story_href)
 
-        recs = []
+        recs = RecordTable(MonthlyStoryRec, text_fields=('title',))
         for row, href in combined:
             cols = row.text_content().split("\n")
             sref = self.ref_from_href(href)
             recs.append(
-                MonthlyStoryRec(
-                    ref=sref,
-                    title=cols[1].strip(),
-                    words=uncomma(cols[2]),
-                    views=uncomma(cols[3]),
-                    visitors=uncomma(cols[4])))
+                ref=sref,
+                title=cols[1].strip(),
+                words=uncomma(cols[2]),
+                views=uncomma(cols[3]),
+                visitors=uncomma(cols[4]))
         return recs
 
 
@@ -644,15 +718,14 @@ class UserParser:
             return False
         combined = zip(self.user_rows, self.user_href)
 
-        recs = []
+        recs = RecordTable(UserRec, text_fields=('alias', 'date_added'))
         for row, href in combined:
             ref = self.ref_from_href(href)
             cols = row.text_content().split("\n")
-            new_rec = UserRec(
+            recs.append(
                 id=ref,
                 alias=cols[1].strip(),
                 date_added=cols[2].strip())
-            recs.append(new_rec)
         return recs
 
 
@@ -801,18 +874,17 @@ class MonthChapterRowsParser:
             return False
         combined = zip(self.chapter_rows, self.chapter_href)
 
-        recs = []
+        recs = RecordTable(MonthlyChapterRec, text_fields=('title',))
         for row, href in combined:
             ref = self.ref_from_href(href)
             cols = row.text_content().split("\n")
-            new_rec = MonthlyChapterRec(
+            recs.append(
                 ch_ref=ref,
                 num=uncomma(cols[1]),
                 title=cols[2].strip(),
                 words=uncomma(cols[3]),
                 views=uncomma(cols[4]),
                 visitors=uncomma(cols[5]))
-            recs.append(new_rec)
         return recs
 
 
@@ -10,11 +10,22 @@ totals.
 
 import sys
 import logging
+from collections import namedtuple
 import dyrm.read_firefox_cookies as read_firefox_cookies
 from dyrm.eprint import eprint
 from dyrm.ffgetter import PageGetter, FanfictionGetter, FanfictionScraper
+from dyrm.ffgetter import MonthlyChapterRec
+from dyrm.sites import FFN_URL
 from dyrm.readme_db import ReadMeDb
+from dyrm.monthdiff import ChangeSet, diff_snapshot
+from dyrm.monthdiff import key_signatures, level_digest, moved_keys
+from dyrm.records import keyed
 from dyrm.reportgen import ReportGen, print_divider
+from dyrm.reportsink import ReportSink, open_report_stream
+from dyrm.memreport import PhaseMemory
+from dyrm.instruments import Instruments, current, export_prometheus
+from dyrm.profiling import NO_PROFILER
+from dyrm.queryaudit import QueryAuditor
 import dyrm.do_you_read_me as doyouread
 
 # Since the monthly structure is now going to be its own thing,
@@ -37,9 +48,15 @@ class MonthlySetup:
     4) Eventually, could allow for a mult-month skip.
     """
 
-    def __init__(self, read_db, catchup=False):
+    def __init__(
+            self, read_db, catchup=False, chapter_budget=None, memory=None):
         self.last_month = read_db.get_last_month()
         self.catchup = catchup
+        # Both trees of a month cross-over share one fetch budget.
+        self.chapter_queue = ChapterQueue(chapter_budget)
+        if memory is None:
+            memory = PhaseMemory(enabled=False)
+        self.memory = memory
 
     def is_bootstrap(self):
         """
@@ -83,19 +100,94 @@ class MonthlySetup:
                 month=month, year=year, mid=old_mid + 1)
             report_gen.set_catchup(self.catchup)
             mtree = MonthlyDataTree(
-                getter, new_month, eyes_tree, report_gen)
+                getter, new_month, eyes_tree, report_gen,
+                chapter_queue=self.chapter_queue, memory=self.memory)
+            old_gen = report_gen.sibling(
+                "Hits for {:02d}/{}".format(old_month, old_year),
+                catchup=False)
             mtree0 = MonthlyDataTree(
-                getter, self.last_month, eyes_tree=None, report_gen=None)
+                getter, self.last_month, eyes_tree=None, report_gen=old_gen,
+                chapter_queue=self.chapter_queue, memory=self.memory)
             return [mtree0, mtree]
         else:
             # Simple data tree case -- current month is good.
             report_gen.set_catchup(self.catchup)
             mtree = MonthlyDataTree(
                 getter, self.last_month,
-                eyes_tree, report_gen)
+                eyes_tree, report_gen,
+                chapter_queue=self.chapter_queue, memory=self.memory)
             return [mtree]
 
 
+def purge_closed_months(read_db, mid):
+    """
+    Drop the chapter pages put off in months before this one; the
+    runs from now on only crawl this month.
+    """
+    dropped = read_db.purge_chapters_pending(mid)
+    if dropped:
+        logger = logging.getLogger(__name__)
+        logger.info(
+            "{} chapter pages of closed months dropped".format(dropped))
+
+
+ChapterTask = namedtuple(
+    'ChapterTask',
+    ['ref', 'title', 'chapter', 'delta', 'deferred', 'latest'])
+
+
+class ChapterQueue:
+    """
+    Chapters that changed and need their single-chapter country page.
+    Each of those pages costs another throttled request, so the queue
+    ranks them and only hands out as many as the run budget allows.
+    Ranking is by size of the change, runs already put off (staleness)
+    and whether it is the latest chapter of its story (recency).
+    """
+
+    stale_weight = 5
+    latest_weight = 5
+
+    def __init__(self, budget=None):
+        self.remaining = budget
+        self.tasks = {}
+
+    def add(self, ref, title, chapter, delta, deferred=0, latest=False):
+        """ Queue a chapter, merging with any entry already queued """
+
+        # pylint: disable=too-many-arguments
+
+        key = (ref, int(chapter.num))
+        old = self.tasks.get(key)
+        if old:
+            delta += old.delta
+            deferred = max(deferred, old.deferred)
+            latest = latest or old.latest
+        self.tasks[key] = ChapterTask(
+            ref, title, chapter, delta, deferred, latest)
+
+    def priority(self, task):
+        """ Higher values get fetched first """
+        score = task.delta + self.stale_weight * task.deferred
+        if task.latest:
+            score += self.latest_weight
+        return score
+
+    def split(self):
+        """
+        Empty the queue into the tasks to fetch now, best first,
+        and the tasks to put off to a later run.
+        """
+        ranked = sorted(
+            self.tasks.values(), key=self.priority, reverse=True)
+        self.tasks = {}
+        if self.remaining is None:
+            return ranked, []
+        now = ranked[:self.remaining]
+        self.remaining -= len(now)
+        return now, ranked[len(now):]
+
+
 class MonthlyDataTree:
     """
     Manage and update information in the database:
@@ -108,7 +200,7 @@ class MonthlyDataTree:
     def __init__(
             self, getter, month_rec,
             eyes_tree=None, report_gen=None,
-            monthly_gen=None, delay=8):
+            monthly_gen=None, delay=8, chapter_queue=None, memory=None):
 
         # pylint: disable=too-many-arguments
 
@@ -118,8 +210,9 @@ class MonthlyDataTree:
         self.delay = delay
         self.catchup = False
 
-        if eyes_tree is None:
-            eyes_tree = getter.get_old_story_eyes_tree(self.month, self.year)
+        # Without a page, the old month's page is only fetched when
+        # this tree gets processed, so two month pages are never
+        # parsed at once. The page is dropped once read.
         self.eyes_tree = eyes_tree
 
         if report_gen is None:
@@ -128,34 +221,92 @@ class MonthlyDataTree:
                     self.month, self.year), catchup=self.catchup)
         self.report_gen = report_gen
         if monthly_gen is None:
-            monthly_gen = ReportGen(
+            monthly_gen = report_gen.sibling(
                 "Monthly changes for {}/{}".format(
                     self.month, self.year), catchup=self.catchup)
         self.monthly_gen = monthly_gen
+        if chapter_queue is None:
+            chapter_queue = ChapterQueue()
+        self.chapter_queue = chapter_queue
+        if memory is None:
+            memory = PhaseMemory(enabled=False)
+        self.memory = memory
         self.changed_story_set = set()
 
     def do_chapter_heirarchy(self, getter, scraper, read_db):
         """ Look for count updates in the monthly stories and chapters """
-        mcap, by_date, by_country, story_rows = \
-            do_story_eyes(scraper, self.eyes_tree)
+        phase = "{}/{} ".format(self.month, self.year)
+        instruments = current()
+        with self.memory.phase(phase + "story eyes"), \
+                instruments.phase("story eyes"):
+            if self.eyes_tree is None:
+                self.eyes_tree = getter.get_old_story_eyes_tree(
+                    self.month, self.year)
+            mcap, by_date, by_country, story_rows = \
+                do_story_eyes(scraper, self.eyes_tree)
+            self.eyes_tree = None
+            scraper.release()
 
         print_date_info(by_date)
 
-        self.check_caption_updates(mcap, read_db)
-        self.check_country_updates(by_country, read_db)
-        self.get_monthly_report().print_report()
-        self.check_story_updates(story_rows, read_db)
+        with self.memory.phase(phase + "story updates"), \
+                instruments.phase("story updates"):
+            self.check_caption_updates(mcap, read_db)
+            self.check_country_updates(by_country, read_db)
+            self.get_monthly_report().print_report()
+            self.check_story_updates(story_rows, read_db)
         chapter_list = read_db.get_checks_pending()
 
         # Data per changed chapter
-        my_report = self.get_report()
-        for sref, title in chapter_list:
-            _, _, _, _ =\
+        with self.memory.phase(phase + "chapters"), \
+                instruments.phase("chapters"):
+            for sref, title in chapter_list:
                 self.check_story_chapters(sref, title, getter, mcap, read_db)
+        with self.memory.phase(phase + "chapter details"), \
+                instruments.phase("chapter details"):
+            detail_titles = self.fetch_chapter_details(
+                getter, scraper, mcap, read_db)
+
+        my_report = self.get_report()
+        titles = set(title for _, title in chapter_list) | detail_titles
+        for title in sorted(titles):
             my_report.print_keyed_section(title)
 
         read_db.clear_checks_pending()
 
+    def fetch_chapter_details(self, getter, scraper, mcap, read_db):
+        """
+        Fetch single-chapter country pages in priority order,
+        including any put off by earlier runs, within the budget.
+        The rest are saved for a later run with their staleness.
+        Returns the titles of stories that got chapter details.
+        """
+        for pending in read_db.get_chapters_pending(self.mid):
+            chapter = MonthlyChapterRec(
+                ch_ref=pending.ch_ref, num=pending.chap,
+                title=pending.chapter.title, words=pending.chapter.words,
+                views=0, visitors=0)
+            self.chapter_queue.add(
+                pending.ref, pending.story.title, chapter,
+                pending.delta, deferred=pending.deferred)
+
+        now, later = self.chapter_queue.split()
+        for task in now:
+            self.do_single_chapter(
+                task.chapter, task.ref, task.title,
+                getter, scraper, read_db, mcap)
+            read_db.clear_chapter_pending(
+                self.mid, task.ref, int(task.chapter.num))
+        for task in later:
+            read_db.set_chapter_pending(
+                self.mid, task.ref, int(task.chapter.num),
+                task.chapter.ch_ref, task.delta, task.deferred + 1)
+        if later:
+            logger = logging.getLogger(__name__)
+            logger.info(
+                "{} chapter pages put off to a later run".format(len(later)))
+        return set(task.title for task in now)
+
     def check_caption_updates(self, mcap, read_db):
         """ Check overall counts in the monthly caption """
         top_rec = read_db.get_or_create_mtop(self.mid)
@@ -165,11 +316,11 @@ class MonthlyDataTree:
         changed += self.monthly_gen.compare_and_print(
             "Monthly", "views",
             mcap_dict,
-            new_rec, prefix="")
+            new_rec, level="total")
         changed += self.monthly_gen.compare_and_print(
             "Monthly", "visitors",
             mcap_dict,
-            new_rec, prefix="")
+            new_rec, level="total")
         if changed > 0:
             top_rec.views = mcap.views
             top_rec.visitors = mcap.visitors
@@ -179,43 +330,55 @@ class MonthlyDataTree:
     def check_story_updates(self, story_rows, read_db):
         """ Find out what stories need their chapters checked """
 
-        for story in story_rows:
-            # There might be a new story, or the start of a month.
-            new_rec = read_db.get_or_create_mstory(self.mid, story.ref)
-            new_dict = new_rec.__dict__
-            story_dict = story._asdict()
-
-            changed = self.report_gen.compare_and_print(
-                story.title, "views",
-                story_dict,
-                new_dict, prefix="")
-            changed = changed + \
-                self.report_gen.compare_and_print(
-                    story.title, "visitors",
-                    story_dict,
-                    new_dict, prefix="")
-            if changed > 0:
-                new_rec.views = story.views
-                new_rec.visitors = story.visitors
-                read_db.set_check_pending(story.ref)
-                self.changed_story_set.add(story.title)
+        # There might be a new story, or the start of a month.
+        current = keyed(story_rows, 'ref')
+        changes = diff_snapshot(current, read_db.get_mstory_values(self.mid))
+        for change in changes:
+            title = current[change.key].title
+            self.report_gen.report_change(
+                title, 'story', change, entity=title, ref=change.key)
+        changes.apply(
+            lambda ref: read_db.get_or_create_mstory(self.mid, ref))
+        for ref in changes.changed_keys():
+            read_db.set_check_pending(ref)
+            self.changed_story_set.add(current[ref].title)
+
+    @staticmethod
+    def diff_moved(read_db, scope, current, read_values):
+        """
+        Delta-only diff of one level. The scraped values are hashed
+        and checked against the signatures cached by the last run,
+        and read_values(keys) only reads the stored rows of keys that
+        moved. An unchanged level costs one small query and no rows.
+        With nothing cached, all the stored values are read
+        (read_values(None)).
+        """
+        signatures = key_signatures(current)
+        digest = level_digest(signatures)
+        cached = read_db.get_signatures(scope)
+        if cached is None:
+            changes = diff_snapshot(current, read_values(None))
+        elif cached[0] == digest:
+            return ChangeSet([], current)
+        else:
+            moved = moved_keys(current, signatures, cached[1])
+            changes = diff_snapshot(
+                dict((key, current[key]) for key in moved),
+                read_values(moved) if moved else {})
+        read_db.set_signatures(scope, digest, signatures)
+        return changes
 
     def check_country_updates(self, by_country, read_db):
         """ Compare top-level country totals for the month """
-        for country_rec in by_country:
-            country = country_rec.cat
-            country_dict = country_rec._asdict()
-            old_rec = read_db.get_or_create_mctry(self.mid, country)
-            old_dict = old_rec.__dict__
-            changed = self.monthly_gen.compare_totals_by_country(
-                country, "", "views",
-                country_dict, old_dict)
-            changed += self.monthly_gen.compare_totals_by_country(
-                country, "", "visitors",
-                country_dict, old_dict)
-            if changed > 0:
-                old_rec.views = country_rec.views
-                old_rec.visitors = country_rec.visitors
+        current = keyed(by_country, 'cat')
+        changes = self.diff_moved(
+            read_db, "mctry:{}".format(self.mid), current,
+            lambda keys: read_db.get_mctry_values(self.mid, keys))
+        for change in changes:
+            self.monthly_gen.report_change(
+                "Monthly", 'country', change, country=change.key)
+        changes.apply(
+            lambda country: read_db.get_or_create_mctry(self.mid, country))
 
     def check_country_totals_for_story(
             self, sref, s_title, by_country, read_db):
@@ -224,20 +387,17 @@ class MonthlyDataTree:
         with previous totals, if any. Record new totals and add
         lines about any changes to the report.
         """
-        for country_rec in by_country:
-            country = country_rec.cat
-            country_dict = country_rec._asdict()
-            old_rec = read_db.get_or_create_mstoryctry(self.mid, sref, country)
-            old_dict = old_rec.__dict__
-            changed = self.report_gen.compare_story_by_country(
-                s_title, country, "", "views",
-                country_dict, old_dict)
-            changed += self.report_gen.compare_story_by_country(
-                s_title, country, "", "visitors",
-                country_dict, old_dict)
-            if changed > 0:
-                old_rec.views = country_rec.views
-                old_rec.visitors = country_rec.visitors
+        current = keyed(by_country, 'cat')
+        changes = self.diff_moved(
+            read_db, "mstoryctry:{}:{}".format(self.mid, sref), current,
+            lambda keys: read_db.get_mstoryctry_values(self.mid, sref, keys))
+        for change in changes:
+            self.report_gen.report_change(
+                s_title, 'story_country', change,
+                entity=s_title, ref=sref, country=change.key)
+        changes.apply(
+            lambda country: read_db.get_or_create_mstoryctry(
+                self.mid, sref, country))
 
     def check_story_chapters(self, sref, s_title, getter, mcap, read_db):
         """
@@ -251,42 +411,68 @@ class MonthlyDataTree:
         scraper = FanfictionScraper()
         mcap2 = scraper.get_chapters_mcap(ch_tree)
         by_date, by_country = scraper.get_chapters_visits(ch_tree)
+        chapter_rows = scraper.get_chapters_rows(ch_tree)
+        # Only plain records from here on; the page can go.
+        del ch_tree, scraper
+
         # Note - at this point the monthly checker has the
         # views and visitors by country for the story.
-        # It would be appropriate to store and report changes here.
-        # Pass the sref and the by_country to a save/report routine.
         self.check_country_totals_for_story(sref, s_title, by_country, read_db)
-        chapter_rows = scraper.get_chapters_rows(ch_tree)
+        db_chapters = read_db.get_chapters_dict(sref)
         for chapter in chapter_rows:
-            chapter_rec = read_db.get_or_create_chapter(sref, chapter)
+            chapter_rec = db_chapters.get(chapter.ch_ref)
+            if chapter_rec is None:
+                chapter_rec = read_db.get_or_create_chapter(sref, chapter)
             if chapter_rec.title != chapter.title:
                 logger = logging.getLogger(__name__)
                 logger.info(
                     "chapter title changed to {}".format(chapter.title))
                 chapter_rec.title = chapter.title
-            db_rec = read_db.get_or_create_mchap(self.mid, sref, chapter.num)
-
-            changed_recs = []
-            compare_chapter_recs(
-                db_rec, s_title, chapter, self.report_gen, changed_recs)
-            for chapter in changed_recs:
-                self.do_single_chapter(
-                    chapter, sref, s_title, getter, scraper, read_db, mcap)
+
+        current = keyed(chapter_rows, 'num')
+        changes = diff_snapshot(
+            current, read_db.get_mchap_values(self.mid, sref))
+        for change in changes:
+            chapter = current[change.key]
+            self.report_gen.report_change(
+                s_title, 'chapter', change,
+                entity=chapter.title, ref=sref, chap=change.key)
+        changes.apply(
+            lambda num: read_db.get_or_create_mchap(self.mid, sref, num))
+
+        # Single-chapter pages are fetched later, best first.
+        deltas = {}
+        for change in changes:
+            deltas[change.key] = deltas.get(change.key, 0) + abs(change.delta)
+        latest = max(current) if current else None
+        for num, delta in deltas.items():
+            self.chapter_queue.add(
+                sref, s_title, current[num], delta, latest=(num == latest))
         return (mcap2, by_date, by_country, chapter_rows)
 
     def do_single_chapter(
             self, chapter, sref, s_title, getter, scraper, read_db, mcap):
         """ Get chapter by chapter changes """
+
+        # pylint: disable=too-many-arguments
+
         single_tree = getter.get_chapter_single(
             chapter.ch_ref, month=mcap.month, year=mcap.year)
         by_ch_country = scraper.get_chapter_single(single_tree)
-        for ch_country_rec in by_ch_country:
-            country = ch_country_rec.cat
-            db_ch_rec = read_db.get_or_create_chapctry(
-                self.mid, sref, chapter.num, country)
-            compare_chap_country_recs(
-                ch_country_rec, s_title,
-                db_ch_rec, chapter, self.report_gen)
+        del single_tree
+        scraper.release()
+        num = int(chapter.num)
+        current = keyed(by_ch_country, 'cat')
+        changes = diff_snapshot(
+            current, read_db.get_chapctry_values(self.mid, sref, num))
+        for change in changes:
+            self.report_gen.report_change(
+                s_title, 'chapter_country', change,
+                entity=chapter.title, ref=sref, chap=num,
+                country=change.key)
+        changes.apply(
+            lambda country: read_db.get_or_create_chapctry(
+                self.mid, sref, num, country))
 
     def get_report(self):
         """ Access report """
@@ -318,58 +504,6 @@ def print_story_rows(story_rows):
     print_divider()
 
 
-def compare_chap_country_recs(
-        current_rec, s_title, db_rec, chapter, report_gen):
-    """ Find numeric differences at the country chapter level """
-    country = current_rec.cat
-    current_dict = current_rec._asdict()
-    db_dict = db_rec.__dict__
-    if report_gen.compare_and_print_ctry_chapter(
-            country,
-            s_title,
-            int(chapter.num),
-            chapter.title,
-            "",
-            'views',
-            current_dict, db_dict):
-            db_rec.views = current_dict['views']
-    if report_gen.compare_and_print_ctry_chapter(
-            country,
-            s_title,
-            int(chapter.num),
-            chapter.title,
-            "",
-            'visitors',
-            current_dict, db_dict):
-            db_rec.visitors = current_dict['visitors']
-
-
-def compare_chapter_recs(
-        db_rec, s_title, current_rec, report_gen, changed_recs):
-    """
-    Find all the numeric differences between the old db rec
-    and the current chapter rec we scraped from the site
-    """
-    tests = [
-        'views', 'visitors']
-    current_dict = current_rec._asdict()
-    db_dict = db_rec.__dict__
-    changed = False
-    for value_key in tests:
-        if report_gen.compare_and_print_chapter(
-                s_title,
-                int(current_rec.num),
-                current_rec.title,
-                "",
-                value_key,
-                current_dict, db_dict):
-            setattr(db_rec, value_key, current_dict[value_key])
-            changed = True
-
-    if changed:
-        changed_recs.append(current_rec)
-
-
 def do_story_eyes(scraper, eyes_tree, mtop=None):
     """
     Process the starting page, "story_eyes.php"
@@ -412,79 +546,183 @@ def print_date_info(by_date):
     print_divider()
 
 
-def main(db, nomonth=False, delay=8.0, timeout=18.0):
-    """ Main driver """
+def log_report_changes(db, reports, started, instruments=None):
+    """
+    Save the change events of all the reports of a run, and the
+    summary of its instruments, if enabled. Returns the run number.
+    """
+    events = []
+    seen = set()
+    for report in reports:
+        if id(report) not in seen:
+            seen.add(id(report))
+            events.extend(report.events())
+    with ReadMeDb(db, echo=False) as read_db:
+        run = read_db.log_changes(
+            events, source="fanfiction", started=started)
+        if instruments is not None and instruments.enabled:
+            read_db.log_metrics(run, instruments.rows())
+        read_db.set_commit_flag()
+        return run.run
+
+
+def finish_run(db, reports, started, instruments, metrics_file):
+    """ Log the changes and timings of a run, and export the timings """
+    log_report_changes(db, reports, started, instruments)
+    instruments.report()
+    if metrics_file:
+        with ReadMeDb(db, echo=False) as read_db:
+            export_prometheus(read_db, metrics_file)
+
+
+def main(
+        db, nomonth=False, delay=8.0, timeout=18.0, chapter_budget=None,
+        json_report=None, html_report=None, top=None, detail=False,
+        report_file=None, report_stream=None, mem_report=False,
+        cookie_jar=None, session=None, throttle=None, base_url=FFN_URL,
+        instruments=None, metrics_file=None, profiler=NO_PROFILER,
+        query_audit=False):
+    """
+    Main driver. With top set, the report ends with a summary of
+    the top movers and only prints every change if detail is set.
+    With report_file, finished sections stream out to a ReportSink
+    there (and to report_stream, if given) instead of staying in memory.
+    mem_report logs the memory use of each phase at the end.
+    A tenant run passes in its own cookie_jar, and a session and
+    throttle shared with the other tenants of the process. base_url
+    points the run at a stand-in for the site.
+    The timings of the run are saved with it; metrics_file gets the
+    latest runs in the Prometheus text format. The profiler profiles
+    the legacy and monthly phases it was asked for. query_audit logs
+    the statements of the run by code location, and the likely N+1
+    loops, at the end.
+    """
 
     # pylint: disable=too-many-locals, too-many-statements
+    # pylint: disable=too-many-arguments
 
     import datetime
     now = datetime.datetime.now()
     logger = logging.getLogger(__name__)
     logger.info('{0:%Y-%m-%d %H:%M:%S}'.format(now))
 
-    firefox_profile_folder = read_firefox_cookies.get_profile_folder()
-    cjar = read_firefox_cookies.get_cookie_jar(firefox_profile_folder)
+    cjar = cookie_jar
+    if cjar is None:
+        firefox_profile_folder = read_firefox_cookies.get_profile_folder()
+        cjar = read_firefox_cookies.get_cookie_jar(firefox_profile_folder)
 
     if cjar is False:
         sys.exit()
 
-    scraper = FanfictionScraper()
-    report_gen = ReportGen('All')
-
-    # Legacy part first, hoping to deal with slow timeouts, etc.
-    legacy_error = False
-    try:
-        with PageGetter(
-                cookie_jar=cjar, delay=delay, timeout=timeout) as pgetter:
-            getter = FanfictionGetter(pgetter)
-
-            with ReadMeDb(db, echo=False) as read_db:
-                favs_to_update, follows_to_update = \
-                    doyouread.do_legacy_story_page(
-                        getter, read_db, scraper, report_gen)
-                doyouread.check_fav_follow_changes(
-                    favs_to_update, follows_to_update,
-                    read_db, getter, report_gen)
-                read_db.set_commit_flag()
-
-            pgetter.stop_sleep()
-
-    except ConnectionRefusedError:
-        eprint("Need to be logged in to fanfiction.net")
-        legacy_error = True
-    except ConnectionAbortedError as exc:
-        eprint("Connection problem", exc)
-        legacy_error = True
-
-    if legacy_error or nomonth:
-        report_gen.print_report()
-        return
-
-    # Now for the monthly records
-    with ReadMeDb(db, echo=False) as read_db:
+    if instruments is None:
+        instruments = Instruments()
+    with instruments.active():
+        scraper = FanfictionScraper()
+        sink = None
+        if report_file:
+            stream = None
+            if report_stream:
+                stream = open_report_stream(report_stream)
+            sink = ReportSink(report_file, stream=stream)
+        report_gen = ReportGen(
+            'All', top=top, detail=detail or top is None, sink=sink)
+        if mem_report and profiler.kind == 'mem':
+            raise ValueError(
+                "the memory report and a mem profile both reset the peak")
+        memory = PhaseMemory(enabled=mem_report)
+        auditor = QueryAuditor(enabled=query_audit)
+
+        # Legacy part first, hoping to deal with slow timeouts, etc.
+        legacy_error = False
         try:
             with PageGetter(
-                    cookie_jar=cjar, delay=delay, timeout=timeout) as pgetter:
-                getter = FanfictionGetter(pgetter)
-                msetup = MonthlySetup(read_db)
-                data_trees = msetup.get_data_trees(
-                    read_db, getter, scraper, report_gen)
-
-                # This is supposed to be both regular and catch-up case.
-                for mtree in data_trees:
-                    mtree.do_chapter_heirarchy(getter, scraper, read_db)
+                    session=session, cookie_jar=cjar, delay=delay,
+                    timeout=timeout, throttle=throttle) as pgetter, \
+                    memory.phase("legacy"), instruments.phase("legacy"), \
+                    profiler.phase("legacy"):
+                getter = FanfictionGetter(pgetter, base_url)
+
+                with ReadMeDb(db, echo=False) as read_db, \
+                        instruments.watch(read_db), \
+                        auditor.watch(read_db), auditor.phase("legacy"):
+                    favs_to_update, follows_to_update = \
+                        doyouread.do_legacy_story_page(
+                            getter, read_db, scraper, report_gen)
+                    scraper.release()
+                    doyouread.check_fav_follow_changes(
+                        favs_to_update, follows_to_update,
+                        read_db, getter, report_gen)
+                    read_db.set_commit_flag()
 
                 pgetter.stop_sleep()
 
         except ConnectionRefusedError:
             eprint("Need to be logged in to fanfiction.net")
+            legacy_error = True
         except ConnectionAbortedError as exc:
             eprint("Connection problem", exc)
-
-        read_db.set_commit_flag()
-
-    # Any sections not already printed happen here
-    report_gen.print_report()
+            legacy_error = True
+
+        if legacy_error or nomonth:
+            with instruments.phase("report"):
+                report_gen.print_report()
+                report_gen.save(json_report, html_report)
+            finish_run(db, [report_gen], now, instruments, metrics_file)
+            if sink:
+                sink.close()
+            memory.report()
+            memory.stop()
+            auditor.report()
+            return
+
+        # Now for the monthly records
+        data_trees = []
+        with profiler.phase("monthly"), \
+                ReadMeDb(db, echo=False) as read_db, \
+                instruments.watch(read_db), \
+                auditor.watch(read_db), auditor.phase("monthly"):
+            try:
+                with PageGetter(
+                        session=session, cookie_jar=cjar, delay=delay,
+                        timeout=timeout, throttle=throttle) as pgetter:
+                    getter = FanfictionGetter(pgetter, base_url)
+                    with instruments.phase("monthly setup"):
+                        msetup = MonthlySetup(
+                            read_db, chapter_budget=chapter_budget,
+                            memory=memory)
+                        data_trees = msetup.get_data_trees(
+                            read_db, getter, scraper, report_gen)
+
+                    # This is supposed to be both regular and catch-up case.
+                    for mtree in data_trees:
+                        mtree.do_chapter_heirarchy(getter, scraper, read_db)
+                    if data_trees:
+                        purge_closed_months(read_db, data_trees[-1].mid)
+
+                    pgetter.stop_sleep()
+
+            except ConnectionRefusedError:
+                eprint("Need to be logged in to fanfiction.net")
+            except ConnectionAbortedError as exc:
+                eprint("Connection problem", exc)
+
+            read_db.set_commit_flag()
+
+        # Any sections not already printed happen here
+        with instruments.phase("report"):
+            report_gen.print_report()
+            report_gen.save(json_report, html_report)
+
+        reports = [report_gen]
+        for mtree in data_trees:
+            reports.append(mtree.get_monthly_report())
+            reports.append(mtree.get_report())
+        finish_run(db, reports, now, instruments, metrics_file)
+        if sink:
+            sink.close()
+        memory.report()
+        memory.stop()
+        auditor.report()
 
 
 # Runs the script, checking for changes
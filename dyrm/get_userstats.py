@@ -44,7 +44,6 @@ def report_ff_change(
 
     if web_dict is None:
         web_dict = {}
-    message = "{0} ".format(detail)
     title = "Me"
 
     for code in user_set:
@@ -61,9 +60,7 @@ def report_ff_change(
             if alias != "New User":
                 read_db.get_or_create_alias(code, alias)
 
-        user_part =\
-            "'{0}' from '{1}' ({2:d})".format(alias, user.country, code)
-        report_gen.line_to_report(title, message + user_part)
+        report_gen.report_user(title, detail, alias, user.country, code)
 
         ff_details_to_db(detail, code, read_db.session)
 
@@ -177,6 +174,7 @@ def main():
                 print_favs(getter, scraper, read_db, report_gen)
                 print_follows(getter, scraper, read_db, report_gen)
                 report_gen.print_report()
+                read_db.log_changes(report_gen.events(), source="user")
 
             # with ReadMeDb(echo=False) as read_db:
             #     favs_to_update, follows_to_update = \
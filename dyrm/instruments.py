@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+
+"""
+Where the time of a run goes.
+
+An Instruments collects histograms of the run: for each page get the
+wait for the throttle, the time to the first byte, the download, the
+bytes and the status, by endpoint; each scraper call; each database
+statement, by verb and table, and each session flush; and the phases
+of the run. The summary of a run is saved against its Runs row in the
+runmetrics table, and export_prometheus writes the latest run of each
+source in the Prometheus text format, for a textfile collector.
+
+A run activates its Instruments in its own thread, so that scrapers
+made anywhere in the run report to it, and tenant runs in other
+threads keep to their own.
+
+    python -m dyrm.instruments dbs/readme.db             # last runs
+    python -m dyrm.instruments dbs/readme.db -p dyrm.prom
+"""
+
+import os
+import re
+import sys
+import time
+import bisect
+import logging
+import argparse
+import functools
+import threading
+import urllib.parse
+from contextlib import contextmanager
+from sqlalchemy import event
+from dyrm.statements import timed_statements
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Label of the key of each metric, for the export; the counters
+# (bytes and responses) are not in seconds
+METRICS = {
+    'phase': 'phase',
+    'page_wait': 'endpoint',
+    'page_ttfb': 'endpoint',
+    'page_download': 'endpoint',
+    'page_bytes': 'endpoint',
+    'page_responses': 'endpoint',
+    'parse': 'call',
+    'db_query': 'query',
+    'db_flush': 'session',
+}
+COUNTERS = ('page_bytes', 'page_responses')
+
+STATEMENT_PATTERN = re.compile(
+    r"^\s*(SELECT|INSERT|UPDATE|DELETE)\b.*?"
+    r"\b(?:FROM|INTO|UPDATE)\s+\"?(\w+)", re.IGNORECASE | re.DOTALL)
+ID_SEGMENT = re.compile(r"/[0-9]+(?=/|$)")
+
+_local = threading.local()
+
+
+def endpoint(page):
+    """ The path of a page url, with numeric ids made generic """
+    path = urllib.parse.urlsplit(page).path or "/"
+    path = ID_SEGMENT.sub("/{id}", path)
+    if path.startswith("/users/"):
+        path = re.sub(r"^/users/[^/]+", "/users/{user}", path)
+    return path
+
+
+def statement_group(statement):
+    """ 'select mstory', say, for a statement on the mstory table """
+    match = STATEMENT_PATTERN.match(statement)
+    if not match:
+        return statement.split(None, 1)[0].lower() if statement else ""
+    return "{0} {1}".format(match.group(1).lower(), match.group(2))
+
+
+class Histogram:
+    """ Counts of observations by bucket, with their sum and maximum """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.peak = 0.0
+
+    def observe(self, value):
+        """ Count one observation """
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.peak = max(self.peak, value)
+
+
+def quantile(buckets, count, fraction, peak):
+    """
+    Estimate a quantile from cumulative bucket counts, interpolating
+    within the bucket as Prometheus' histogram_quantile does.
+    """
+    if not count:
+        return 0.0
+    rank = fraction * count
+    lower, below = 0.0, 0
+    for bound, cumulative in zip(BUCKETS + (peak,), buckets):
+        if cumulative >= rank:
+            inside = cumulative - below
+            share = (rank - below) / inside if inside else 1.0
+            return min(peak, lower + (bound - lower) * share)
+        lower, below = bound, cumulative
+    return peak
+
+
+def current():
+    """ The Instruments active in this thread, or a disabled one """
+    return getattr(_local, 'instruments', None) or NO_INSTRUMENTS
+
+
+def timed(metric):
+    """ Decorate a method to time each call under its name """
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            instruments = current()
+            if not instruments.enabled:
+                return method(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                instruments.observe(
+                    metric, method.__name__, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+class Instruments:
+    """ The timings of one run """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.histograms = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def active(self):
+        """ Make this the current Instruments of the thread """
+        previous = getattr(_local, 'instruments', None)
+        _local.instruments = self
+        try:
+            yield self
+        finally:
+            _local.instruments = previous
+
+    def observe(self, metric, key, seconds):
+        """ Count one timing """
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.histograms.get((metric, key))
+            if histogram is None:
+                histogram = self.histograms[(metric, key)] = Histogram()
+            histogram.observe(seconds)
+
+    def add(self, metric, key, amount=1):
+        """ Add to a counter """
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[(metric, key)] = \
+                self.counters.get((metric, key), 0) + amount
+
+    @contextmanager
+    def timer(self, metric, key):
+        """ Time the with block """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(metric, key, time.perf_counter() - start)
+
+    def phase(self, name):
+        """ Time a phase of the run """
+        return self.timer('phase', name)
+
+    def page(self, page, wait, ttfb, download, size, status):
+        """ Count one page get: its timings, bytes and status """
+        if not self.enabled:
+            return
+        path = endpoint(page)
+        self.observe('page_wait', path, wait)
+        self.observe('page_ttfb', path, ttfb)
+        self.observe('page_download', path, download)
+        self.add('page_bytes', path, size)
+        self.add('page_responses', "{0} {1}".format(path, status))
+
+    @contextmanager
+    def watch(self, read_db):
+        """ Time the statements and flushes of a ReadMeDb in the block """
+        if not self.enabled:
+            yield
+            return
+        session = read_db.session
+
+        def statement_time(statement, seconds):
+            self.observe('db_query', statement_group(statement), seconds)
+
+        def before_flush(flushing, *args):
+            # pylint: disable=unused-argument
+            flushing.info['instruments_flush'] = time.perf_counter()
+
+        def after_flush(flushing, *args):
+            # pylint: disable=unused-argument
+            start = flushing.info.pop('instruments_flush', None)
+            if start is not None:
+                self.observe(
+                    'db_flush', 'flush', time.perf_counter() - start)
+
+        listeners = [
+            (session, 'before_flush', before_flush),
+            (session, 'after_flush_postexec', after_flush)]
+        for target, name, listener in listeners:
+            event.listen(target, name, listener)
+        try:
+            with timed_statements(read_db.engine, statement_time):
+                yield
+        finally:
+            for target, name, listener in listeners:
+                event.remove(target, name, listener)
+
+    def rows(self):
+        """ (metric, key, count, total, peak, buckets) for each series """
+        rows = []
+        with self.lock:
+            for (metric, key), histogram in sorted(self.histograms.items()):
+                cumulative = []
+                running = 0
+                for count in histogram.counts:
+                    running += count
+                    cumulative.append(running)
+                rows.append((
+                    metric, key, histogram.count, histogram.total,
+                    histogram.peak, cumulative))
+            for (metric, key), amount in sorted(self.counters.items()):
+                rows.append((metric, key, amount, float(amount), 0.0, []))
+        return rows
+
+    def report(self, top=5):
+        """ Log the phases, and the slowest series of each metric """
+        if not self.enabled:
+            return
+        logger = logging.getLogger(__name__)
+        for line in summary_lines(self.rows(), top):
+            logger.info(line)
+
+
+NO_INSTRUMENTS = Instruments(enabled=False)
+
+
+def summary_lines(rows, top=5):
+    """ Lines of the series with the most time, top few by metric """
+    lines = []
+    for metric in METRICS:
+        if metric in COUNTERS:
+            continue
+        series = sorted(
+            (row for row in rows if row[0] == metric),
+            key=lambda row: -row[3])
+        for name, key, count, total, peak, buckets in series[:top]:
+            lines.append(
+                "{0} {1}: {2:,d} in {3:.3f}s, p50 {4:.4f}s, p90 {5:.4f}s, "
+                "max {6:.4f}s".format(
+                    name, key, count, total,
+                    quantile(buckets, count, 0.5, peak),
+                    quantile(buckets, count, 0.9, peak), peak))
+    return lines
+
+
+def label_value(value):
+    """ A label value escaped as the Prometheus text format requires """
+    return '"{0}"'.format(
+        str(value).replace("\\", "\\\\").replace('"', '\\"').replace(
+            "\n", "\\n"))
+
+
+def prometheus_text(runs):
+    """
+    The Prometheus text format of runs, a list of (source, started,
+    rows). Series are labelled by source and by their key.
+    """
+    # pylint: disable=too-many-locals
+    families = {}
+    for source, _, rows in runs:
+        for metric, key, count, total, peak, buckets in rows:
+            families.setdefault(metric, []).append(
+                (source, key, count, total, peak, buckets))
+    lines = [
+        "# HELP dyrm_run_started_seconds When the last run of a source "
+        "started",
+        "# TYPE dyrm_run_started_seconds gauge"]
+    for source, started, _ in runs:
+        lines.append('dyrm_run_started_seconds{{source={0}}} {1:.0f}'.format(
+            label_value(source), started.timestamp()))
+    for metric, label in METRICS.items():
+        series = families.get(metric, [])
+        if not series:
+            continue
+        if metric == 'page_responses':
+            name = "dyrm_page_responses_total"
+            lines.append("# TYPE {0} counter".format(name))
+            for source, key, count, _, _, _ in series:
+                path, status = key.rsplit(" ", 1)
+                lines.append(
+                    '{0}{{source={1},{2}={3},status={4}}} {5:d}'.format(
+                        name, label_value(source), label, label_value(path),
+                        label_value(status), count))
+            continue
+        if metric == 'page_bytes':
+            name = "dyrm_page_bytes_total"
+            lines.append("# TYPE {0} counter".format(name))
+            for source, key, count, _, _, _ in series:
+                lines.append('{0}{{source={1},{2}={3}}} {4:d}'.format(
+                    name, label_value(source), label, label_value(key),
+                    count))
+            continue
+        name = "dyrm_{0}_seconds".format(metric)
+        lines.append("# TYPE {0} histogram".format(name))
+        for source, key, count, total, _, buckets in series:
+            labels = 'source={0},{1}={2}'.format(
+                label_value(source), label, label_value(key))
+            for bound, cumulative in zip(BUCKETS, buckets):
+                lines.append('{0}_bucket{{{1},le="{2}"}} {3:d}'.format(
+                    name, labels, bound, cumulative))
+            lines.append('{0}_bucket{{{1},le="+Inf"}} {2:d}'.format(
+                name, labels, count))
+            lines.append('{0}_sum{{{1}}} {2:.6f}'.format(name, labels, total))
+            lines.append('{0}_count{{{1}}} {2:d}'.format(name, labels, count))
+    return "\n".join(lines) + "\n"
+
+
+def export_prometheus(read_db, path):
+    """
+    Write the latest run of each source to path, replacing it in one
+    step so a collector never reads half a file.
+    """
+    text = prometheus_text(read_db.get_latest_run_metrics())
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w') as prom_file:
+        prom_file.write(text)
+    os.replace(temp_path, path)
+
+
+def main(argv=None):
+    """ Print the latest run of each source, or export them """
+    # pylint: disable=import-outside-toplevel
+    from dyrm.readme_db import ReadMeDb
+    parser = argparse.ArgumentParser(prog="python -m dyrm.instruments")
+    parser.add_argument("db", help="path to sqlite3 database")
+    parser.add_argument(
+        "-p", "--prometheus", help="write the Prometheus text format here")
+    parser.add_argument("-k", "--top", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    with ReadMeDb(args.db) as read_db:
+        if args.prometheus:
+            export_prometheus(read_db, args.prometheus)
+            return 0
+        for source, started, rows in read_db.get_latest_run_metrics():
+            print("{0} run of {1:%Y-%m-%d %H:%M:%S}".format(source, started))
+            for line in summary_lines(rows, args.top):
+                print("   ", line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
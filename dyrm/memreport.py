@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+"""
+Memory use per phase of a run, measured with tracemalloc.
+
+Each phase records the traced memory when it starts and ends and the
+peak reached inside it, so a phase that keeps pages or records alive
+longer than it should stands out. Phases are not meant to be nested.
+"""
+
+import logging
+import tracemalloc
+from collections import namedtuple
+from contextlib import contextmanager
+
+PhaseUse = namedtuple('PhaseUse', ['phase', 'start', 'end', 'peak'])
+
+
+class PhaseMemory:
+    """ Collect the memory use of the phases of a run """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.phases = []
+        self.started = False
+
+    @contextmanager
+    def phase(self, name):
+        """ Measure the memory use of the code run in the with block """
+        if not self.enabled:
+            yield
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started = True
+        tracemalloc.reset_peak()
+        start, _ = tracemalloc.get_traced_memory()
+        try:
+            yield
+        finally:
+            end, peak = tracemalloc.get_traced_memory()
+            self.phases.append(PhaseUse(name, start, end, peak))
+
+    def report(self):
+        """ Log one line per phase, in KiB """
+        if not self.enabled:
+            return
+        logger = logging.getLogger(__name__)
+        for use in self.phases:
+            logger.info(
+                "memory {}: {:,d} KiB, {:+,d} KiB, peak {:,d} KiB".format(
+                    use.phase, use.end // 1024,
+                    (use.end - use.start) // 1024, use.peak // 1024))
+
+    def stop(self):
+        """ Stop tracing, if this collector started it """
+        if self.started:
+            tracemalloc.stop()
+            self.started = False
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+"""
+Snapshot differ for the monthly hit counts.
+
+A level of the monthly hierarchy (stories, countries, chapters,
+chapter countries) is compared in one go: the scraped records and
+the stored values are lined up by key into one column per field,
+the columns are subtracted, and only the non-zero deltas are kept.
+The resulting ChangeSet feeds both the report and the db writer.
+
+Levels that mostly stay the same between runs can be diffed against
+signatures instead: a short hash per key of its values, and a digest
+of the whole level. Only the keys whose hash moved need their stored
+values read at all.
+"""
+
+import hashlib
+from collections import namedtuple
+
+DIFF_FIELDS = ('views', 'visitors')
+
+Change = namedtuple('Change', ['key', 'field', 'old', 'new', 'delta'])
+
+
+class ChangeSet:
+    """ Changes found at one level of the monthly hierarchy """
+
+    def __init__(self, changes, current):
+        self.changes = changes
+        self.current = current
+
+    def __iter__(self):
+        return iter(self.changes)
+
+    def __len__(self):
+        return len(self.changes)
+
+    def __bool__(self):
+        return bool(self.changes)
+
+    def changed_keys(self):
+        """ Keys with at least one change, in scraped order """
+        keys = []
+        for change in self.changes:
+            if not keys or keys[-1] != change.key:
+                keys.append(change.key)
+        return keys
+
+    def apply(self, get_rec):
+        """
+        Write the new values into the db records.
+        get_rec(key) must return the (possibly new) record for a key,
+        and is only called for keys that actually changed.
+        """
+        rec = None
+        last_key = None
+        for change in self.changes:
+            if rec is None or change.key != last_key:
+                rec = get_rec(change.key)
+                last_key = change.key
+            setattr(rec, change.field, change.new)
+
+
+def level_columns(current, fields):
+    """ The keys of a level and one column of values per field """
+    keys = list(current)
+    if hasattr(current, 'column'):
+        return keys, [current.column(field) for field in fields]
+    return keys, [
+        [getattr(current[key], field) for key in keys] for field in fields]
+
+
+def diff_snapshot(current, stored, fields=DIFF_FIELDS):
+    """
+    Compare scraped records with stored values for one level.
+
+    current maps key -> scraped record (fields read as attributes),
+    or is a KeyedTable, whose columns are used as they are.
+    stored maps key -> tuple of stored values, in fields order.
+    Keys missing from stored compare against zero.
+    """
+    keys, new_cols = level_columns(current, fields)
+    zero = (0,) * len(fields)
+    old_rows = [stored.get(key, zero) for key in keys]
+    old_cols = [
+        [row[pos] for row in old_rows] for pos in range(len(fields))]
+    delta_cols = [
+        [new - old for new, old in zip(new_col, old_col)]
+        for new_col, old_col in zip(new_cols, old_cols)]
+
+    # Only the rows with some non-zero delta need to be looked at again.
+    moved = [
+        idx for idx, deltas in enumerate(zip(*delta_cols)) if any(deltas)]
+    changes = []
+    for idx in moved:
+        for pos, field in enumerate(fields):
+            delta = delta_cols[pos][idx]
+            if delta:
+                changes.append(Change(
+                    keys[idx], field,
+                    old_cols[pos][idx], new_cols[pos][idx], delta))
+    return ChangeSet(changes, current)
+
+
+def key_signatures(current, fields=DIFF_FIELDS):
+    """ Short hash per key of its scraped values, keys as strings """
+    keys, cols = level_columns(current, fields)
+    return dict(
+        (str(key), hashlib.blake2b(
+            repr(tuple(values)).encode(), digest_size=8).hexdigest())
+        for key, *values in zip(keys, *cols))
+
+
+def level_digest(signatures):
+    """ One hash for a whole level, from its key signatures """
+    return hashlib.blake2b(
+        repr(sorted(signatures.items())).encode(),
+        digest_size=16).hexdigest()
+
+
+def moved_keys(current, signatures, old_signatures):
+    """ Keys of current whose signature differs from the cached one """
+    return [
+        key for key in current
+        if old_signatures.get(str(key)) != signatures[str(key)]]
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+"""
+Profiles of chosen phases of a run, without editing the code.
+
+A PhaseProfiler wraps the phases it is asked for (legacy, monthly,
+ao3, countries) with one kind of profile:
+
+cpu   cProfile; the stats are dumped for pstats or snakeviz, with a
+      text summary of the top functions by cumulative time. Threads
+      started in the phase, like the ao3 and country workers, get a
+      profile each, merged into the phase's at its end
+mem   tracemalloc snapshots at the start and end of the phase; the
+      lines that grew the most, and the peak. It resets the peak, so
+      it is not run with the memory report (--memreport)
+sql   every statement run by a database engine in the phase, by
+      statement text: count, total and mean milliseconds
+
+Each phase writes its files to the folder given, named
+ffm-<start time>-<phase>.<kind>..., and logs their paths.
+
+    ./ffm.py --profile cpu --profile-phase monthly
+"""
+
+import os
+import re
+import pstats
+import cProfile
+import logging
+import datetime
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from sqlalchemy.engine import Engine
+from dyrm.statements import timed_statements
+
+PROFILES = ('cpu', 'mem', 'sql')
+PROFILE_PHASES = ('legacy', 'monthly', 'ao3', 'countries')
+
+SPACES = re.compile(r"\s+")
+
+
+class PhaseProfiler:
+    """ Profile the chosen phases of a run, one kind of profile """
+
+    def __init__(self, kind=None, phases=None, folder=".", top=40):
+        self.kind = kind
+        self.phases = set(phases or PROFILE_PHASES)
+        self.folder = folder
+        self.top = top
+        self.artifacts = []
+
+    @contextmanager
+    def phase(self, name):
+        """ Profile the with block, if the phase is one of those chosen """
+        if self.kind is None or name not in self.phases:
+            yield
+            return
+        path = os.path.join(self.folder, "ffm-{0:%Y%m%d-%H%M%S}-{1}".format(
+            datetime.datetime.now(), name))
+        profile = dict(
+            cpu=self.profile_cpu, mem=self.profile_mem,
+            sql=self.profile_sql)[self.kind]
+        with profile(path):
+            yield
+
+    def wrote(self, path):
+        """ Note a file written """
+        self.artifacts.append(path)
+        logger = logging.getLogger(__name__)
+        logger.info("profile written to {0}".format(path))
+
+    @contextmanager
+    def profile_cpu(self, path):
+        """ cProfile the block, and the threads it starts """
+        workers = []
+        lock = threading.Lock()
+
+        def profile_worker(*args):
+            # pylint: disable=unused-argument
+            # Called once in each new thread; the thread's own profile
+            # takes over from here
+            worker = cProfile.Profile()
+            with lock:
+                workers.append(worker)
+            worker.enable()
+
+        previous = threading.getprofile()
+        threading.setprofile(profile_worker)
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            threading.setprofile(previous)
+            stats = pstats.Stats(profile)
+            with lock:
+                for worker in workers:
+                    worker.create_stats()
+                    if worker.stats:
+                        stats.add(worker)
+            stats.dump_stats(path + ".cpu.prof")
+            self.wrote(path + ".cpu.prof")
+            with open(path + ".cpu.txt", 'w') as text_file:
+                text_file.write("with {0:d} worker threads\n".format(
+                    len(workers)))
+                stats.stream = text_file
+                stats.sort_stats('cumulative').print_stats(self.top)
+            self.wrote(path + ".cpu.txt")
+
+    @contextmanager
+    def profile_mem(self, path):
+        """ Compare tracemalloc snapshots from before and after """
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        try:
+            yield
+        finally:
+            after = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            if started:
+                tracemalloc.stop()
+            ignore = (tracemalloc.Filter(False, tracemalloc.__file__),)
+            growth = after.filter_traces(ignore).compare_to(
+                before.filter_traces(ignore), 'lineno')
+            with open(path + ".mem.txt", 'w') as text_file:
+                text_file.write(
+                    "traced {0:,d} KiB, peak {1:,d} KiB\n\n".format(
+                        current // 1024, peak // 1024))
+                for stat in growth[:self.top]:
+                    text_file.write("{0}\n".format(stat))
+            self.wrote(path + ".mem.txt")
+
+    @contextmanager
+    def profile_sql(self, path):
+        """ Time the statements this thread runs on any engine """
+        statements = StatementTimes(threading.get_ident())
+        try:
+            with timed_statements(Engine, statements.add):
+                yield
+        finally:
+            with open(path + ".sql.txt", 'w') as text_file:
+                for line in statements.lines():
+                    text_file.write(line + "\n")
+            self.wrote(path + ".sql.txt")
+
+
+class StatementTimes:
+    """ Count and total time of each statement text, for one thread """
+
+    def __init__(self, thread):
+        self.thread = thread
+        self.times = {}
+
+    def add(self, statement, elapsed):
+        """ Add the time of a statement to its text's """
+        if threading.get_ident() != self.thread:
+            return
+        text = SPACES.sub(" ", statement).strip()
+        count, total = self.times.get(text, (0, 0.0))
+        self.times[text] = (count + 1, total + elapsed)
+
+    def lines(self):
+        """ A table of the statements, most total time first """
+        rows = sorted(
+            self.times.items(), key=lambda item: item[1][1], reverse=True)
+        lines = ["{0:>8} {1:>10} {2:>9}  statement".format(
+            "count", "total ms", "mean ms")]
+        for text, (count, total) in rows:
+            lines.append("{0:8,d} {1:10.1f} {2:9.3f}  {3}".format(
+                count, total * 1000, total * 1000 / count, text))
+        lines.append(
+            "{0:8,d} {1:10.1f} {2:>9}  in all, {3:,d} distinct".format(
+                sum(x[0] for x in self.times.values()),
+                sum(x[1] for x in self.times.values()) * 1000, "",
+                len(self.times)))
+        return lines
+
+
+NO_PROFILER = PhaseProfiler()
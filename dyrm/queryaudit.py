@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+"""
+Count the statements a ReadMeDb runs, by code location, and find the
+loops that run the same statement once per row (the N+1 pattern).
+
+A QueryAuditor watches the engine of a ReadMeDb. Each statement is
+reduced to its shape, with literals and IN lists made generic, and
+counted, with its time, under the phase it ran in and the place in
+dyrm it came from: the first frame in the package and its caller,
+like "readme_db.py:1142 get_or_create_user < do_you_read_me.py:219
+report_ff_change". Lazy loads of relationships show up under the line
+that touched the attribute.
+
+A shape run many times in one phase is a likely N+1; suspects() ranks
+them by total time. Tests hold code to a statement budget:
+
+    auditor = QueryAuditor()
+    with auditor.watch(read_db), auditor.budget(12):
+        mtree.check_story_updates(story_rows, read_db)
+"""
+
+import os
+import re
+import sys
+import logging
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from dyrm import statements
+from dyrm.statements import timed_statements
+
+# Shapes seen at least this often in a phase are N+1 suspects
+REPEAT_THRESHOLD = 5
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Frames of the auditing itself, not of the code that ran the statement
+AUDIT_FILES = (
+    os.path.abspath(__file__), os.path.abspath(statements.__file__))
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r"\b[0-9]+(?:\.[0-9]+)?\b")
+PARAM_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+SPACES = re.compile(r"\s+")
+
+Suspect = namedtuple(
+    'Suspect', ['phase', 'shape', 'count', 'total', 'locations'])
+
+
+def statement_shape(statement):
+    """ The statement with its literals and parameter lists made generic """
+    shape = STRING_LITERAL.sub("?", statement)
+    shape = NUMBER_LITERAL.sub("?", shape)
+    shape = SPACES.sub(" ", shape).strip()
+    return PARAM_LIST.sub("(?...)", shape)
+
+
+def code_location(depth=2):
+    """
+    Where in dyrm the current statement came from: the innermost
+    frames in the package, outside the auditing, innermost first.
+    """
+    frame = sys._getframe(1)  # pylint: disable=protected-access
+    places = []
+    while frame is not None and len(places) < depth:
+        path = frame.f_code.co_filename
+        if path.startswith(PACKAGE_DIR) and path not in AUDIT_FILES:
+            places.append("{0}:{1:d} {2}".format(
+                os.path.basename(path), frame.f_lineno,
+                frame.f_code.co_name))
+        frame = frame.f_back
+    return " < ".join(places) or "outside dyrm"
+
+
+class QueryAuditor:
+    """ Statement counts of the ReadMeDb sessions it watches """
+
+    def __init__(self, enabled=True, threshold=REPEAT_THRESHOLD):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.current_phase = ""
+        self.statements = 0
+        self.total = 0.0
+        # (phase, shape) -> [count, seconds, {location: count}]
+        self.shapes = {}
+        # location -> [count, seconds]
+        self.locations = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def watch(self, read_db):
+        """ Audit the statements of a ReadMeDb's engine in the block """
+        if not self.enabled:
+            yield self
+            return
+
+        def statement_time(statement, seconds):
+            self.count(statement, seconds, code_location())
+
+        with timed_statements(read_db.engine, statement_time):
+            yield self
+
+    @contextmanager
+    def phase(self, name):
+        """ Count the statements of the block under a phase name """
+        previous = self.current_phase
+        self.current_phase = name
+        try:
+            yield
+        finally:
+            self.current_phase = previous
+
+    @contextmanager
+    def budget(self, limit):
+        """ Fail if the block runs more than limit statements """
+        start = self.statements
+        yield
+        used = self.statements - start
+        if used > limit:
+            raise AssertionError(
+                "{0:d} statements over a budget of {1:d}\n{2}".format(
+                    used, limit, "\n".join(self.report_lines())))
+
+    def count(self, statement, elapsed, location):
+        """ Count one statement """
+        shape = statement_shape(statement)
+        with self.lock:
+            self.statements += 1
+            self.total += elapsed
+            counts = self.shapes.setdefault(
+                (self.current_phase, shape), [0, 0.0, {}])
+            counts[0] += 1
+            counts[1] += elapsed
+            counts[2][location] = counts[2].get(location, 0) + 1
+            place = self.locations.setdefault(location, [0, 0.0])
+            place[0] += 1
+            place[1] += elapsed
+
+    def suspects(self):
+        """ Shapes repeated in a phase, most total time first """
+        with self.lock:
+            found = [
+                Suspect(phase, shape, count, total, sorted(
+                    places.items(), key=lambda item: -item[1]))
+                for (phase, shape), (count, total, places)
+                in self.shapes.items() if count >= self.threshold]
+        return sorted(found, key=lambda suspect: -suspect.total)
+
+    def report_lines(self, top=10):
+        """ The busiest locations, then the likely N+1 patterns """
+        lines = ["{0:,d} statements in {1:.1f} ms".format(
+            self.statements, self.total * 1000)]
+        with self.lock:
+            places = sorted(
+                self.locations.items(), key=lambda item: -item[1][1])
+        for location, (count, total) in places[:top]:
+            lines.append("{0:8,d} {1:10.1f} ms  {2}".format(
+                count, total * 1000, location))
+        suspects = self.suspects()
+        if suspects:
+            lines.append("likely N+1:")
+        for suspect in suspects[:top]:
+            lines.append("{0:8,d} {1:10.1f} ms  {2}: {3}".format(
+                suspect.count, suspect.total * 1000,
+                suspect.phase or "-", suspect.shape[:160]))
+            for location, count in suspect.locations[:2]:
+                lines.append("{0:8,d}  from {1}".format(count, location))
+        return lines
+
+    def report(self, top=10):
+        """ Log the report """
+        if not self.enabled:
+            return
+        logger = logging.getLogger(__name__)
+        for line in self.report_lines(top):
+            logger.info(line)
@@ -2,74 +2,127 @@
 
 """
 Get cookies from Firefox.
+
+Original Author: Noah Fontes nfontes AT cynigram DOT com
+Original URL:
+  http://blog.mithis.net/archives/python/90-firefox3-cookies-in-python
+License: MIT
+
+Maintainer: Dotan Cohen
+* Ported to Python 3
+* Support cookies from recovery.js
+* Accept profile folder as input parameter instead of sqlite filename
 """
 
 import sys
 import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import http.cookiejar
+from urllib.request import pathname2url
 
 
 FTSTR = ["FALSE", "TRUE"]
 
 
-def get_cookie_jar(profile_folder):
-    """
-    Original Author: Noah Fontes nfontes AT cynigram DOT com
-    Original URL:
-      http://blog.mithis.net/archives/python/90-firefox3-cookies-in-python
-    License: MIT
-
-    Maintainer: Dotan Cohen
-    * Ported to Python 3
-    * Support cookies from recovery.js
-    * Accept profile folder as input parameter instead of sqlite filename
-    """
+# Only cookies for the sites we crawl are loaded
+CRAWL_HOSTS = ("fanfiction.net", "archiveofourown.org")
+
+# Loaded jars by (cookie file, hosts), with the file stamps they match
+_jar_cache = {}
+_jar_lock = threading.Lock()
 
-    import http.cookiejar
-    from io import StringIO
 
-    strio = StringIO()
-    strio.write("""\
-# Netscape HTTP Cookie File
-# http://www.netscape.com/newsref/std/cookie_spec.html
-# This is a generated file!  Do not edit.
-""")
+def get_cookie_jar(profile_folder, hosts=CRAWL_HOSTS):
+    """
+    Cookie jar with the Firefox cookies for the given hosts and
+    their subdomains, or False if there is no cookie store.
 
-    if read_cookies_db(profile_folder, strio) is False:
+    The jar is cached until cookies.sqlite or its write-ahead log
+    changes, so a fresh login is picked up by the next caller
+    without a restart.
+    """
+
+    sql_file = os.path.join(profile_folder, 'cookies.sqlite')
+    try:
+        stamp = cookie_file_stamp(sql_file)
+    except OSError:
         return False
 
-    # read_sessions_file(profile_folder, strio)
+    key = (sql_file, tuple(hosts))
+    with _jar_lock:
+        cached = _jar_cache.get(key)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
 
-    strio.seek(0)
-    cookie_jar = http.cookiejar.MozillaCookieJar()
-    cookie_jar._really_load(strio, '', True, True)
+    cookie_jar = http.cookiejar.CookieJar()
+    try:
+        for cookie in read_cookies_db(sql_file, hosts):
+            cookie_jar.set_cookie(cookie)
+    except sqlite3.DatabaseError:
+        return False
 
+    with _jar_lock:
+        _jar_cache[key] = (stamp, cookie_jar)
     return cookie_jar
 
 
-def read_cookies_db(profile_folder, strio):
-    """
-    Read the Firefox cookies database.
-    """
-
-    import os
-    import sqlite3
+def cookie_file_stamp(sql_file):
+    """ Modification time and size of the cookie store and its log """
+    stamp = []
+    for path in (sql_file, sql_file + "-wal"):
+        try:
+            info = os.stat(path)
+        except FileNotFoundError:
+            if path == sql_file:
+                raise
+            continue
+        stamp.append((info.st_mtime_ns, info.st_size))
+    return tuple(stamp)
 
-    sql_file = os.path.join(profile_folder, 'cookies.sqlite')
 
-    try:
-        con = sqlite3.connect(sql_file)
-    except sqlite3.OperationalError:
-        return False
+def read_cookies_db(sql_file, hosts):
+    """
+    Read the Firefox cookies database, for the given hosts only.
 
-    cur = con.cursor()
-    cur.execute(
-        "SELECT host, path, isSecure, expiry, name, value FROM moz_cookies")
+    The store is opened as an immutable read-only URI, so a running
+    Firefox's lock does not get in the way. Immutable mode ignores
+    the write-ahead log, so while the log holds changes the store
+    and log are read from a copy instead.
+    """
 
-    for f_item in cur.fetchall():
-        strio.write("%s\t%s\t%s\t%s\t%s\t%s\t%s\n" % (
-            f_item[0], FTSTR[f_item[0].startswith('.')], f_item[1],
-            FTSTR[f_item[2]], f_item[3], f_item[4], f_item[5]))
-    return True
+    where = " OR ".join(["host = ? OR host LIKE ?"] * len(hosts))
+    params = []
+    for host in hosts:
+        params.extend((host.lstrip('.'), "%." + host.lstrip('.')))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        wal_file = sql_file + "-wal"
+        if os.path.exists(wal_file) and os.path.getsize(wal_file):
+            copy_file = os.path.join(tmp_dir, 'cookies.sqlite')
+            shutil.copyfile(sql_file, copy_file)
+            shutil.copyfile(wal_file, copy_file + "-wal")
+            con = sqlite3.connect(copy_file)
+        else:
+            con = sqlite3.connect(
+                "file:{0}?immutable=1".format(pathname2url(sql_file)),
+                uri=True)
+        try:
+            rows = con.execute(
+                "SELECT host, path, isSecure, expiry, name, value "
+                "FROM moz_cookies WHERE " + where, params).fetchall()
+        finally:
+            con.close()
+
+    return [
+        http.cookiejar.Cookie(
+            0, name, value, None, False,
+            host, host.startswith('.'), host.startswith('.'),
+            path, True, bool(secure), expiry, False,
+            None, None, {})
+        for host, path, secure, expiry, name, value in rows]
 
 
 def read_sessions_file(profile_folder, strio):
@@ -4,15 +4,19 @@
 Local database to track story hits and other information for
 fanfiction writers.
 """
+import json
+import logging
+import threading
 from collections import namedtuple
 from sqlalchemy import create_engine, Column
-from sqlalchemy import Integer, String, ForeignKey, DateTime
+from sqlalchemy import Integer, String, Text, ForeignKey, DateTime, Float
 from sqlalchemy import Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
-from sqlalchemy import func
+from sqlalchemy import func, text, update
 from sqlalchemy.engine import Engine
 from sqlalchemy import event
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 import sqlite3
 
 
@@ -45,6 +49,48 @@ def legacy_recs_iter(legacy_recs):
             rec.alerts)
 
 
+CommentRec = namedtuple(
+    'CommentRec', ['ref', 'chapter', 'stamp', 'name', 'comment', 'code'])
+
+# The natural key of a comment, in index order
+COMMENT_KEY = ('ref', 'stamp', 'chapter', 'name')
+
+CountryLookup = namedtuple(
+    'CountryLookup', ['code', 'country', 'due', 'attempts'])
+
+CommentHit = namedtuple(
+    'CommentHit',
+    ['ref', 'title', 'chapter', 'stamp', 'name', 'comment', 'rank'])
+
+# Full-text index of the comments, with the reviewer's name on the
+# comment and every alias the signed-in reviewer has been seen under.
+# Triggers keep it in step with comments, scomments and aliases.
+COMMENT_SEARCH_SQL = (
+    "CREATE VIRTUAL TABLE comments_fts USING fts5("
+    "comment, name, aliases, tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER comments_fts_insert AFTER INSERT ON comments BEGIN "
+    "INSERT INTO comments_fts (rowid, comment, name, aliases) "
+    "VALUES (new.num, new.comment, new.name, ''); END",
+    "CREATE TRIGGER comments_fts_delete AFTER DELETE ON comments BEGIN "
+    "DELETE FROM comments_fts WHERE rowid = old.num; END",
+    "CREATE TRIGGER comments_fts_update AFTER UPDATE OF comment, name "
+    "ON comments BEGIN "
+    "UPDATE comments_fts SET comment = new.comment, name = new.name "
+    "WHERE rowid = new.num; END",
+    "CREATE TRIGGER comments_fts_signed AFTER INSERT ON scomments BEGIN "
+    "UPDATE comments_fts SET aliases = (SELECT group_concat(name, ' ') "
+    "FROM aliases WHERE code = new.code) WHERE rowid = new.num; END",
+    "CREATE TRIGGER comments_fts_alias AFTER INSERT ON aliases BEGIN "
+    "UPDATE comments_fts SET aliases = (SELECT group_concat(name, ' ') "
+    "FROM aliases WHERE code = new.code) "
+    "WHERE rowid IN (SELECT num FROM scomments WHERE code = new.code); "
+    "END",
+    "INSERT INTO comments_fts (rowid, comment, name, aliases) "
+    "SELECT c.num, c.comment, c.name, coalesce(("
+    "SELECT group_concat(a.name, ' ') FROM scomments s "
+    "JOIN aliases a ON a.code = s.code WHERE s.num = c.num), '') "
+    "FROM comments c")
+
 LegacyRecNoTitle = namedtuple(
     'LegacyRecNoTitle',
     ['ref', 'words', 'chaps', 'reviews',
@@ -97,6 +143,9 @@ class Comments(Base):
     comment = Column(String)
     stamp = Column(DateTime)
 
+    __table_args__ = (
+        Index('comment_key', *COMMENT_KEY, unique=True),)
+
     signed = relationship("SComments", back_populates="comment")
 
     def __repr__(self):
@@ -142,23 +191,184 @@ class CheckPend(Base):
             self.ref, self.check_pending)
 
 
+class ChapPend(Base):
+    """
+    Represents chapters whose country breakdown still needs fetching.
+    The delta and the number of runs it has been put off set its
+    priority in the next run.
+    """
+
+    # pylint: disable=too-few-public-methods,no-init
+
+    __tablename__ = 'chappend'
+
+    mid = Column(Integer, ForeignKey('months.mid'), primary_key=True)
+    ref = Column(Integer, ForeignKey('stories.ref'), primary_key=True)
+    chap = Column(Integer, primary_key=True)
+    ch_ref = Column(Integer, ForeignKey('chapters.ch_ref'), nullable=False)
+    delta = Column(Integer, default=0)
+    deferred = Column(Integer, default=0)
+
+    story = relationship("Stories")
+    chapter = relationship("Chapters")
+
+    def __repr__(self):
+        str = "<ChapPend(mid={0:d}, ref={1:d}, chap={2:d}, deferred={3:d})>"
+        return str.format(self.mid, self.ref, self.chap, self.deferred)
+
+
+class CountryQueue(Base):
+    """
+    Users whose country flag is to be looked up, and when.
+    A user stays queued after a lookup, due again once the result
+    (a country, or no flag at all) has aged out, so the queue is
+    also the cache of lookups.
+    """
+
+    # pylint: disable=too-few-public-methods,no-init
+
+    __tablename__ = 'countryqueue'
+
+    code = Column(Integer, ForeignKey('users.code'), primary_key=True)
+    due = Column(DateTime, nullable=False)
+    checked = Column(DateTime)
+    attempts = Column(Integer, default=0)
+
+    __table_args__ = (
+        Index('country_due', "due", unique=False),)
+
+    def __repr__(self):
+        return "<CountryQueue(code={0:d}, due='{1}')>".format(
+            self.code, self.due)
+
+
+class Signatures(Base):
+    """
+    Hashes of the values stored for one level of the monthly hierarchy
+    (the scope, such as the countries of a month), one per key plus a
+    digest of the whole level. A run compares scraped values with these
+    to find the keys that moved without loading the rows themselves.
+    """
+
+    # pylint: disable=too-few-public-methods,no-init
+
+    __tablename__ = 'signatures'
+
+    scope = Column(String, primary_key=True)
+    digest = Column(String, nullable=False)
+    keys = Column(Text, default="{}")
+
+    def __repr__(self):
+        return "<Signatures(scope='{0}', digest='{1}')>".format(
+            self.scope, self.digest)
+
+
 class Ao3Stories(Base):
-    """ Represents story records from A03 """
+    """
+    Represents story records from A03, keyed by work id.
+    A negative ref is a placeholder for a work whose id was
+    not known when older databases were migrated. Titles need
+    not be unique; two works can share one, or swap theirs.
+    """
 
     # pylint: disable=too-few-public-methods,no-init
 
     __tablename__ = 'ao3stories'
 
-    title = Column(String, primary_key=True)
+    ref = Column(Integer, primary_key=True, autoincrement=False)
+    title = Column(String, nullable=False)
     hits = Column(Integer, default=0)
     kudos = Column(Integer, default=0)
     comments = Column(Integer, default=0)
     bookmarks = Column(Integer, default=0)
-    ref = Column(Integer, default=0)
+
+    __table_args__ = (
+        Index('ao3_title', "title"),)
 
     def __repr__(self):
-        return "<A03Stories(title='%s')>" % (
-            self.title)
+        return "<A03Stories(ref={0:d}, title='{1}')>".format(
+            self.ref, self.title)
+
+
+def migrate_ao3_stories(engine):
+    """
+    Older databases keyed ao3stories by title, some without a ref
+    column at all. Rebuild such a table keyed by work id. Rows with
+    no known id get a negative placeholder ref, to be matched up by
+    title on the next update. Where a renamed work left two rows
+    with the same id, the newer row is kept. A table already keyed
+    by work id loses the unique index on its titles.
+    """
+    with engine.begin() as conn:
+        cols = conn.exec_driver_sql(
+            "PRAGMA table_info(ao3stories)").fetchall()
+        keys = [col[1] for col in cols if col[5]]
+        if not cols:
+            return
+        if keys == ['ref']:
+            unique = [
+                row[1] for row in conn.exec_driver_sql(
+                    "PRAGMA index_list(ao3stories)") if row[2]]
+            if 'ao3_title' in unique:
+                conn.exec_driver_sql("DROP INDEX ao3_title")
+                conn.exec_driver_sql(
+                    "CREATE INDEX ao3_title ON ao3stories (title)")
+            return
+        ref_expr = "-rowid"
+        if 'ref' in [col[1] for col in cols]:
+            ref_expr = "CASE WHEN ref > 0 THEN ref ELSE -rowid END"
+        conn.exec_driver_sql(
+            "ALTER TABLE ao3stories RENAME TO ao3stories_old")
+        Ao3Stories.__table__.create(conn)
+        conn.exec_driver_sql(
+            "INSERT OR IGNORE INTO ao3stories "
+            "(ref, title, hits, kudos, comments, bookmarks) "
+            "SELECT {0}, title, hits, kudos, comments, bookmarks "
+            "FROM ao3stories_old ORDER BY rowid DESC".format(ref_expr))
+        conn.exec_driver_sql("DROP TABLE ao3stories_old")
+
+
+def migrate_comments(engine):
+    """
+    Older databases could hold the same comment more than once, from
+    runs that read every review page again. Drop the repeats, keeping
+    the first copy, and add the unique index on the natural key.
+    This deletes rows, so it logs how many went.
+    """
+    with engine.begin() as conn:
+        names = set(row[0] for row in conn.exec_driver_sql(
+            "SELECT name FROM sqlite_master"))
+        if 'comments' not in names or 'comment_key' in names:
+            return
+        first = (
+            "SELECT MIN(num) FROM comments GROUP BY {0}".format(
+                ", ".join(COMMENT_KEY)))
+        signed = 0
+        if 'scomments' in names:
+            signed = conn.exec_driver_sql(
+                "DELETE FROM scomments WHERE num NOT IN ({0})".format(
+                    first)).rowcount
+        dropped = conn.exec_driver_sql(
+            "DELETE FROM comments WHERE num NOT IN ({0})".format(
+                first)).rowcount
+        for index in Comments.__table__.indexes:
+            index.create(conn)
+    if dropped or signed:
+        logger = logging.getLogger(__name__)
+        logger.warning(
+            "Removed %d repeated comments (and %d of their signed rows) "
+            "from %s", dropped, signed, engine.url.database)
+
+
+def create_comment_search(engine):
+    """ Build the comment full-text index, if not there yet """
+    with engine.begin() as conn:
+        found = conn.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE name = 'comments_fts'")
+        if found.fetchall():
+            return
+        for sql in COMMENT_SEARCH_SQL:
+            conn.exec_driver_sql(sql)
 
 
 class Favs(Base):
@@ -504,6 +714,84 @@ class Legacy(Base):
             self.views, self.c2s, self.favs, self.alerts)
 
 
+class Runs(Base):
+    """ One run of a scraper that logged its changes """
+
+    # pylint: disable=too-few-public-methods,no-init
+
+    __tablename__ = 'runs'
+
+    run = Column(Integer, primary_key=True)
+    source = Column(String, default="")
+    started = Column(DateTime, default=func.now())
+
+    __table_args__ = (
+        Index('run_started', "started", unique=False),)
+
+    def __repr__(self):
+        return "<Runs(run={0:d}, source='{1}', started='{2}')>".format(
+            self.run, self.source, self.started)
+
+
+class Changes(Base):
+    """
+    Change events from the report of a run, one row per changed field.
+    Level tells what kind of thing changed (story, chapter, country...).
+    """
+
+    # pylint: disable=too-few-public-methods,no-init
+
+    __tablename__ = 'changes'
+
+    num = Column(Integer, primary_key=True)
+    run = Column(Integer, ForeignKey('runs.run'), nullable=False)
+    level = Column(String, nullable=False)
+    ref = Column(Integer, default=0)
+    chap = Column(Integer, default=0)
+    code = Column(Integer, default=0)
+    country = Column(String, default="")
+    field = Column(String, nullable=False)
+    entity = Column(String, default="")
+    old = Column(Integer, default=0)
+    new = Column(Integer, default=0)
+    delta = Column(Integer, default=0)
+
+    __table_args__ = (
+        Index('change_key', "run", "ref", "chap", "country", "field"),
+        Index('change_story', "ref", "level", "run"),
+        Index('change_level', "level", "field", "run"))
+
+    date = relationship("Runs")
+
+    def __repr__(self):
+        str = "<Changes(run={0:d}, level='{1}', ref={2:d}, field='{3}')>"
+        return str.format(self.run, self.level, self.ref, self.field)
+
+
+class RunMetrics(Base):
+    """
+    The timings of a run, one row per series of the instruments:
+    metric and key, count, total and peak seconds, and the cumulative
+    bucket counts as JSON. Counters keep their sum in count.
+    """
+
+    # pylint: disable=too-few-public-methods,no-init
+
+    __tablename__ = 'runmetrics'
+
+    run = Column(Integer, ForeignKey('runs.run'), primary_key=True)
+    metric = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    count = Column(Integer, default=0)
+    total = Column(Float, default=0.0)
+    peak = Column(Float, default=0.0)
+    buckets = Column(Text, default="[]")
+
+    def __repr__(self):
+        return "<RunMetrics(run={0:d}, metric='{1}', key='{2}')>".format(
+            self.run, self.metric, self.key)
+
+
 def legacy_query_to_dict_iter(recs):
     """ turn Legacy table query into dictionary lookup """
     for rec in recs:
@@ -515,19 +803,194 @@ def format_date(month, year):
     return "{}/{}".format(year, month)
 
 
+def prepare_engine(file, echo=False):
+    """ An engine for the database file, with the schema up to date """
+    engine = create_engine("sqlite:///{0}".format(file), echo=echo)
+    migrate_ao3_stories(engine)
+    migrate_comments(engine)
+    Base.metadata.create_all(engine)
+    create_comment_search(engine)
+    return engine
+
+
+# Engines kept open by a long-running process, by (file, echo), and
+# the snapshots of the stored values it keeps with them, by file
+_engines = {}
+_snapshots = {}
+_engines_lock = threading.Lock()
+
+LEGACY_FIELDS = ('chaps', 'reviews', 'views', 'c2s', 'favs', 'alerts')
+
+
+def snapshot_levels():
+    """
+    The tables kept in snapshots: for each, the key column and the
+    columns that pick out one level (one month, one story...).
+    """
+    return {
+        Legacy: ('ref', ()),
+        MStory: ('ref', ('mid',)),
+        MCtry: ('country', ('mid',)),
+        MStoryCtry: ('country', ('mid', 'ref')),
+        MChap: ('chap', ('mid', 'ref')),
+        MChapCtry: ('country', ('mid', 'ref', 'chap')),
+    }
+
+
+def snapshot_values(rec):
+    """ The values a snapshot keeps for a record """
+    if isinstance(rec, Legacy):
+        return dict((name, getattr(rec, name)) for name in LEGACY_FIELDS)
+    return (rec.views or 0, rec.visitors or 0)
+
+
+class Snapshots:
+    """
+    The stored legacy table and month levels, kept by a long-running
+    process so that each cycle compares against memory instead of
+    reading them again. A level is read from the database the first
+    time it is asked for. Values written by a session are staged when
+    it flushes and only kept once it commits.
+    """
+
+    def __init__(self):
+        # (table name, level filters) -> {key: values}
+        self.levels = {}
+        self.lock = threading.Lock()
+
+    def get(self, scope):
+        """ A copy of a level's values, or None if not kept yet """
+        with self.lock:
+            values = self.levels.get(scope)
+            return None if values is None else dict(values)
+
+    def put(self, scope, values):
+        """ Keep a level's values, as just read """
+        with self.lock:
+            self.levels[scope] = dict(values)
+
+    def update(self, staged):
+        """
+        Keep the values a session committed. Levels not kept yet are
+        left to be read when asked for.
+        """
+        with self.lock:
+            for scope, changes in staged.items():
+                values = self.levels.get(scope)
+                if values is None:
+                    continue
+                for key, value in changes.items():
+                    if value is None:
+                        values.pop(key, None)
+                    else:
+                        values[key] = value
+
+    def forget(self, table_name):
+        """ Drop every level of a table written around the session """
+        with self.lock:
+            for scope in [x for x in self.levels if x[0] == table_name]:
+                del self.levels[scope]
+
+
+def open_engine(file, echo=False):
+    """
+    Keep a prepared engine for the database file, so that every
+    ReadMeDb opened on it in this process reuses its connections
+    and skips the schema checks.
+    """
+    with _engines_lock:
+        engine = _engines.get((file, echo))
+        if engine is None:
+            engine = prepare_engine(file, echo)
+            _engines[(file, echo)] = engine
+            _snapshots.setdefault(file, Snapshots())
+        return engine
+
+
+def close_engines():
+    """ Close the connections of the kept engines """
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+        _snapshots.clear()
+
+
 class ReadMeDb:
-    """ Database to store hit levels to compare with new ones """
+    """
+    Database to store hit levels to compare with new ones. On a file
+    kept open with open_engine, the legacy and month values are read
+    from the process's snapshots.
+    """
 
     def __init__(self, file="dbs/readme.db", echo=False):
         self.sql_file = file
-        engine_str = "sqlite:///{0}".format(self.sql_file)
-        self.engine = create_engine(engine_str, echo=echo)
+        self.engine = _engines.get((file, echo))
+        if self.engine is None:
+            self.engine = prepare_engine(file, echo)
         self.titles = {}
         self.legacy = {}
-        Base.metadata.create_all(self.engine)
-        Session.configure(bind=self.engine)
-        self.session = Session()
+        self.session = Session(bind=self.engine)
         self.commit_flag = False
+        self.snapshots = _snapshots.get(file)
+        self.staged = {}
+        if self.snapshots is not None:
+            event.listen(self.session, 'after_flush', self.stage_flush)
+            event.listen(self.session, 'after_commit', self.keep_staged)
+            event.listen(
+                self.session, 'after_rollback', self.drop_staged)
+
+    def stage_flush(self, session, flush_context):
+        """ Stage the snapshot values a flush wrote """
+        # pylint: disable=unused-argument
+        levels = snapshot_levels()
+        for recs, deleted in (
+                (session.new, False), (session.dirty, False),
+                (session.deleted, True)):
+            for rec in recs:
+                level = levels.get(type(rec))
+                if level is None:
+                    continue
+                key_name, filter_names = level
+                scope = (rec.__tablename__, tuple(
+                    getattr(rec, name) for name in filter_names))
+                self.staged.setdefault(scope, {})[
+                    getattr(rec, key_name)] = \
+                    None if deleted else snapshot_values(rec)
+
+    def keep_staged(self, session):
+        """ The commit went through; the snapshots take its values """
+        # pylint: disable=unused-argument
+        self.snapshots.update(self.staged)
+        self.staged = {}
+
+    def drop_staged(self, session):
+        """ The session rolled back, and its values with it """
+        # pylint: disable=unused-argument
+        self.staged = {}
+
+    def snapshot_level(self, scope, read):
+        """
+        The stored values of one level: from the snapshots when kept,
+        with what this session has written since on top.
+        """
+        if self.snapshots is None:
+            return read()
+        self.session.flush()
+        staged = self.staged.get(scope, {})
+        values = self.snapshots.get(scope)
+        if values is None:
+            values = read()
+            # Only what is committed is kept for the next sessions
+            if not staged:
+                self.snapshots.put(scope, values)
+            return values
+        for key, value in staged.items():
+            if value is None:
+                values.pop(key, None)
+            else:
+                values[key] = value
+        return values
 
     def __enter__(self):
         return self
@@ -557,11 +1020,14 @@ class ReadMeDb:
 
     def get_checks_pending(self):
         """ Get the list of stories that need chapter checking """
+        # One join rather than a lazy load of each story
         pending = self.session.query(
-            CheckPend).filter_by(check_pending=1).all()
-        new_pending = [
-            (item.ref, item.story.title) for item in pending]
-        return sorted(new_pending, key=lambda tup: tup[1])
+            CheckPend.ref, Stories.title).join(
+                Stories, Stories.ref == CheckPend.ref).filter(
+                    CheckPend.check_pending == 1).all()
+        return sorted(
+            ((ref, title) for ref, title in pending),
+            key=lambda tup: tup[1])
 
     def clear_checks_pending(self):
         """" CLear the list of stories that need chapter checking """
@@ -570,6 +1036,107 @@ class ReadMeDb:
         for item in pending:
             item.check_pending = 0
 
+    def get_chapters_pending(self, mid):
+        """
+        Get the chapters of a month still waiting for their
+        country breakdown, as ChapPend records.
+        """
+        return self.session.query(ChapPend).filter_by(mid=mid).all()
+
+    def set_chapter_pending(self, mid, ref, chap, ch_ref, delta, deferred):
+        """ Put off the country breakdown of a chapter to a later run """
+        pending = self.session.query(
+            ChapPend).filter_by(mid=mid, ref=ref, chap=chap).first()
+        if not pending:
+            pending = ChapPend(mid=mid, ref=ref, chap=chap)
+            self.session.add(pending)
+        pending.ch_ref = ch_ref
+        pending.delta = delta
+        pending.deferred = deferred
+        return pending
+
+    def clear_chapter_pending(self, mid, ref, chap):
+        """ The country breakdown of a chapter is up to date """
+        self.session.query(
+            ChapPend).filter_by(mid=mid, ref=ref, chap=chap).delete()
+
+    def purge_chapters_pending(self, mid):
+        """
+        Drop the chapters put off in months before mid. Those months
+        are closed, and no run fetches their chapter pages again.
+        Returns the number dropped.
+        """
+        return self.session.query(
+            ChapPend).filter(ChapPend.mid < mid).delete()
+
+    def enqueue_countries(self, codes, due, force=False):
+        """
+        Queue users for a country lookup at the due time. Users
+        already queued keep their place, unless force is set.
+        """
+        rows = [dict(code=code, due=due) for code in set(codes)]
+        if not rows:
+            return
+        stmt = sqlite_insert(CountryQueue)
+        if force:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['code'], set_=dict(due=stmt.excluded.due))
+        else:
+            stmt = stmt.on_conflict_do_nothing()
+        self.session.execute(stmt, rows)
+
+    def get_countries_due(self, now, limit=None):
+        """ Queued (code, attempts) pairs due by now, oldest first """
+        query = self.session.query(
+            CountryQueue.code, CountryQueue.attempts).filter(
+                CountryQueue.due <= now).order_by(CountryQueue.due)
+        if limit is not None:
+            query = query.limit(limit)
+        return [(code, attempts or 0) for code, attempts in query]
+
+    def set_countries(self, lookups, checked):
+        """
+        Store a batch of CountryLookups: the countries found (None for
+        a failed lookup) on the users, and when each is due again.
+        """
+        if not lookups:
+            return
+        found = [
+            dict(code=item.code, country=item.country)
+            for item in lookups if item.country is not None]
+        if found:
+            self.session.execute(update(Users), found)
+        stmt = sqlite_insert(CountryQueue)
+        self.session.execute(stmt.on_conflict_do_update(
+            index_elements=['code'],
+            set_=dict(
+                (name, stmt.excluded[name])
+                for name in ('due', 'checked', 'attempts'))), [
+            dict(code=item.code, due=item.due, checked=checked,
+                 attempts=item.attempts) for item in lookups])
+
+    def get_signatures(self, scope):
+        """
+        Get the signatures cached for a scope by the last run,
+        as (digest, dictionary from key to hash), or None.
+        """
+        rec = self.session.query(
+            Signatures).filter_by(scope=scope).first()
+        if rec is None:
+            return None
+        return rec.digest, json.loads(rec.keys)
+
+    def set_signatures(self, scope, digest, signatures):
+        """ Cache the signatures of a scope for the next run """
+        rec = self.session.query(
+            Signatures).filter_by(scope=scope).first()
+        if rec is None:
+            rec = Signatures(scope=scope)
+            self.session.add(rec)
+        rec.digest = digest
+        rec.keys = json.dumps(signatures, sort_keys=True)
+        return rec
+
     def get_fav_counts(self):
         """ Get story favorites counts """
         fav_counts = self.session.query(
@@ -623,11 +1190,121 @@ class ReadMeDb:
         """ Insert many new ao3 stories at once """
         new_stories = [
             Ao3Stories(
-                title=item["title"], hits=item["hits"], kudos=item["kudos"],
-                comments=item["comments"],
-                bookmarks=item["bookmarks"]) for item in stories]
+                ref=item.ref, title=item.title, hits=item.hits,
+                kudos=item.kudos, comments=item.comments,
+                bookmarks=item.bookmarks) for item in stories]
         self.session.bulk_save_objects(new_stories)
 
+    def get_ao3_values(self):
+        """
+        Get every stored ao3 work in one query, as a dictionary
+        from ref to (title, hits, kudos, comments, bookmarks).
+        """
+        rows = self.session.query(
+            Ao3Stories.ref, Ao3Stories.title, Ao3Stories.hits,
+            Ao3Stories.kudos, Ao3Stories.comments, Ao3Stories.bookmarks)
+        return dict(
+            (ref, (title, hits or 0, kudos or 0, comments or 0,
+                   bookmarks or 0))
+            for ref, title, hits, kudos, comments, bookmarks in rows)
+
+    def rekey_ao3_story(self, old_ref, new_ref):
+        """ Give a placeholder ao3 row its real work id """
+        self.session.query(Ao3Stories).filter_by(
+            ref=old_ref).update({"ref": new_ref})
+
+    def upsert_ao3_stories(self, stories):
+        """
+        Insert or update many ao3 works in one statement,
+        keyed by work id.
+        """
+        if not stories:
+            return
+        stmt = sqlite_insert(Ao3Stories)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['ref'],
+            set_=dict(
+                (name, stmt.excluded[name]) for name in (
+                    'title', 'hits', 'kudos', 'comments', 'bookmarks')))
+        self.session.execute(stmt, [
+            dict(ref=item.ref, title=item.title, hits=item.hits,
+                 kudos=item.kudos, comments=item.comments,
+                 bookmarks=item.bookmarks) for item in stories])
+
+    def get_comment_stamps(self):
+        """ The time of the newest stored comment, by story ref """
+        return dict(self.session.query(
+            Comments.ref, func.max(Comments.stamp)).group_by(Comments.ref))
+
+    def add_comments(self, comments):
+        """
+        Insert many CommentRecs at once, skipping any already stored,
+        and link the signed ones to their users. Returns the count added.
+        """
+        rows = [
+            dict(ref=item.ref, chapter=item.chapter, stamp=item.stamp,
+                 name=item.name, comment=item.comment) for item in comments]
+        if not rows:
+            return 0
+        codes = dict(
+            ((item.ref, item.stamp, item.chapter, item.name), item.code)
+            for item in comments if item.code)
+        stmt = sqlite_insert(Comments).on_conflict_do_nothing(
+            index_elements=list(COMMENT_KEY))
+        added = self.session.execute(stmt.returning(
+            Comments.num, *(Comments.__table__.c[x] for x in COMMENT_KEY)),
+            rows).all()
+        signed = [
+            (row[0], row[4], codes[tuple(row[1:])])
+            for row in added if tuple(row[1:]) in codes]
+        if signed:
+            self.session.execute(
+                sqlite_insert(Users).on_conflict_do_nothing(),
+                [dict(code=code, country="Unknown")
+                 for code in set(x[2] for x in signed)])
+            self.session.execute(
+                sqlite_insert(Aliases).on_conflict_do_nothing(),
+                [dict(code=code, name=name) for _, name, code in signed])
+            self.session.execute(
+                sqlite_insert(SComments),
+                [dict(num=num, code=code) for num, _, code in signed])
+        return len(added)
+
+    def search_comments(self, query, ref=None, chapter=None, limit=20):
+        """
+        CommentHits for an FTS5 query over comment text and reviewer
+        names, best first. Columns can be named, as in 'name: dipper'.
+        Optionally only for one story, or one chapter of it.
+        """
+        sql = (
+            "SELECT c.ref, s.title, c.chapter, c.stamp, c.name, c.comment, "
+            "bm25(comments_fts) AS rank FROM comments_fts "
+            "JOIN comments c ON c.num = comments_fts.rowid "
+            "LEFT JOIN stories s ON s.ref = c.ref "
+            "WHERE comments_fts MATCH :query")
+        params = dict(query=query, limit=limit)
+        if ref is not None:
+            sql += " AND c.ref = :ref"
+            params['ref'] = ref
+        if chapter is not None:
+            sql += " AND c.chapter = :chapter"
+            params['chapter'] = chapter
+        sql += " ORDER BY rank LIMIT :limit"
+        rows = self.session.execute(
+            text(sql).columns(
+                Comments.__table__.c.ref, Stories.__table__.c.title,
+                *(Comments.__table__.c[x] for x in (
+                    'chapter', 'stamp', 'name', 'comment')),
+                rank=Float), params)
+        return [CommentHit._make(row) for row in rows]
+
+    def insert_rows(self, model, rows):
+        """ Insert many rows, as dictionaries, into a table at once """
+        if rows:
+            self.session.execute(model.__table__.insert(), rows)
+            if self.snapshots is not None:
+                self.snapshots.forget(model.__tablename__)
+
     def batch_insert_stories(self, stories):
         """ Insert many new stories at once """
         new_stories = [
@@ -680,12 +1357,12 @@ class ReadMeDb:
         self.session.add(story)
         return story
 
-    def get_or_create_ao3_story(self, title):
-        """ Add to the Stories data table if not there """
-        story = self.session.query(Ao3Stories).filter_by(title=title).first()
+    def get_or_create_ao3_story(self, ref, title):
+        """ Add to the ao3 Stories data table if not there """
+        story = self.session.query(Ao3Stories).filter_by(ref=ref).first()
         if story:
             return story
-        story = Ao3Stories(title=title)
+        story = Ao3Stories(ref=ref, title=title)
         self.session.add(story)
         return story
 
@@ -715,6 +1392,62 @@ class ReadMeDb:
             Monthly).order_by(Monthly.date.desc()).first()
         return last_monthly
 
+    def month_values(self, model, key_col, keys=None, **filters):
+        """
+        Get stored views and visitors for one level of a month,
+        as a dictionary from key to (views, visitors).
+        keys, if given, limits the query to those keys.
+        """
+        if self.snapshots is not None:
+            _, filter_names = snapshot_levels()[model]
+            scope = (model.__tablename__, tuple(
+                filters[name] for name in filter_names))
+            values = self.snapshot_level(
+                scope,
+                lambda: self.read_month_values(model, key_col, None, filters))
+            if keys is None:
+                return values
+            return dict((key, values[key]) for key in keys if key in values)
+        return self.read_month_values(model, key_col, keys, filters)
+
+    def read_month_values(self, model, key_col, keys, filters):
+        """ Read the values of one month level from the database """
+        rows = self.session.query(
+            key_col, model.views, model.visitors).filter_by(**filters)
+        if keys is not None:
+            rows = rows.filter(key_col.in_(keys))
+        return dict(
+            (key, (views or 0, visitors or 0))
+            for key, views, visitors in rows)
+
+    def get_mstory_values(self, mid):
+        """ Stored monthly story totals, keyed by story ref """
+        return self.month_values(MStory, MStory.ref, mid=mid)
+
+    def get_mctry_values(self, mid, keys=None):
+        """ Stored monthly country totals, keyed by country """
+        return self.month_values(MCtry, MCtry.country, keys, mid=mid)
+
+    def get_mstoryctry_values(self, mid, ref, keys=None):
+        """ Stored monthly country totals for a story, keyed by country """
+        return self.month_values(
+            MStoryCtry, MStoryCtry.country, keys, mid=mid, ref=ref)
+
+    def get_mchap_values(self, mid, ref):
+        """ Stored monthly chapter totals for a story, keyed by chapter """
+        return self.month_values(MChap, MChap.chap, mid=mid, ref=ref)
+
+    def get_chapctry_values(self, mid, ref, chap):
+        """ Stored monthly country totals for a chapter, keyed by country """
+        return self.month_values(
+            MChapCtry, MChapCtry.country, mid=mid, ref=ref, chap=chap)
+
+    def get_chapters_dict(self, sref):
+        """ Get the chapter records of one story, keyed by ch_ref """
+        return dict(
+            (rec.ch_ref, rec) for rec in
+            self.session.query(Chapters).filter_by(story_ref=sref))
+
     def get_or_create_mtop(self, mid):
         """ Find or create the monthly top record. """
         rec = self.session.query(
@@ -800,6 +1533,56 @@ class ReadMeDb:
         self.session.add(chapter)
         return chapter
 
+    def log_changes(self, events, source="", started=None):
+        """
+        Save the change events of a run in the changes table.
+        Free text notes are not changes and are left out.
+        Returns the new Runs record.
+        """
+        run = Runs(source=source)
+        if started is not None:
+            run.started = started
+        self.session.add(run)
+        self.session.flush()
+        self.session.bulk_insert_mappings(Changes, [
+            {'run': run.run, 'level': event.level, 'ref': event.ref,
+             'chap': event.chap, 'code': event.code,
+             'country': event.country, 'field': event.field,
+             'entity': event.entity, 'old': event.old, 'new': event.new,
+             'delta': event.delta}
+            for event in events if event.level != 'note'])
+        return run
+
+    def log_metrics(self, run, rows):
+        """
+        Save the summary of a run's instruments against its Runs record,
+        rows as given by Instruments.rows().
+        """
+        self.session.bulk_insert_mappings(RunMetrics, [
+            {'run': run.run, 'metric': metric, 'key': key, 'count': count,
+             'total': total, 'peak': peak, 'buckets': json.dumps(buckets)}
+            for metric, key, count, total, peak, buckets in rows])
+
+    def get_latest_run_metrics(self):
+        """
+        The metrics of the latest run of each source that has any,
+        as a list of (source, started, rows) by source.
+        """
+        latest = self.session.query(
+            func.max(RunMetrics.run)).join(
+                Runs, Runs.run == RunMetrics.run).group_by(Runs.source)
+        runs = self.session.query(Runs).filter(
+            Runs.run.in_(latest.scalar_subquery())).order_by(Runs.source)
+        result = []
+        for run in runs:
+            rows = [
+                (rec.metric, rec.key, rec.count, rec.total, rec.peak,
+                 json.loads(rec.buckets))
+                for rec in self.session.query(RunMetrics).filter_by(
+                    run=run.run).order_by(RunMetrics.metric, RunMetrics.key)]
+            result.append((run.source, run.started, rows))
+        return result
+
     def create_empty_legacy(self, new_ref):
         " Make a new empty rec for given legacy key"
         new_legacy = Legacy(ref=new_ref)
@@ -807,6 +1590,26 @@ class ReadMeDb:
         rec = self.session.query(Legacy).filter_by(ref=new_ref).first()
         return rec
 
+    def get_legacy_values(self):
+        """
+        Get the stored legacy counts, as a dictionary from story
+        ref to a dictionary of the counts.
+        """
+        def read():
+            return dict(
+                (row[0], dict(zip(LEGACY_FIELDS, row[1:])))
+                for row in self.session.query(
+                    Legacy.ref, *(getattr(Legacy, name)
+                                  for name in LEGACY_FIELDS)))
+        return self.snapshot_level(('legacy', ()), read)
+
+    def get_or_create_legacy(self, ref):
+        """ The legacy record of a story, made empty if there is none """
+        rec = self.session.get(Legacy, ref)
+        if rec is None:
+            rec = self.create_empty_legacy(ref)
+        return rec
+
     def get_legacy_table_dict(self):
         """ Get records from the Legacy table """
         self.legacy = {}
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+"""
+Compact tables for scraped rows.
+
+A RecordTable keeps the rows of one record type column by column:
+an array('q') for each numeric field and a plain list for each text
+field. A page of country or chapter counts then costs a few machine
+words per row rather than a tuple per row. Rows still come back as
+the record namedtuple, built only when asked for, and the differ
+reads whole columns straight from the arrays.
+"""
+
+from array import array
+from collections.abc import Mapping, Sequence
+
+
+class RecordTable(Sequence):
+    """ Struct-of-arrays rows of one namedtuple record type """
+
+    def __init__(self, rec_type, text_fields=()):
+        self.rec_type = rec_type
+        self.fields = rec_type._fields
+        self.columns = dict(
+            (field, [] if field in text_fields else array('q'))
+            for field in self.fields)
+        self.ordered = [self.columns[field] for field in self.fields]
+
+    def append(self, *values, **named):
+        """ Add a row, by position or by field name """
+        if named:
+            values = [named[field] for field in self.fields]
+        for column, value in zip(self.ordered, values):
+            column.append(value)
+
+    def __len__(self):
+        return len(self.ordered[0])
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[pos] for pos in range(*idx.indices(len(self)))]
+        return self.rec_type._make(column[idx] for column in self.ordered)
+
+    def __iter__(self):
+        return map(self.rec_type._make, zip(*self.ordered))
+
+    def __eq__(self, other):
+        if isinstance(other, Sequence):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return "<RecordTable({0}, rows={1:d})>".format(
+            self.rec_type.__name__, len(self))
+
+    def column(self, field):
+        """ The stored column for a field, not a copy """
+        return self.columns[field]
+
+    def keyed(self, key_field):
+        """ A read-only mapping view of the rows by one field """
+        return KeyedTable(self, key_field)
+
+
+class KeyedTable(Mapping):
+    """
+    RecordTable rows looked up by a key field, in table order.
+    When a key repeats, the last row wins, as with a dict.
+    """
+
+    def __init__(self, table, key_field):
+        self.table = table
+        self.positions = dict(
+            (key, pos) for pos, key in enumerate(table.column(key_field)))
+
+    def __getitem__(self, key):
+        return self.table[self.positions[key]]
+
+    def __iter__(self):
+        return iter(self.positions)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def column(self, field):
+        """ Values of a field in key order, without copying if possible """
+        column = self.table.column(field)
+        if len(self.positions) == len(self.table):
+            return column
+        return [column[pos] for pos in self.positions.values()]
+
+
+def keyed(recs, key_field):
+    """
+    Rows by a key field: a KeyedTable view for a RecordTable,
+    otherwise a dict of the records.
+    """
+    if isinstance(recs, RecordTable):
+        return recs.keyed(key_field)
+    return dict((getattr(rec, key_field), rec) for rec in recs)
@@ -2,11 +2,28 @@
 
 """
 Change report generator
+
+Changes are recorded as typed events, kept column by column for
+each report section. Nothing is formatted until a renderer asks for
+it: text lines for the log, JSON lines for other tools, or an HTML
+table.
+
+A report can also keep a summary of the top movers: the stories,
+chapters and countries with the biggest view deltas. These are kept
+in bounded heaps as events arrive, so the summary stays the same size
+however many changes a run finds.
+
+With a sink (see reportsink), each section is written out and dropped
+from memory as soon as it is printed, and read back on demand.
 """
 
 import re
+import json
 import logging
-from collections import defaultdict
+from heapq import heappush, heapreplace
+from array import array
+from collections import defaultdict, namedtuple
+from html import escape
 
 
 def uncomma(num_str):
@@ -26,27 +43,220 @@ def print_divider():
     logger.info("-" * 10)
 
 
+ChangeEvent = namedtuple(
+    'ChangeEvent',
+    ['key', 'level', 'entity', 'ref', 'chap', 'code',
+     'country', 'field', 'old', 'new', 'delta'])
+
+
+class EventColumns:
+    """
+    Change events for one report section, stored as columns.
+    Numbers go in compact arrays, the rest in plain lists.
+    """
+
+    __slots__ = (
+        'level', 'entity', 'country', 'field',
+        'ref', 'chap', 'code', 'old', 'new')
+
+    def __init__(self):
+        self.level = []
+        self.entity = []
+        self.country = []
+        self.field = []
+        self.ref = array('q')
+        self.chap = array('q')
+        self.code = array('q')
+        self.old = array('q')
+        self.new = array('q')
+
+    def __len__(self):
+        return len(self.level)
+
+    def append(
+            self, level, field, old, new,
+            entity, ref, chap, code, country):
+        """ Add one event to the columns """
+
+        # pylint: disable=too-many-arguments
+
+        self.level.append(level)
+        self.field.append(field)
+        self.old.append(old or 0)
+        self.new.append(new or 0)
+        self.entity.append(entity)
+        self.ref.append(ref or 0)
+        self.chap.append(chap or 0)
+        self.code.append(code or 0)
+        self.country.append(country)
+
+    def events(self, key):
+        """ Iterate the section as ChangeEvent records """
+        for idx in range(len(self.level)):
+            old = self.old[idx]
+            new = self.new[idx]
+            yield ChangeEvent(
+                key, self.level[idx], self.entity[idx],
+                self.ref[idx], self.chap[idx], self.code[idx],
+                self.country[idx], self.field[idx], old, new, new - old)
+
+
+def event_text(event):
+    """ Format one event as a line of the text report """
+    if event.level == 'note':
+        return event.entity
+    change = "%s %d to %d (delta %d)" % (
+        event.field, event.old, event.new, event.delta)
+    if event.level == 'user':
+        user_part = "'{0}' from '{1}' ({2:d})".format(
+            event.entity, event.country, event.code)
+        if event.ref:
+            return "'%s' %s %s" % (event.key, event.field, user_part)
+        return "%s %s" % (event.field, user_part)
+    if event.level in ('country', 'story_country'):
+        return "country '%s': %s" % (event.country, change)
+    if event.level == 'chapter':
+        return "chapter %d: '%s' %s" % (event.chap, event.entity, change)
+    if event.level == 'chapter_country':
+        return "chapter %d: '%s' for '%s' %s" % (
+            event.chap, event.entity, event.country, change)
+    if event.level == 'legacy':
+        return "'%s' legacy %s" % (event.entity, change)
+    return "'%s' %s" % (event.entity, change)
+
+
+def event_json(event):
+    """ Format one event as a JSON line """
+    return json.dumps(event._asdict(), sort_keys=True)
+
+
+HTML_COLUMNS = [
+    'level', 'entity', 'chap', 'country', 'field', 'old', 'new', 'delta']
+
+
+def event_html_row(event):
+    """ Format one event as an HTML table row """
+    cells = "".join(
+        "<td>%s</td>" % escape(str(getattr(event, name)))
+        for name in HTML_COLUMNS)
+    return "<tr>%s</tr>" % cells
+
+
+MOVER_LEVELS = {
+    'story': 'stories',
+    'chapter': 'chapters',
+    'country': 'countries'}
+
+MOVER_CATEGORIES = ('stories', 'chapters', 'countries')
+
+
+class TopMovers:
+    """
+    The top few view deltas per category, in min-heaps of bounded size.
+    Each offer is O(log k), and anything smaller than the current
+    k-th best is dropped straight away.
+    """
+
+    def __init__(self, top=10):
+        self.top = top
+        self.heaps = {category: [] for category in MOVER_CATEGORIES}
+        self.offered = 0
+
+    def offer(self, category, delta, label):
+        """ Consider one delta; label says what moved """
+        heap = self.heaps[category]
+        self.offered += 1
+        # Ties keep the earlier arrival, hence the negated counter.
+        entry = (delta, -self.offered, label)
+        if len(heap) < self.top:
+            heappush(heap, entry)
+        elif delta > heap[0][0]:
+            heapreplace(heap, entry)
+
+    def ranked(self, category):
+        """ The (delta, label) pairs kept for a category, biggest first """
+        return [
+            (delta, label)
+            for delta, _, label in sorted(self.heaps[category], reverse=True)]
+
+
+def mover_text(category, delta, label):
+    """ Format one top mover as a line of the summary """
+    key, entity, chap, country = label
+    if category == 'chapters':
+        return "'%s' chapter %d: '%s' views +%d" % (key, chap, entity, delta)
+    if category == 'countries':
+        return "country '%s' views +%d" % (country, delta)
+    return "'%s' views +%d" % (key, delta)
+
+
 class ReportGen:
     """
     Take in change information and generate
     an output report.
     """
 
-    def __init__(self, report_title, silent=False, catchup=True):
-        self.report = defaultdict(list)
+    def __init__(
+            self, report_title, silent=False, catchup=True,
+            top=None, detail=True, movers=None, sink=None):
+        """
+        top keeps a summary of the top that many movers, printed
+        at the end of the report. detail=False prints only that
+        summary. movers shares the summary of another report.
+        sink takes each section once it has been printed.
+        """
+
+        # pylint: disable=too-many-arguments
+
+        self.report = defaultdict(EventColumns)
         self.report_title = report_title
         self.silent = silent
         self.false_return = 0
         if catchup:
             self.false_return = 1
         self.used_keys = set()
+        self.detail = detail
+        self.summarise = top is not None
+        if self.summarise:
+            movers = TopMovers(top)
+        self.movers = movers
+        self.sink = sink
+        self.flushed = {}
+
+    def sibling(self, report_title, catchup=True):
+        """
+        A new report feeding the same top movers summary,
+        with the same detail setting.
+        """
+        return ReportGen(
+            report_title, silent=self.silent, catchup=catchup,
+            detail=self.detail, movers=self.movers, sink=self.sink)
+
+    def record(
+            self, key, level, field, old=0, new=0,
+            entity="", ref=0, chap=0, code=0, country=""):
+        """
+        Record a change event under a report section key
+        (usually the story title). Nothing is formatted here.
+        """
+
+        # pylint: disable=too-many-arguments
+
+        self.report[key].append(
+            level, field, old, new, entity, ref, chap, code, country)
+        if self.movers is not None and field == 'views':
+            category = MOVER_LEVELS.get(level)
+            if category:
+                self.movers.offer(
+                    category, (new or 0) - (old or 0),
+                    (key, entity, chap or 0, country))
 
     def line_to_report(self, key, line):
         """
         Add a line to be printed in the change report.
         It will be printed sorted by title.
         """
-        self.report[key].append(line)
+        self.record(key, 'note', '', entity=line)
 
     def compare_totals_by_country(
             self, country, prefix,
@@ -60,11 +270,9 @@ class ReportGen:
         val = grp[val_key]
         old_val = old_grp[prefix + val_key]
         if val != old_val:
-            val_delta = val - old_val
-            self.line_to_report(
-                "Monthly",
-                "country '%s': %s %d to %d (delta %d)" %
-                (country, val_key, old_val, val, val_delta))
+            self.record(
+                "Monthly", 'country', val_key, old_val, val,
+                country=country)
             return 1
         return self.false_return
 
@@ -79,11 +287,9 @@ class ReportGen:
         val = grp[val_key]
         old_val = old_grp[prefix + val_key]
         if val != old_val:
-            val_delta = val - old_val
-            self.line_to_report(
-                s_title,
-                "country '%s': %s %d to %d (delta %d)" %
-                (country, val_key, old_val, val, val_delta))
+            self.record(
+                s_title, 'story_country', val_key, old_val, val,
+                entity=s_title, country=country)
             return 1
         return self.false_return
 
@@ -104,26 +310,20 @@ class ReportGen:
         val = grp[val_key]
         old_val = old_grp.get(prefix + val_key, 0)
         if val != old_val:
-            val_delta = val - old_val
-            self.line_to_report(
-                s_title,
-                "chapter %d: '%s' for '%s' %s %d to %d (delta %d)" %
-                (ch_num, ch_title, country, val_key, old_val, val, val_delta))
+            self.record(
+                s_title, 'chapter_country', val_key, old_val, val,
+                entity=ch_title, chap=ch_num, country=country)
             return 1
         return self.false_return
 
     def compare_and_print_chapter(
             self, s_title, ch_num, ch_title, prefix, val_key, grp, old_grp):
         """
-        This needs to be a deeper and more subtle version of the one below.
-        The title I will index to is not the same as the title of the item.
-        There is a depth of details as well, like the chapter number and
-        sometimes the country. This will take considerable new work.
+        Record a chapter level change, indexed by the story title.
 
            Title of the story, for indexing
            Number of the chapter
            Title of the chapter
-           Country name, if this is a by-country update.
            val-key, as before it's the key for comparison (views or visitors)
            prefix was 'm_' and for chapters I will want 'c_'
         """
@@ -133,19 +333,17 @@ class ReportGen:
         val = grp[val_key]
         old_val = old_grp.get(prefix + val_key, 0)
         if val != old_val:
-            val_delta = val - old_val
-            self.line_to_report(
-                s_title,
-                "chapter %d: '%s' %s %d to %d (delta %d)" %
-                (ch_num, ch_title, val_key, old_val, val, val_delta))
+            self.record(
+                s_title, 'chapter', val_key, old_val, val,
+                entity=ch_title, chap=ch_num)
             return 1
         return 0
 
     def compare_and_print(
-            self, title, val_key, grp, old_grp, prefix="", extra=""):
+            self, title, val_key, grp, old_grp, prefix="", level="story"):
         """
         Compare old and new values, recording a change
-        line for later printing
+        event for later printing
         """
 
         # pylint: disable=too-many-arguments
@@ -153,15 +351,29 @@ class ReportGen:
         val = grp[val_key]
         old_val = old_grp.get(prefix + val_key, 0)
         if val != old_val:
-            val_delta = val - old_val
-            self.line_to_report(
-                title,
-                "'%s' %s%s %d to %d (delta %d)" %
-                (title, extra, val_key, old_val, val, val_delta))
-        if val != old_val:
+            self.record(
+                title, level, val_key, old_val, val,
+                entity=title, ref=grp.get('ref', 0))
             return 1
         return 0
 
+    def report_change(self, key, level, change, **columns):
+        """
+        Record an event for one Change from a monthly change set.
+        The other columns (entity, ref, chap, country) say what changed.
+        """
+        self.record(
+            key, level, change.field, change.old, change.new, **columns)
+
+    def report_user(self, key, detail, alias, country, code, ref=0):
+        """ Record a user that added or removed a fav or follow """
+
+        # pylint: disable=too-many-arguments
+
+        self.record(
+            key, 'user', detail, entity=alias,
+            ref=ref, code=code, country=country)
+
     def set_catchup(self, catchup):
         self.false_return = 0
         if catchup:
@@ -169,27 +381,106 @@ class ReportGen:
 
     def get_report_len(self):
         """ Get the length of the report """
-        return len(self.report.keys())
+        return len(self.section_keys())
+
+    def section_keys(self):
+        """ Keys of all sections, in memory or already in the sink """
+        return sorted(set(self.report) | set(self.flushed))
+
+    def events(self, key=None):
+        """ Iterate recorded events, for one key or the whole report """
+        if key is None:
+            for section_key in self.section_keys():
+                yield from self.events(section_key)
+            return
+        if key in self.flushed:
+            yield from self.sink.read_section(self.flushed[key])
+        section = self.report.get(key)
+        if section:
+            yield from section.events(key)
+
+    def flush_section(self, key):
+        """ Hand a finished section to the sink and forget it """
+        if self.sink is None or key in self.flushed:
+            return
+        section = self.report.pop(key, None)
+        if section:
+            self.flushed[key] = self.sink.write_section(
+                self.report_title, key, section.events(key))
+
+    def text_lines(self, key):
+        """ Render one section of the report as text lines """
+        return [event_text(event) for event in self.events(key)]
+
+    def write_json_lines(self, stream):
+        """ Render the whole report as JSON lines, one event per line """
+        for event in self.events():
+            stream.write(event_json(event) + "\n")
+
+    def write_html(self, stream):
+        """ Render the whole report as HTML tables, one per section """
+        stream.write("<h2>%s</h2>\n" % escape(str(self.report_title)))
+        for key in self.section_keys():
+            stream.write("<h3>%s</h3>\n<table>\n" % escape(str(key)))
+            stream.write("<tr>%s</tr>\n" % "".join(
+                "<th>%s</th>" % name for name in HTML_COLUMNS))
+            for event in self.events(key):
+                stream.write(event_html_row(event) + "\n")
+            stream.write("</table>\n")
+
+    def save(self, json_path=None, html_path=None):
+        """ Render the report to JSON lines and/or HTML files """
+        if json_path:
+            with open(json_path, 'w') as stream:
+                self.write_json_lines(stream)
+        if html_path:
+            with open(html_path, 'w') as stream:
+                self.write_html(stream)
 
     def print_keyed_section(self, key):
         """ Print one section of a report, by the key (usually title) """
         if key in self.used_keys:
             return
         self.used_keys.add(key)
-        if self.report[key]:
+        if self.detail and self.report.get(key):
+            lines = self.text_lines(key)
             logger = logging.getLogger(__name__)
-            if key not in self.report[key][0]:
+            if str(key) not in lines[0]:
                 # Title if not there
                 logger.info(key)
-            for line in self.report[key]:
+            for line in lines:
                 logger.info(line)
+        self.flush_section(key)
+
+    def summary_lines(self):
+        """ Render the top movers summary as text lines """
+        if self.movers is None:
+            return []
+        lines = []
+        for category in MOVER_CATEGORIES:
+            ranked = self.movers.ranked(category)
+            if ranked:
+                lines.append("Top %d %s" % (len(ranked), category))
+                lines.extend(
+                    mover_text(category, delta, label)
+                    for delta, label in ranked)
+        return lines
 
     def print_report(self):
-        """ Print out a sorted report of the changes collected """
+        """
+        Print out a sorted report of the changes collected,
+        then the top movers summary if this report keeps one.
+        """
         if not self.silent:
             for key in sorted(self.report):
                 self.print_keyed_section(key)
-            print_divider()
+            if self.detail:
+                print_divider()
+            if self.summarise:
+                logger = logging.getLogger(__name__)
+                for line in self.summary_lines():
+                    logger.info(line)
+                print_divider()
 
 
 def main():
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+"""
+Streaming sink for change reports.
+
+Finished report sections are appended to segment files as JSON
+lines, one event per line, as soon as they are printed. A small
+index file records where each section went, so the sorted report
+can be rebuilt later by sorting the index rather than the events.
+Segments roll over at a size limit and the oldest are removed,
+with their index entries, so the sink never holds more than one
+section in memory. A sink only removes segments of earlier runs,
+since its own report is read back from the ones it writes.
+"""
+
+import os
+import re
+import sys
+import glob
+import json
+import socket
+import logging
+from collections import namedtuple
+from dyrm.reportgen import ChangeEvent, event_json, event_text
+
+SectionEntry = namedtuple(
+    'SectionEntry', ['title', 'key', 'segment', 'offset', 'length', 'events'])
+
+
+def open_report_stream(target):
+    """
+    Open an extra destination for the report lines:
+    '-' for stdout, host:port for a socket, otherwise a path
+    (which may be a named pipe).
+    """
+    if target == '-':
+        return sys.stdout
+    match = re.match(r'^([\w.-]+):(\d+)$', target)
+    if match:
+        conn = socket.create_connection(
+            (match.group(1), int(match.group(2))))
+        return conn.makefile('w', encoding='utf-8')
+    return open(target, 'a', encoding='utf-8')
+
+
+class ReportSink:
+    """
+    Rotating store of finished report sections, appended to as they
+    are printed.
+    """
+
+    def __init__(
+            self, path, max_bytes=10 * 1024 * 1024, backups=5, stream=None):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.stream = stream
+        self.segment = self.last_segment() or 1
+        # Segments from here on hold this run's report
+        self.first_segment = self.segment
+        self.seg_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def segment_path(self, segment):
+        """ File name of a numbered segment """
+        return "{}.{:04d}".format(self.path, segment)
+
+    def segments(self):
+        """ Numbers of the segment files on disk, oldest first """
+        found = []
+        for name in glob.glob(glob.escape(self.path) + ".[0-9][0-9][0-9]*"):
+            suffix = name[len(self.path) + 1:]
+            if suffix.isdigit():
+                found.append(int(suffix))
+        return sorted(found)
+
+    def last_segment(self):
+        """ Newest segment on disk, or None """
+        found = self.segments()
+        return found[-1] if found else None
+
+    def open_segment(self):
+        """ Open the current segment, rolling over when it is full """
+        if self.seg_file is None:
+            self.seg_file = open(self.segment_path(self.segment), 'ab')
+        if self.seg_file.tell() >= self.max_bytes:
+            self.seg_file.close()
+            self.segment += 1
+            self.seg_file = open(self.segment_path(self.segment), 'ab')
+            self.remove_old_segments()
+        return self.seg_file
+
+    def remove_old_segments(self):
+        """
+        Keep only the newest backups segments, but none this sink
+        wrote, and drop the removed ones from the index.
+        """
+        old = [
+            segment for segment in self.segments()[:-self.backups]
+            if segment < self.first_segment]
+        for segment in old:
+            os.remove(self.segment_path(segment))
+        if old:
+            self.prune_index(set(self.segments()))
+
+    def prune_index(self, kept):
+        """ Rewrite the index with only the sections of kept segments """
+        if not os.path.exists(self.index_path):
+            return
+        temp_path = self.index_path + ".tmp"
+        with open(self.index_path, encoding='utf-8') as index, \
+                open(temp_path, 'w', encoding='utf-8') as pruned:
+            for line in index:
+                if json.loads(line)['segment'] in kept:
+                    pruned.write(line)
+        os.replace(temp_path, self.index_path)
+
+    def write_section(self, title, key, events):
+        """
+        Append one finished section and index it.
+        Returns the SectionEntry, which is enough to read it back.
+        """
+        seg_file = self.open_segment()
+        offset = seg_file.tell()
+        count = 0
+        for event in events:
+            line = event_json(event) + "\n"
+            seg_file.write(line.encode('utf-8'))
+            if self.stream is not None:
+                self.stream.write(line)
+            count += 1
+        seg_file.flush()
+        entry = SectionEntry(
+            title, key, self.segment, offset, seg_file.tell() - offset, count)
+        with open(self.index_path, 'a', encoding='utf-8') as index:
+            index.write(json.dumps(entry._asdict()) + "\n")
+        if self.stream is not None:
+            self.stream.flush()
+        return entry
+
+    def read_section(self, entry):
+        """ Read back the events of one indexed section """
+        try:
+            with open(self.segment_path(entry.segment), 'rb') as seg_file:
+                seg_file.seek(entry.offset)
+                data = seg_file.read(entry.length).decode('utf-8')
+        except FileNotFoundError:
+            logger = logging.getLogger(__name__)
+            logger.warning(
+                "Report segment %d was rotated away", entry.segment)
+            return
+        for line in data.splitlines():
+            yield ChangeEvent(**json.loads(line))
+
+    def read_index(self):
+        """ All index entries whose segment is still on disk """
+        kept = set(self.segments())
+        if not os.path.exists(self.index_path):
+            return []
+        with open(self.index_path, encoding='utf-8') as index:
+            entries = [SectionEntry(**json.loads(line)) for line in index]
+        return [entry for entry in entries if entry.segment in kept]
+
+    def sorted_sections(self, title=None):
+        """
+        The indexed sections sorted by key, optionally for one
+        report title, as (entry, events) pairs read on demand.
+        """
+        entries = [
+            entry for entry in self.read_index()
+            if title is None or entry.title == title]
+        entries.sort(
+            key=lambda entry: (str(entry.key), entry.segment, entry.offset))
+        for entry in entries:
+            yield entry, self.read_section(entry)
+
+    def close(self):
+        """ Close the current segment and any extra stream """
+        if self.seg_file is not None:
+            self.seg_file.close()
+            self.seg_file = None
+        if self.stream not in (None, sys.stdout):
+            self.stream.close()
+        self.stream = None
+
+
+def print_sorted_report(path, title=None):
+    """ Rebuild the sorted text report from the sink's index """
+    logger = logging.getLogger(__name__)
+    with ReportSink(path) as sink:
+        last_key = None
+        for entry, events in sink.sorted_sections(title):
+            if entry.key != last_key:
+                logger.info(entry.key)
+                last_key = entry.key
+            for event in events:
+                logger.info(event_text(event))
+
+
+def main(path="logs/report.jsonl"):
+    """ Print the sorted report kept in a sink """
+    logging.basicConfig(format='%(message)s', level=logging.INFO)
+    print_sorted_report(path)
+
+
+# Rebuild the sorted report from a sink.
+if __name__ == "__main__":
+    main(*sys.argv[1:2])
@@ -0,0 +1,11 @@
+#!/usr/bin/env python
+
+"""
+Base urls of the sites we crawl.
+
+Kept apart from the page getter, like the throttles, so code that
+only needs a url does not have to load the page parsers.
+"""
+
+FFN_URL = "https://www.fanfiction.net"
+AO3_URL = "https://archiveofourown.org"
@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+
+"""
+Local stand-in for fanfiction.net and ao3, for end-to-end tests and
+benchmarks with no network.
+
+A StandinServer answers on localhost at the paths the crawl reads:
+/stats/story_eyes.php, story_eyes_story.php, story_eyes_chapter.php,
+story.php, part.php and user.php, /u/<id> and ao3's
+/users/<user>/works. The pages come from a SyntheticAuthor
+(AuthorPages) or from the saved pages in tests/ (FixturePages).
+
+Faults make it behave like a slow or flaky site: a latency with
+jitter before each reply, a share of 503 errors, of "You must be
+logged in" pages and of replies that hang past the client timeout,
+and a bandwidth limit on the bodies. Connections are kept alive, so
+a session's connection pool works as it does against the site.
+
+    python -m dyrm.standin --scale 10 --latency 0.2 --jitter 0.1
+    ./ffm.py -d dbs/big.db --site http://127.0.0.1:8632 -t 0
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import argparse
+import threading
+import urllib.parse
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_STANDIN_PORT = 8632
+
+Faults = namedtuple(
+    'Faults',
+    ['latency', 'jitter', 'error_rate', 'logout_rate', 'hang_rate', 'hang',
+     'bandwidth'])
+
+# Latency and jitter and hang are in seconds, bandwidth in bytes per
+# second (0 for no limit), the rates are shares of the requests.
+NO_FAULTS = Faults(
+    latency=0.0, jitter=0.0, error_rate=0.0, logout_rate=0.0,
+    hang_rate=0.0, hang=30.0, bandwidth=0)
+
+LOGGED_OUT = (
+    b"<html><body><div class='panel'>You must be logged in to view "
+    b"this page.</div></body></html>")
+
+# Saved page served for each path
+FIXTURE_PAGES = {
+    "/stats/story_eyes.php": "test_story_eyes.php",
+    "/stats/story_eyes_story.php": "test_chapter_page.php",
+    "/stats/story_eyes_chapter.php": "test_chapter_single.php",
+    "/stats/story.php": "test_legacy.php",
+    "/stats/part.php": "part_favs.php",
+    "/stats/user.php": "user_fav.php",
+    "/u/": "user_prof.php",
+}
+
+USER_PATH = re.compile(r"^/u/([0-9]+)/?")
+WORKS_PATH = re.compile(r"^/users/[^/]+/works$")
+
+
+def query_int(query, name, default=None):
+    """ An integer from the parsed query string """
+    values = query.get(name)
+    if not values:
+        return default
+    return int(values[0])
+
+
+class AuthorPages:
+    """ Pages rendered from a SyntheticAuthor """
+
+    def __init__(self, author):
+        self.author = author
+        # The author keeps the month it rendered last; one at a time
+        self.lock = threading.Lock()
+
+    def month_index(self, query):
+        """ The month asked for, the latest if none """
+        month = query_int(query, 'month')
+        year = query_int(query, 'year')
+        if month is None or year is None:
+            return -1
+        start_year, start_month = self.author.start
+        index = (year - start_year) * 12 + month - start_month
+        if 0 <= index < self.author.scale.months:
+            return index
+        return -1
+
+    def render(self, path, query):
+        """ The page as bytes, or None where there is none """
+        author = self.author
+        index = self.month_index(query)
+        routes = {
+            "/stats/story_eyes.php": lambda: author.story_eyes_page(index),
+            "/stats/story_eyes_story.php": lambda: author.story_chapters_page(
+                query_int(query, 'storyid'), index),
+            "/stats/story_eyes_chapter.php":
+                lambda: author.chapter_single_page(
+                    query_int(query, 'storytextid'), index),
+            "/stats/story.php": author.legacy_page,
+            "/stats/part.php": lambda: author.part_page(
+                query_int(query, 'storyid'), query.get('part', [''])[0]),
+            "/stats/user.php": lambda: author.user_page(
+                query.get('action', [''])[0]),
+        }
+        render = routes.get(path)
+        match = USER_PATH.match(path)
+        if match:
+            render = lambda: author.profile_page(int(match.group(1)))
+        elif WORKS_PATH.match(path):
+            render = lambda: author.works_page(query_int(query, 'page', 1))
+        if render is None:
+            return None
+        try:
+            with self.lock:
+                return render().encode('utf-8')
+        except (KeyError, TypeError):
+            return None
+
+
+class FixturePages:
+    """ The saved pages, whatever the ids in the query """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.pages = {}
+
+    def render(self, path, query):
+        """ The saved page for the path as bytes, or None """
+        # pylint: disable=unused-argument
+        name = FIXTURE_PAGES.get(path)
+        if USER_PATH.match(path):
+            name = FIXTURE_PAGES["/u/"]
+        if name is None:
+            return None
+        if name not in self.pages:
+            with open(os.path.join(self.folder, name), 'rb') as page_file:
+                self.pages[name] = page_file.read()
+        return self.pages[name]
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """ One GET, slowed or broken as the server's faults say """
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        """ Answer with the page for the path, or a fault """
+        # pylint: disable=invalid-name
+        standin = self.server.standin
+        faults = standin.faults
+        url = urllib.parse.urlsplit(self.path)
+        fault, delay = standin.choose_fault()
+        time.sleep(delay)
+        if fault == "hang":
+            time.sleep(faults.hang)
+            self.close_connection = True
+            standin.count(url.path, 0, 0)
+            return
+        if fault == "error":
+            self.reply(503, b"")
+            standin.count(url.path, 503, 0)
+            return
+        body = standin.source.render(
+            url.path, urllib.parse.parse_qs(url.query))
+        if body is None:
+            self.reply(404, b"")
+            standin.count(url.path, 404, 0)
+            return
+        if fault == "logout":
+            body = LOGGED_OUT
+        try:
+            self.reply(200, body, faults.bandwidth)
+        except OSError:
+            # The client gave up on a slow body
+            self.close_connection = True
+        standin.count(url.path, 200, len(body))
+
+    def reply(self, status, body, bandwidth=0):
+        """ Send the body, paced to the bandwidth if there is one """
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not bandwidth:
+            self.wfile.write(body)
+            return
+        start = time.monotonic()
+        chunk = max(512, bandwidth // 20)
+        for sent in range(0, len(body), chunk):
+            self.wfile.write(body[sent:sent + chunk])
+            self.wfile.flush()
+            wait = start + (sent + chunk) / bandwidth - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+
+    def log_message(self, format, *args):
+        # pylint: disable=redefined-builtin
+        pass
+
+
+class StandinServer:
+    """ The stand-in site, served from a thread """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, source, faults=NO_FAULTS, port=0, seed=0):
+        self.source = source
+        self.faults = faults
+        self.port = port
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.server = None
+        self.thread = None
+        self.requests = 0
+        self.bytes_sent = 0
+        self.statuses = {}
+        self.paths = {}
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.stop()
+
+    @property
+    def url(self):
+        """ The base url to crawl instead of the site's """
+        return "http://127.0.0.1:{0:d}".format(self.port)
+
+    def start(self):
+        """ Listen on localhost, on a free port if the port is 0 """
+        self.server = ThreadingHTTPServer(
+            ("127.0.0.1", self.port), StandinHandler)
+        self.server.standin = self
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, name="standin", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """ Stop listening; hanging replies are left to time out """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def choose_fault(self):
+        """ (fault or None, seconds to wait first) for one request """
+        faults = self.faults
+        with self.lock:
+            delay = max(0.0, faults.latency + self.rng.uniform(
+                -faults.jitter, faults.jitter))
+            roll = self.rng.random()
+        for fault, rate in (
+                ("error", faults.error_rate), ("logout", faults.logout_rate),
+                ("hang", faults.hang_rate)):
+            if roll < rate:
+                return fault, delay
+            roll -= rate
+        return None, delay
+
+    def count(self, path, status, size):
+        """ Count a reply; status 0 for a hang """
+        with self.lock:
+            self.requests += 1
+            self.bytes_sent += size
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.paths[path] = self.paths.get(path, 0) + 1
+
+    def stats(self):
+        """ Counts of the replies so far, as a dictionary fit for JSON """
+        with self.lock:
+            return dict(
+                requests=self.requests, bytes=self.bytes_sent,
+                statuses=dict(
+                    (str(status), count)
+                    for status, count in self.statuses.items()),
+                paths=dict(self.paths))
+
+
+def main(argv=None):
+    """ Serve a synthetic author, or the saved pages, until interrupted """
+    parser = argparse.ArgumentParser(prog="python -m dyrm.standin")
+    parser.add_argument("-p", "--port", type=int, default=DEFAULT_STANDIN_PORT)
+    parser.add_argument(
+        "-f", "--fixtures", help="serve the saved pages in this folder")
+    parser.add_argument(
+        "-s", "--scale", type=float, default=1.0,
+        help="size of the synthetic author, times the test author")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--errors", type=float, default=0.0,
+                        help="share of requests answered 503")
+    parser.add_argument("--logouts", type=float, default=0.0,
+                        help="share of requests answered logged out")
+    parser.add_argument("--hangs", type=float, default=0.0,
+                        help="share of requests never answered")
+    parser.add_argument("--hang", type=float, default=30.0,
+                        help="seconds a hanging request is held")
+    parser.add_argument("--bandwidth", type=int, default=0,
+                        help="bytes per second per reply, 0 for no limit")
+    args = parser.parse_args(argv)
+
+    # pylint: disable=import-outside-toplevel
+    if args.fixtures:
+        source = FixturePages(args.fixtures)
+    else:
+        from dyrm.synthetic import SyntheticAuthor, scaled
+        source = AuthorPages(SyntheticAuthor(scaled(args.scale), args.seed))
+    faults = Faults(
+        args.latency, args.jitter, args.errors, args.logouts, args.hangs,
+        args.hang, args.bandwidth)
+    standin = StandinServer(source, faults, args.port, args.seed).start()
+    print("Serving on", standin.url)
+    try:
+        standin.thread.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        standin.stop()
+        print(standin.stats())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+"""
+One timing of each database statement, shared by whatever wants it.
+
+The run instruments, the sql profile and the query auditor all want
+the time of each statement an engine runs. Rather than each hang its
+own pair of listeners on the engine, they subscribe to the one
+StatementTimer of the engine (or of the Engine class, for every
+engine), which calls each subscriber with the statement and its
+seconds:
+
+    with timed_statements(read_db.engine, count):
+        ...
+
+A statement that fails has its start time dropped when the error is
+handled, so a pooled connection never carries it into its next use.
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+from sqlalchemy import event
+
+_timers = {}
+_timers_lock = threading.Lock()
+
+
+class StatementTimer:
+    """ Time the statements of one event target for its subscribers """
+
+    def __init__(self, target):
+        self.target = target
+        self.start_key = ('statement_starts', id(self))
+        self.subscribers = []
+
+    def listen(self):
+        """ Start timing the target's statements """
+        event.listen(self.target, 'before_cursor_execute', self.before)
+        event.listen(self.target, 'after_cursor_execute', self.after)
+        event.listen(self.target, 'handle_error', self.error)
+
+    def remove(self):
+        """ Stop timing the target's statements """
+        event.remove(self.target, 'before_cursor_execute', self.before)
+        event.remove(self.target, 'after_cursor_execute', self.after)
+        event.remove(self.target, 'handle_error', self.error)
+
+    def before(self, conn, cursor, statement, *args):
+        """ Note when a statement starts """
+        # pylint: disable=unused-argument
+        conn.info.setdefault(self.start_key, []).append(time.perf_counter())
+
+    def after(self, conn, cursor, statement, *args):
+        """ Pass the time of a statement to each subscriber """
+        # pylint: disable=unused-argument
+        starts = conn.info.get(self.start_key)
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        for subscriber in list(self.subscribers):
+            subscriber(statement, elapsed)
+
+    def error(self, context):
+        """ A statement failed; forget when it started """
+        conn = context.connection
+        if conn is None or context.statement is None:
+            return
+        starts = conn.info.get(self.start_key)
+        if starts:
+            starts.pop()
+
+
+@contextmanager
+def timed_statements(target, subscriber):
+    """
+    Call subscriber(statement, seconds) for each statement the
+    target, an engine or the Engine class, runs in the block.
+    """
+    with _timers_lock:
+        timer = _timers.get(target)
+        if timer is None:
+            timer = _timers[target] = StatementTimer(target)
+            timer.listen()
+        timer.subscribers.append(subscriber)
+    try:
+        yield timer
+    finally:
+        with _timers_lock:
+            timer.subscribers.remove(subscriber)
+            if not timer.subscribers:
+                timer.remove()
+                del _timers[target]
@@ -0,0 +1,726 @@
+#!/usr/bin/env python
+
+"""
+Synthetic author data for testing at scale.
+
+A SyntheticAuthor is made up from a Scale and a seed: stories with
+a few chapters each, readers from many countries, favs, follows and
+comments, and a run of months of views. The sizes are skewed the way
+real ones are: a few stories and countries get most of the views,
+chapter counts and lengths are lognormal, readers drop off chapter
+by chapter, and a few readers fav many stories.
+
+The same author can fill a ReadMeDb and render the pages the crawl
+reads (story_eyes, story_eyes_story, story_eyes_chapter, story.php,
+part.php, user.php and the user profiles) in the site's markup, with
+matching numbers. A month's views are made up from the seed and the
+month alone, so any month can be rendered without the ones before.
+
+    python -m dyrm.synthetic dbs/big.db --scale 10 --pages pages10
+"""
+
+import os
+import sys
+import math
+import random
+import argparse
+import datetime
+import functools
+import itertools
+from html import escape
+from collections import namedtuple
+from dyrm.readme_db import ReadMeDb, CommentRec
+from dyrm.readme_db import Stories, Chapters, Legacy, Users, Aliases
+from dyrm.readme_db import Favs, Follows, FavMe, FollowMe, Months, MTop
+from dyrm.readme_db import MStory, MCtry, MStoryCtry, MChap, MChapCtry
+
+Scale = namedtuple(
+    'Scale',
+    ['stories', 'chapters', 'months', 'countries', 'users',
+     'favs', 'follows', 'comments'])
+
+# About the size of the author in tests/readme.db; chapters is the
+# mean per story
+BASE_SCALE = Scale(
+    stories=105, chapters=6, months=12, countries=60, users=1100,
+    favs=1300, follows=750, comments=3000)
+
+# Views of all stories in a month, at BASE_SCALE
+BASE_VIEWS = 3200
+
+COUNTRIES = (
+    "United States", "United Kingdom", "Canada", "Australia",
+    "Philippines", "Germany", "India", "Mexico", "Brazil", "France",
+    "Netherlands", "Sweden", "New Zealand", "Poland", "Indonesia",
+    "Malaysia", "Singapore", "Spain", "Italy", "Ireland", "Norway",
+    "Denmark", "Finland", "Russia", "South Africa", "Argentina", "Chile",
+    "Japan", "China", "Vietnam", "Thailand", "Romania", "Portugal",
+    "Belgium", "Austria", "Switzerland", "Czech Republic", "Hungary",
+    "Greece", "Turkey", "Israel", "Egypt", "Algeria", "Morocco",
+    "Nigeria", "Kenya", "Colombia", "Peru", "Venezuela", "Ukraine",
+    "South Korea", "Taiwan", "Hong Kong", "Pakistan", "Bangladesh",
+    "Saudi Arabia", "United Arab Emirates", "Croatia", "Serbia",
+    "Estonia")
+
+WORDS = (
+    "amber", "broken", "crystal", "distant", "ember", "fallen", "gilded",
+    "hidden", "iron", "jade", "lost", "midnight", "quiet", "silver",
+    "winter", "wandering", "crimson", "hollow", "last", "secret")
+THINGS = (
+    "song", "falls", "war", "tale", "garden", "key", "crown", "river",
+    "letters", "summer", "shadow", "promise", "house", "road", "storm",
+    "gate", "wings", "mirror", "harbor", "lantern")
+REMARKS = (
+    "Loved this chapter", "Please update soon", "Great story so far",
+    "I did not see that coming", "The ending made me cry",
+    "Can't wait for more", "This is my favorite fic", "Poor Dipper",
+    "Such a good twist", "The dialogue is wonderful",
+    "Reread it three times", "Why would you do that to them")
+DAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+
+SyntheticMonth = namedtuple(
+    'SyntheticMonth',
+    ['mid', 'year', 'month', 'day', 'views', 'visitors', 'days',
+     'stories', 'chapters', 'countries', 'story_countries',
+     'chapter_countries'])
+
+
+def scaled(factor, base=BASE_SCALE):
+    """ The base scale with the counts, not the shape, times factor """
+    return base._replace(**dict(
+        (field, max(1, int(round(getattr(base, field) * factor))))
+        for field in ('stories', 'users', 'favs', 'follows', 'comments')))
+
+
+@functools.lru_cache(maxsize=256)
+def zipf_weights(count, exponent=1.0):
+    """ Weights for ranks 1 to count, falling off as a power law """
+    return tuple(1.0 / (rank ** exponent) for rank in range(1, count + 1))
+
+
+def cumulative(weights):
+    """ Running totals of weights, to draw many times with choices """
+    return list(itertools.accumulate(weights))
+
+
+def allocate(total, weights, rng, cum_weights=None):
+    """
+    Split a count in proportion to the weights; the remainder goes
+    at random by weight, so that small counts spread thinly.
+    """
+    if cum_weights is None:
+        cum_weights = cumulative(weights)
+    whole = cum_weights[-1]
+    if total < len(weights):
+        shares = [0] * len(weights)
+    else:
+        shares = [int(total * weight / whole) for weight in weights]
+    left = total - sum(shares)
+    if left > 0:
+        for index in rng.choices(
+                range(len(weights)), cum_weights=cum_weights, k=left):
+            shares[index] += 1
+    return shares
+
+
+def visitors_for(views, ratio):
+    """ Visitors for a count of views, at least one where there are any """
+    if views <= 0:
+        return 0
+    return max(1, int(views * ratio))
+
+
+def add_months(year, month, count):
+    """ The (year, month) count months on """
+    index = year * 12 + month - 1 + count
+    return index // 12, index % 12 + 1
+
+
+def story_title(rng):
+    """ A made up story title """
+    return "{0} {1}".format(
+        rng.choice(WORDS).title(), rng.choice(THINGS).title())
+
+
+class SyntheticAuthor:
+    """ An author's stories, readers and monthly views, made up """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, scale=BASE_SCALE, seed=0, start=(2016, 1)):
+        self.scale = scale
+        self.seed = seed
+        self.start = start
+        self._month_cache = {}
+        self._legacy = None
+        rng = random.Random("{0}:author".format(seed))
+        self.countries = list(COUNTRIES[:scale.countries]) + [
+            "Country {0:d}".format(num)
+            for num in range(len(COUNTRIES) + 1, scale.countries + 1)]
+        self.country_weights = zipf_weights(len(self.countries), 1.3)
+        self.country_cum = cumulative(self.country_weights)
+        self.make_stories(rng)
+        self.make_users(rng)
+        self.favs = self.make_links(rng, scale.favs)
+        self.follows = self.make_links(rng, scale.follows)
+        # The readers of each story's favs and alerts pages, by ref
+        self.part_codes = dict(
+            favs=link_codes(self.favs), alerts=link_codes(self.follows))
+        self.comments = self.make_comments(rng)
+
+    def make_stories(self, rng):
+        """ Stories with their chapters, most popular first """
+        scale = self.scale
+        refs = rng.sample(range(1000000, 14000000), scale.stories)
+        mu = math.log(max(1.0, scale.chapters - 0.5)) - 0.32
+        counts = [
+            min(120, 1 + int(rng.lognormvariate(mu, 0.8)))
+            for _ in refs]
+        ch_refs = iter(rng.sample(range(1000000, 13000000), sum(counts)))
+        self.stories = []
+        self.story_titles = {}
+        self.chapters = {}
+        titles = set()
+        for ref, count in zip(refs, counts):
+            # ao3 keeps titles unique
+            title = story_title(rng)
+            if title in titles:
+                title = "{0} {1:d}".format(title, len(titles))
+            titles.add(title)
+            self.stories.append((ref, title))
+            self.story_titles[ref] = title
+            self.chapters[ref] = [
+                (next(ch_refs), num, "Chapter {0:d}".format(num),
+                 int(rng.lognormvariate(7.6, 0.6)))
+                for num in range(1, count + 1)]
+        self.story_weights = zipf_weights(scale.stories, 1.1)
+        self.story_cum = cumulative(self.story_weights)
+        self.chapter_refs = dict(
+            (chapter[0], (ref, chapter[1]))
+            for ref, chapters in self.chapters.items()
+            for chapter in chapters)
+        self.words = dict(
+            (ref, sum(chapter[3] for chapter in chapters))
+            for ref, chapters in self.chapters.items())
+
+    def make_users(self, rng):
+        """ Readers with an alias, a country and when they joined """
+        codes = rng.sample(range(1000, 12000000), self.scale.users)
+        self.users = []
+        countries = rng.choices(
+            self.countries, cum_weights=self.country_cum, k=len(codes))
+        for code, country in zip(codes, countries):
+            alias = "{0}{1}{2:d}".format(
+                rng.choice(WORDS).title(), rng.choice(THINGS).title(),
+                rng.randrange(100))
+            added = '00-00-0000'
+            if rng.random() > 0.3:
+                added = "{0:02d}-{1:02d}-{2:d}".format(
+                    rng.randint(1, 12), rng.randint(1, 28),
+                    rng.randint(2010, self.start[0]))
+            self.users.append((code, alias, country, added))
+        self.user_codes = dict((user[0], user) for user in self.users)
+        # A few readers fav, follow and review far more than the rest
+        self.user_cum = cumulative(zipf_weights(len(self.users), 0.8))
+        self.favme = self.users[:len(self.users) // 6]
+        self.followme = self.users[len(self.users) // 8:len(self.users) // 4]
+
+    def make_links(self, rng, count):
+        """ Distinct (ref, code, date) favs or follows """
+        count = min(count, len(self.stories) * len(self.users) // 2)
+        links = {}
+        while len(links) < count:
+            for ref, user in zip(
+                    rng.choices(
+                        self.stories, cum_weights=self.story_cum, k=count),
+                    rng.choices(
+                        self.users, cum_weights=self.user_cum, k=count)):
+                if len(links) < count:
+                    links.setdefault((ref[0], user[0]), self.stamp(rng))
+        return sorted(
+            (ref, code, "{0:%Y-%m-%d %H:%M:%S}".format(stamp))
+            for (ref, code), stamp in links.items())
+
+    def make_comments(self, rng):
+        """ CommentRecs, two in three signed, most on early chapters """
+        count = self.scale.comments
+        comments = []
+        for (ref, _), user in zip(
+                rng.choices(self.stories, cum_weights=self.story_cum, k=count),
+                rng.choices(self.users, cum_weights=self.user_cum, k=count)):
+            chapters = self.chapters[ref]
+            chapter = rng.choices(
+                chapters, zipf_weights(len(chapters), 0.7))[0][1]
+            text = "{0}. {1}!".format(
+                rng.choice(REMARKS), rng.choice(REMARKS))
+            if rng.random() < 0.66:
+                code, name = user[:2]
+            else:
+                code, name = 0, "Guest{0:d}".format(rng.randrange(1000))
+            comments.append(CommentRec(
+                ref, chapter, self.stamp(rng), name, text, code))
+        return comments
+
+    def stamp(self, rng):
+        """ A random time within the months """
+        year, month = self.start
+        first = datetime.datetime(year, month, 1)
+        end = datetime.datetime(*add_months(year, month, self.scale.months), 1)
+        seconds = int((end - first).total_seconds())
+        return first + datetime.timedelta(seconds=rng.randrange(seconds))
+
+    def month(self, index=-1):
+        """ The SyntheticMonth for a month, by index from the start """
+        if index < 0:
+            index += self.scale.months
+        if index not in self._month_cache:
+            self._month_cache.clear()
+            self._month_cache[index] = self.make_month(index)
+        return self._month_cache[index]
+
+    def make_month(self, index):
+        """
+        Views by story, chapter, country and day for one month. Each
+        story's views fall to its chapters, and each chapter's to the
+        countries of its readers; the totals are the sums of the parts.
+        """
+        # pylint: disable=too-many-locals
+        rng = random.Random("{0}:month:{1:d}".format(self.seed, index))
+        year, month = add_months(self.start[0], self.start[1], index)
+        total = BASE_VIEWS * len(self.stories) / BASE_SCALE.stories
+        total *= 1.0 + 0.15 * math.sin(index / 2.0)
+        whole = sum(self.story_weights)
+        stories, chapters = {}, {}
+        story_countries, chapter_countries = {}, {}
+        countries = {}
+        for (ref, _), weight in zip(self.stories, self.story_weights):
+            views = int(total * weight / whole * rng.lognormvariate(0, 0.5))
+            ratio = rng.uniform(0.3, 0.8)
+            chapter_list = self.chapters[ref]
+            chapter_views = allocate(
+                views, zipf_weights(len(chapter_list), 0.7), rng)
+            by_country = {}
+            for chapter, ch_views in zip(chapter_list, chapter_views):
+                shares = allocate(
+                    ch_views, self.country_weights, rng, self.country_cum)
+                counts = dict(
+                    (country, (share, visitors_for(share, ratio)))
+                    for country, share in zip(self.countries, shares)
+                    if share)
+                chapter_countries[(ref, chapter[1])] = counts
+                for country, (share, visitors) in counts.items():
+                    old = by_country.get(country, (0, 0))
+                    by_country[country] = (old[0] + share, old[1] + visitors)
+            chapters[ref] = [
+                (ch_views, visitors_for(ch_views, ratio))
+                for ch_views in chapter_views]
+            story_countries[ref] = by_country
+            stories[ref] = (views, sum(item[1] for item in chapters[ref]))
+            for country, (share, visitors) in by_country.items():
+                old = countries.get(country, (0, 0))
+                countries[country] = (old[0] + share, old[1] + visitors)
+        views = sum(item[0] for item in stories.values())
+        visitors = sum(item[1] for item in stories.values())
+        day_count = (
+            datetime.date(*add_months(year, month, 1), 1) -
+            datetime.date(year, month, 1)).days
+        weekdays = [
+            datetime.date(year, month, day).weekday()
+            for day in range(1, day_count + 1)]
+        day_views = allocate(
+            views, [1.2 if day >= 5 else 1.0 for day in weekdays], rng)
+        day_visitors = allocate(visitors, day_views, rng) if views else [
+            0] * day_count
+        days = [
+            ("{0:d}/{1}".format(day, DAYS[weekday]), day_view, day_visitor)
+            for day, weekday, day_view, day_visitor in zip(
+                range(1, day_count + 1), weekdays, day_views, day_visitors)]
+        return SyntheticMonth(
+            index + 1, year, month, day_count, views, visitors,
+            days[::-1], stories, chapters, countries, story_countries,
+            chapter_countries)
+
+    def legacy(self):
+        """ (ref, title, words, chaps, reviews, views, c2s, favs, alerts) """
+        if self._legacy is None:
+            self._legacy = self.make_legacy()
+        return self._legacy
+
+    def make_legacy(self):
+        """ The all time totals, from the comments, links and months """
+        reviews = dict((ref, 0) for ref, _ in self.stories)
+        for comment in self.comments:
+            reviews[comment.ref] += 1
+        favs = dict((ref, 0) for ref, _ in self.stories)
+        for ref, _, _ in self.favs:
+            favs[ref] += 1
+        alerts = dict((ref, 0) for ref, _ in self.stories)
+        for ref, _, _ in self.follows:
+            alerts[ref] += 1
+        views = dict((ref, 0) for ref, _ in self.stories)
+        for index in range(self.scale.months):
+            for ref, (story_views, _) in self.month(index).stories.items():
+                views[ref] += story_views
+        return [
+            (ref, title, self.words[ref], len(self.chapters[ref]),
+             reviews[ref], views[ref], favs[ref] // 40, favs[ref],
+             alerts[ref])
+            for ref, title in self.stories]
+
+    def fill_db(self, read_db, months=None):
+        """
+        Insert the author into an empty database, with the months up
+        to the given count (all of them by default). Commit after.
+        """
+        if months is None:
+            months = self.scale.months
+        insert = read_db.insert_rows
+        insert(Stories, [
+            dict(ref=ref, title=title) for ref, title in self.stories])
+        insert(Chapters, [
+            dict(ch_ref=ch_ref, story_ref=ref, num=num, title=title,
+                 words=words)
+            for ref, chapters in self.chapters.items()
+            for ch_ref, num, title, words in chapters])
+        insert(Legacy, [
+            dict(ref=rec[0], chaps=rec[3], reviews=rec[4], views=rec[5],
+                 c2s=rec[6], favs=rec[7], alerts=rec[8])
+            for rec in self.legacy()])
+        joined = datetime.datetime(*self.start, 1)
+        insert(Users, [
+            dict(code=code, country=country, date_added=added)
+            for code, _, country, added in self.users])
+        insert(Aliases, [
+            dict(code=code, name=alias, dt=joined)
+            for code, alias, _, _ in self.users])
+        insert(Favs, [
+            dict(ref=ref, code=code, dt=stamp)
+            for ref, code, stamp in self.favs])
+        insert(Follows, [
+            dict(ref=ref, code=code, dt=stamp)
+            for ref, code, stamp in self.follows])
+        insert(FavMe, [dict(code=user[0], dt=joined) for user in self.favme])
+        insert(FollowMe, [
+            dict(code=user[0], dt=joined) for user in self.followme])
+        read_db.add_comments(self.comments)
+        for index in range(months):
+            self.fill_month(read_db, self.month(index))
+
+    @staticmethod
+    def fill_month(read_db, mon):
+        """ Insert the views of one month """
+        insert = read_db.insert_rows
+        mid = mon.mid
+        insert(Months, [dict(mid=mid, year=mon.year, month=mon.month)])
+        insert(MTop, [dict(
+            mid=mid, day=mon.day, views=mon.views, visitors=mon.visitors)])
+        insert(MCtry, [
+            dict(mid=mid, country=country, views=views, visitors=visitors)
+            for country, (views, visitors) in mon.countries.items()])
+        insert(MStory, [
+            dict(mid=mid, ref=ref, views=views, visitors=visitors)
+            for ref, (views, visitors) in mon.stories.items()])
+        insert(MStoryCtry, [
+            dict(mid=mid, ref=ref, country=country, views=views,
+                 visitors=visitors)
+            for ref, counts in mon.story_countries.items()
+            for country, (views, visitors) in counts.items()])
+        insert(MChap, [
+            dict(mid=mid, ref=ref, chap=num, views=views, visitors=visitors)
+            for ref, counts in mon.chapters.items()
+            for num, (views, visitors) in enumerate(counts, 1)])
+        insert(MChapCtry, [
+            dict(mid=mid, ref=ref, chap=num, country=country, views=views,
+                 visitors=visitors)
+            for (ref, num), counts in mon.chapter_countries.items()
+            for country, (views, visitors) in counts.items()])
+
+    # The pages, in the site's markup
+
+    def story_eyes_page(self, index=-1):
+        """ stats/story_eyes.php: the month's totals and stories """
+        mon = self.month(index)
+        rows = "".join(
+            story_row(
+                "story_eyes_story.php?storyid={0:d}&month={1:02d}"
+                "&year={2:d}".format(ref, mon.month, mon.year),
+                title, [self.words[ref]] + list(mon.stories[ref]))
+            for ref, title in sorted(self.stories, key=lambda x: x[1]))
+        body = (
+            self.month_menu(mon) +
+            caption_table(mon, mon.views, mon.visitors, "all of your stories")
+            + chart_script(1, mon.days) +
+            chart_script(2, country_items(mon.countries)) +
+            table("gui_table2i", ("Story", "Words", "Views", "Visitors"),
+                  rows))
+        return page(body)
+
+    def story_chapters_page(self, ref, index=-1):
+        """ stats/story_eyes_story.php: a story's month, by chapter """
+        mon = self.month(index)
+        title = self.story_titles[ref]
+        views, visitors = mon.stories[ref]
+        rows = "".join(
+            story_row(
+                "story_eyes_chapter.php?storytextid={0:d}&month={1:02d}"
+                "&year={2:d}".format(ch_ref, mon.month, mon.year),
+                ch_title, [words, counts[0], counts[1]], num)
+            for (ch_ref, num, ch_title, words), counts in zip(
+                self.chapters[ref], mon.chapters[ref]))
+        day_views = allocate(views, [item[1] or 1 for item in mon.days],
+                             random.Random(ref))
+        days = [
+            (item[0], day, visitors_for(day, visitors / (views or 1)))
+            for item, day in zip(mon.days, day_views)]
+        body = (
+            self.month_menu(mon) +
+            caption_table(mon, views, visitors, "story: <b>{0}</b>".format(
+                escape(title))) +
+            chart_script(1, days) +
+            chart_script(2, country_items(mon.story_countries[ref])) +
+            table("gui_table2i",
+                  ("#", "Chapter Name", "Words", "Views", "Visitors"), rows))
+        return page(body)
+
+    def chapter_single_page(self, ch_ref, index=-1):
+        """ stats/story_eyes_chapter.php: a chapter's month by country """
+        mon = self.month(index)
+        counts = mon.chapter_countries[self.chapter_refs[ch_ref]]
+        views = sum(item[0] for item in counts.values())
+        visitors = sum(item[1] for item in counts.values())
+        body = (
+            self.month_menu(mon) +
+            caption_table(mon, views, visitors, "chapter") +
+            chart_script(1, []) + chart_script(2, country_items(counts)))
+        return page(body)
+
+    def legacy_page(self):
+        """ stats/story.php: the all time totals of every story """
+        rows = []
+        for rec in sorted(self.legacy(), key=lambda x: x[1]):
+            ref = rec[0]
+            cells = [
+                "<a href='../story/story_preview.php?storyid={0:d}'>"
+                "{1}</a>".format(ref, escape(rec[1])),
+                "{0:,d}".format(rec[2]), "{0:,d}".format(rec[3]),
+                "<a href='/r/{0:d}/'>{1:,d}</a>".format(ref, rec[4]),
+                "<a href='part.php?part=hits&storyid={0:d}'>{1:,d}</a>".format(
+                    ref, rec[5]),
+                "{0:,d}".format(rec[6]),
+                "<a href='part.php?part=favs&storyid={0:d}'>{1:,d}</a>".format(
+                    ref, rec[7]),
+                "<a href='part.php?part=alerts&storyid={0:d}'>{1:,d}"
+                "</a>".format(ref, rec[8])]
+            rows.append(row(cells))
+        return page(table(
+            "gui_table1i",
+            ("Story", "Words", "Chaps", "Reviews", "Views", "C2s", "Favs",
+             "Alerts"), "".join(rows)))
+
+    def part_page(self, ref, part):
+        """ stats/part.php: the readers who fav or follow a story """
+        codes = self.part_codes["favs" if part == "favs" else "alerts"]
+        return self.users_page(
+            "Author", [self.user_codes[code] for code in codes.get(ref, ())])
+
+    def user_page(self, action):
+        """ stats/user.php: the readers who fav or follow the author """
+        return self.users_page(
+            "PenName", self.favme if action == "favs" else self.followme)
+
+    @staticmethod
+    def users_page(heading, users):
+        """ A table of readers, by alias """
+        rows = "".join(
+            row(["<a href='/u/{0:d}/' target='_new'>{1}</a>".format(
+                code, escape(alias)), added])
+            for code, alias, _, added in sorted(
+                users, key=lambda x: (x[1], x[0])))
+        return page(table("gui_table1i", (heading, "Date Added"), rows))
+
+    def profile_page(self, code):
+        """ u/<code>: a reader's profile, with a flag for the country """
+        _, alias, country, added = self.user_codes[code]
+        return page(
+            "<table><tr><td>{0}</td></tr><tr><td colspan=2>Joined <span "
+            "data-xutime='0'>{1}</span>, id: {2:d} <img ALIGN='ABSMIDDLE' "
+            "src='/static/flags2/xx.png' width=16 height=11 title='{3}'> "
+            "</td></tr></table>".format(
+                escape(alias), added, code, escape(country)))
+
+    def works_page(self, num=1, per_page=20):
+        """ ao3 users/<user>/works: a page of the stories as works """
+        works = sorted(self.legacy(), key=lambda x: x[1])
+        page_count = max(1, -(-len(works) // per_page))
+        blurbs = "".join(
+            "<li class=\"work blurb group\" id=\"work_{0:d}\">"
+            "<div class=\"header module\"><h4 class=\"heading\">"
+            "<a href=\"/works/{0:d}\">{1}</a></h4></div>"
+            "<dl class=\"stats\"><dd class=\"words\">{2:,d}</dd>"
+            "<dd class=\"chapters\">{3:d}/{3:d}</dd>"
+            "<dd class=\"comments\"><a href=\"#\">{4:,d}</a></dd>"
+            "<dd class=\"kudos\"><a href=\"#\">{5:,d}</a></dd>"
+            "<dd class=\"bookmarks\"><a href=\"#\">{6:,d}</a></dd>"
+            "<dd class=\"hits\">{7:,d}</dd></dl></li>".format(
+                rec[0], escape(rec[1]), rec[2], rec[3], rec[4] // 2, rec[7],
+                rec[8] // 3, rec[5] // 2)
+            for rec in works[(num - 1) * per_page:num * per_page])
+        links = "".join(
+            "<li><a href=\"?page={0:d}\">{0:d}</a></li>".format(other)
+            for other in range(1, page_count + 1) if other != num)
+        return page(
+            "<ol class=\"work index group\">{0}</ol>"
+            "<ol class=\"pagination actions\">{1}</ol>".format(
+                blurbs, links))
+
+    def month_menu(self, mon):
+        """ The month menu, newest first, the month shown selected """
+        options = []
+        for index in range(self.scale.months - 1, -1, -1):
+            year, month = add_months(self.start[0], self.start[1], index)
+            options.append(
+                "<option value='{0:d}{1:02d}' {2}>Month: {1:02d}/{0:d}".format(
+                    year, month, "selected" if index + 1 == mon.mid else ""))
+        return "<select name=date>{0}</select>".format("".join(options))
+
+    def write_pages(self, folder, index=-1):
+        """
+        Write the pages of a month to a folder, named after the page
+        and its ids, as story_eyes_story_<ref>.php. Returns the count.
+        """
+        os.makedirs(folder, exist_ok=True)
+        pages = [
+            ("story_eyes.php", lambda: self.story_eyes_page(index)),
+            ("story.php", self.legacy_page),
+            ("user_favs.php", lambda: self.user_page("favs")),
+            ("user_alerts.php", lambda: self.user_page("alerts"))]
+        for ref, _ in self.stories:
+            pages.append((
+                "story_eyes_story_{0:d}.php".format(ref),
+                lambda ref=ref: self.story_chapters_page(ref, index)))
+            for part in ("favs", "alerts"):
+                pages.append((
+                    "part_{0}_{1:d}.php".format(part, ref),
+                    lambda ref=ref, part=part: self.part_page(ref, part)))
+            for ch_ref, _, _, _ in self.chapters[ref]:
+                pages.append((
+                    "story_eyes_chapter_{0:d}.php".format(ch_ref),
+                    lambda ch_ref=ch_ref: self.chapter_single_page(
+                        ch_ref, index)))
+        for name, render in pages:
+            with open(os.path.join(folder, name), 'w',
+                      encoding='utf-8') as page_file:
+                page_file.write(render())
+        return len(pages)
+
+
+def link_codes(links):
+    """ The codes of the readers of each story's favs or follows """
+    codes = {}
+    for ref, code, _ in links:
+        codes.setdefault(ref, []).append(code)
+    return codes
+
+
+def page(body):
+    """ A stats page around the body """
+    return (
+        "<html><head><title>FanFiction | Stats</title></head><body>"
+        "<form name=sform method=get action='story_eyes.php'>"
+        "{0}</form></body></html>".format(body))
+
+
+def row(cells):
+    """ A table row, one cell per line, as the site lays them out """
+    return "<tr  >\n{0}\n</tr>\n".format(
+        "\n".join("    <td  >{0}</td>".format(cell) for cell in cells))
+
+
+def story_row(href, title, counts, num=None):
+    """ A row of the monthly story or chapter table """
+    cells = [] if num is None else [str(num)]
+    cells.append("<a href='{0}'>{1}</a>".format(href, escape(title)))
+    cells.extend("{0:,d}".format(count) for count in counts)
+    return row(cells)
+
+
+def table(table_id, headings, rows):
+    """ A sortable stats table """
+    heads = "\n".join(
+        "<th  class='thead'  align='left' >{0}&nbsp;&nbsp;&nbsp;&nbsp;"
+        "</th>".format(heading) for heading in headings)
+    return (
+        "<table class='table  sortable  table-hover '  width='100%'   "
+        "cellpadding='4'  id='{0}'><thead><tr>\n{1}</tr></thead>\n"
+        "<tbody>{2}</tbody></table>".format(table_id, heads, rows))
+
+
+def caption_table(mon, views, visitors, what):
+    """ The table with the month's totals in its caption """
+    return (
+        "<table class='table  table-striped '  width='100%'   "
+        "cellpadding='4'  id='gui_table1i'><tbody><tr  >\n"
+        "    <td  >Menu: <b>Stats Home</b></td>\n</tr>\n<tr  >\n"
+        "    <td  ><b>Help/Info</b> : For the month of {0:d}-{1:02d}, there "
+        "have been a total of\n    <b>{2:,d} Views</b> and <b>{3:,d} "
+        "Visitors</b> to {4}.</td>\n</tr>\n</tbody></table>".format(
+            mon.year, mon.month, views, visitors, what))
+
+
+def country_items(counts):
+    """ (country, views, visitors), most views first """
+    return sorted(
+        ((country, views, visitors)
+         for country, (views, visitors) in counts.items()),
+        key=lambda item: (-item[1], item[0]))
+
+
+def chart_script(num, items):
+    """ A chart script, its data as escaped XML as the site has it """
+    categories = "".join(
+        "<category label=\\'{0}\\' />".format(escape(label, quote=False))
+        for label, _, _ in items)
+    views = "".join(
+        "<set value=\\'{0:d}\\' />".format(item[1]) for item in items)
+    visitors = "".join(
+        "<set value=\\'{0:d}\\' />".format(item[2]) for item in items)
+    return (
+        "<div id='chart{0:d}div'></div><script>\n"
+        "    $(function(){{\n"
+        "         var chart{0:d} = new FusionCharts('ScrollCombi2D.swf', "
+        "'chart{0:d}', '100%', '275', '0', '1');\n"
+        "         chart{0:d}.setDataXML(\"<chart animation=\\'0\\'> "
+        "<categories>{1}</categories> <dataset seriesName=\\'Views\\'>{2}"
+        "</dataset><dataset seriesName=\\'Visitors\\'>{3}</dataset>"
+        "</chart>\");\n    }});\n</script>\n".format(
+            num, categories, views, visitors))
+
+
+def main(argv=None):
+    """ Make up an author into a new database, and its pages """
+    parser = argparse.ArgumentParser(prog="python -m dyrm.synthetic")
+    parser.add_argument("db", help="database file to create")
+    parser.add_argument(
+        "-s", "--scale", type=float, default=1.0,
+        help="times the size of the test author (10 and 100 for scale)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-m", "--months", type=int,
+                        help="months to fill in (all by default)")
+    parser.add_argument("-p", "--pages", help="write the pages here")
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.db):
+        parser.error("{0} already exists".format(args.db))
+    author = SyntheticAuthor(scaled(args.scale), args.seed)
+    with ReadMeDb(args.db) as read_db:
+        author.fill_db(read_db, args.months)
+        read_db.set_commit_flag()
+    if args.pages:
+        index = -1 if args.months is None else args.months - 1
+        count = author.write_pages(args.pages, index)
+        print("Wrote {0:d} pages to {1}".format(count, args.pages))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+"""
+Several authors crawled from one process.
+
+A tenants file is an INI file with one section per author:
+
+    [RockSunner]
+    db = dbs/readme.db
+    profile = ~/.mozilla/firefox/abcd1234.default
+    fanfiction = yes
+    ao3 = RockSunner
+    jsonreport = logs/rocksunner.jsonl
+
+Each tenant runs in its own thread with its own cookie jar and
+database. The tenants share one connection pool and one HostThrottle
+per site; the throttle lets waiting requests in round-robin by
+tenant, so the total request rate stays within the site's limits
+and no author's crawl starves the others.
+"""
+
+import os
+import logging
+import threading
+import configparser
+from collections import namedtuple
+import requests
+import dyrm.read_firefox_cookies as read_firefox_cookies
+from dyrm.eprint import eprint
+from dyrm.throttle import HostThrottle
+from dyrm.readme_db import open_engine
+from dyrm import ffmonthly, do_you_read_ao3, update_user_countries
+
+FFN_HOST = "www.fanfiction.net"
+AO3_HOST = "archiveofourown.org"
+
+Tenant = namedtuple(
+    'Tenant',
+    ['name', 'db', 'profile', 'fanfiction', 'ao3_user',
+     'json_report', 'html_report', 'report_file'])
+
+
+def load_tenants(path):
+    """ Read the tenants file, one Tenant per section """
+    config = configparser.ConfigParser()
+    with open(path, 'r') as tenants_file:
+        config.read_file(tenants_file)
+    tenants = []
+    for name in config.sections():
+        section = config[name]
+        profile = section.get('profile')
+        if profile:
+            profile = os.path.expanduser(profile)
+        tenants.append(Tenant(
+            name,
+            section.get('db', "dbs/{0}.db".format(name)),
+            profile,
+            section.getboolean('fanfiction', True),
+            section.get('ao3') or None,
+            section.get('jsonreport'),
+            section.get('htmlreport'),
+            section.get('reportfile')))
+    return tenants
+
+
+class SharedHosts:
+    """ Throttles and connection pool shared by all the tenants """
+
+    def __init__(self, delay=8.0, tenant_count=1):
+        self.throttles = {
+            FFN_HOST: HostThrottle(delay, 1),
+            AO3_HOST: HostThrottle(
+                do_you_read_ao3.AO3_MIN_INTERVAL,
+                do_you_read_ao3.AO3_MAX_CONCURRENT)}
+        self.adapter = requests.adapters.HTTPAdapter(
+            pool_connections=len(self.throttles),
+            pool_maxsize=max(
+                tenant_count, do_you_read_ao3.AO3_MAX_CONCURRENT))
+
+    def session(self):
+        """
+        A session of a tenant's own, so cookies set by one site visit
+        stay with that tenant, using the shared connection pool.
+        """
+        session = requests.Session()
+        session.mount('https://', self.adapter)
+        session.mount('http://', self.adapter)
+        return session
+
+    def throttle(self, host, tenant):
+        """ A tenant's handle on the throttle for a host """
+        return self.throttles[host].tenant(tenant.name)
+
+    def close(self):
+        """ Close the pooled connections """
+        self.adapter.close()
+
+
+def run_tenant(tenant, hosts, countries=None, **options):
+    """
+    The fanfiction.net and ao3 runs for one tenant, then up to
+    countries queued user country lookups.
+    """
+    profile = tenant.profile
+    if profile is None:
+        profile = read_firefox_cookies.get_profile_folder()
+    cjar = read_firefox_cookies.get_cookie_jar(profile)
+    if cjar is False:
+        eprint("No cookies for", tenant.name)
+        return
+
+    session = hosts.session()
+    if tenant.fanfiction:
+        ffmonthly.main(
+            tenant.db, json_report=tenant.json_report,
+            html_report=tenant.html_report, report_file=tenant.report_file,
+            cookie_jar=cjar, session=session,
+            throttle=hosts.throttle(FFN_HOST, tenant), **options)
+        if countries:
+            update_user_countries.main(
+                tenant.db, limit=countries, session=session,
+                throttle=hosts.throttle(FFN_HOST, tenant))
+    if tenant.ao3_user:
+        do_you_read_ao3.main(
+            tenant.db, user=tenant.ao3_user, cookie_jar=cjar,
+            session=session, throttle=hosts.throttle(AO3_HOST, tenant))
+
+
+def run_tenants(tenants, delay=8.0, hosts=None, **options):
+    """
+    Run every tenant at once, each in a thread named after it.
+    One tenant failing does not stop the others. A daemon passes in
+    SharedHosts to keep, and the tenants' database engines are then
+    kept open too.
+    """
+    logger = logging.getLogger(__name__)
+    own_hosts = hosts is None
+    if own_hosts:
+        hosts = SharedHosts(delay, len(tenants))
+    else:
+        for tenant in tenants:
+            open_engine(tenant.db)
+
+    def run(tenant):
+        try:
+            run_tenant(tenant, hosts, delay=delay, **options)
+        except (Exception, SystemExit) as exc:
+            # pylint: disable=broad-except
+            logger.error("tenant %s failed: %r", tenant.name, exc)
+
+    threads = [
+        threading.Thread(target=run, args=(tenant,), name=tenant.name)
+        for tenant in tenants]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if own_hosts:
+        hosts.close()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+"""
+Politeness limits for the sites we crawl, shared across threads.
+
+Kept apart from the page getter so that code which only needs to
+space out its requests does not have to load the page parsers.
+"""
+import time
+import threading
+from collections import deque
+
+
+class HostThrottle:
+    """
+    Politeness limit for one host, shared by every thread that
+    fetches from it: at most max_concurrent requests at a time,
+    and request starts spaced at least min_interval seconds apart.
+    Waiting requests are let in round-robin by tenant, so a tenant
+    with a long queue cannot hold up the others.
+    """
+
+    def __init__(self, min_interval=8.0, max_concurrent=1):
+        self.min_interval = min_interval
+        self.max_concurrent = max_concurrent
+        self.active = 0
+        self.waiting = {}
+        self.turns = deque()
+        self.ready = threading.Condition()
+        self.next_start = 0.0
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.release()
+
+    def tenant(self, name):
+        """ A handle on this throttle for one tenant's requests """
+        return TenantThrottle(self, name)
+
+    def acquire(self, tenant=None):
+        """ Wait for a free slot, this tenant's turn and the spacing """
+        ticket = object()
+        with self.ready:
+            queue = self.waiting.setdefault(tenant, deque())
+            queue.append(ticket)
+            if len(queue) == 1:
+                self.turns.append(tenant)
+            try:
+                while (self.active >= self.max_concurrent or
+                       self.turns[0] != tenant or queue[0] is not ticket):
+                    self.ready.wait()
+            except BaseException:
+                # Interrupted; leave the queues as if never asked
+                self.withdraw(tenant, queue, ticket)
+                raise
+            queue.popleft()
+            self.turns.popleft()
+            if queue:
+                self.turns.append(tenant)
+            else:
+                del self.waiting[tenant]
+            self.active += 1
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.min_interval
+            self.ready.notify_all()
+        if start > now:
+            try:
+                time.sleep(start - now)
+            except BaseException:
+                self.release()
+                raise
+
+    def withdraw(self, tenant, queue, ticket):
+        """
+        Take a waiting ticket out of its tenant's queue, and the
+        tenant out of the turns if it has nothing left waiting.
+        Called with the condition held.
+        """
+        queue.remove(ticket)
+        if not queue:
+            self.turns.remove(tenant)
+            del self.waiting[tenant]
+        self.ready.notify_all()
+
+    def release(self):
+        """ Give back a request slot """
+        with self.ready:
+            self.active -= 1
+            self.ready.notify_all()
+
+
+class TenantThrottle:
+    """ One tenant's handle on a shared HostThrottle """
+
+    def __init__(self, throttle, tenant):
+        self.throttle = throttle
+        self.tenant = tenant
+
+    def __enter__(self):
+        self.throttle.acquire(self.tenant)
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.throttle.release()
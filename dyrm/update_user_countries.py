@@ -3,23 +3,50 @@
 """
 Screen-scraper to get country information from
 user profile pages.
+
+Users to look up wait in the countryqueue table. Fav and follow
+reports queue new users there rather than looking them up on the
+spot; a run of this module then works through the users that are
+due, a few at a time under the site throttle, and writes the
+results back in batches. A found country is trusted for
+COUNTRY_TTL and a profile with no flag for NO_COUNTRY_TTL before
+the user is looked up again; failed lookups back off.
 """
 
 # import sys
 import re
-from dyrm.ffgetter import PageGetter, FanfictionGetter
-from dyrm.readme_db import ReadMeDb
+import logging
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from dyrm.throttle import HostThrottle
+from dyrm.sites import FFN_URL
+from dyrm.readme_db import ReadMeDb, CountryLookup
 import requests
 from contextlib import closing
 
-def get_country(user, session, flag_pattern):
+COUNTRY_TTL = datetime.timedelta(days=180)
+NO_COUNTRY_TTL = datetime.timedelta(days=30)
+RETRY_DELAY = datetime.timedelta(hours=1)
+
+FLAG_PATTERN = re.compile(r"""
+        ABSMIDDLE
+        .*?
+        title=
+        \\?'
+        ([A-Za-z ]+)
+        \\?'
+        """, re.VERBOSE)
+
+
+def get_country(
+        user, session, flag_pattern=FLAG_PATTERN, base_url=FFN_URL):
     """
     Get the country information, which will be near the start
     on a flag title, if present.
 
     User profiles can be gigantic, so use streaming.
     """
-    page = "https://www.fanfiction.net/u/" + str(user)
+    page = base_url + "/u/" + str(user)
     country = ""
     with closing(session.get(page, timeout=10.0, stream=True)) as r:
         lines = 0;
@@ -36,48 +63,102 @@ def get_country(user, session, flag_pattern):
     return country
 
 
-def main(userid=None):
+def next_lookup(code, country, attempts, now):
     """
-    Find users where the country is 'Unknown' and look up
-    the country flag on their profile pages.
+    The CountryLookup to store for a lookup result, where country
+    is None if the lookup failed.
     """
-    # import pdb; pdb.set_trace()
-    with ReadMeDb(echo=False) as read_db:
+    if country is None:
+        delay = min(RETRY_DELAY * 2 ** attempts, NO_COUNTRY_TTL)
+        return CountryLookup(code, None, now + delay, attempts + 1)
+    if country:
+        return CountryLookup(code, country, now + COUNTRY_TTL, 0)
+    return CountryLookup(code, country, now + NO_COUNTRY_TTL, 0)
+
+
+class CountryEnricher:
+    """ Look up the countries of queued users, a few at a time """
+
+    def __init__(
+            self, session, throttle, workers=2, batch=50, base_url=FFN_URL):
+        # pylint: disable=too-many-arguments
+        self.session = session
+        self.throttle = throttle
+        self.base_url = base_url
+        self.workers = workers
+        self.batch = batch
+
+    def lookup(self, code):
+        """ The country of one user, "" if none, None on failure """
+        try:
+            with self.throttle:
+                return get_country(
+                    code, self.session, base_url=self.base_url)
+        except (requests.RequestException, OSError) as exc:
+            logger = logging.getLogger(__name__)
+            logger.info("country lookup for {0:d} failed: {1}".format(
+                code, exc))
+            return None
+
+    def run(self, read_db, now, limit=None):
+        """
+        Look up the users due by now, committing each batch of
+        results. Returns the number of users looked up.
+        """
+        due = read_db.get_countries_due(now, limit)
+        lookups = []
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            countries = pool.map(self.lookup, [code for code, _ in due])
+            for (code, attempts), country in zip(due, countries):
+                if country is not None:
+                    print("Updating user {0:d} with country '{1}'".format(
+                        code, country))
+                lookups.append(next_lookup(code, country, attempts, now))
+                if len(lookups) >= self.batch:
+                    read_db.set_countries(lookups, now)
+                    read_db.session.commit()
+                    lookups = []
+        read_db.set_countries(lookups, now)
+        read_db.session.commit()
+        return len(due)
+
+
+def main(
+        db="dbs/readme.db", userid=None, limit=None, delay=8.0,
+        session=None, throttle=None, base_url=FFN_URL):
+    """
+    Queue users whose country is 'Unknown' (or just userid) and look
+    up the country flag on the profile pages of those that are due.
+    A tenant run passes in a session and throttle it shares, and a
+    benchmark the base_url of a stand-in server.
+    """
+
+    # pylint: disable=too-many-arguments
+
+    now = datetime.datetime.now()
+    with ReadMeDb(db, echo=False) as read_db:
         read_db.set_commit_flag()
 
         if userid:
-            users = read_db.find_users_with_code(userid)
+            read_db.get_or_create_user(userid, "Unknown")
+            read_db.enqueue_countries([userid], now, force=True)
         else:
-            users = read_db.find_users_with_country("Unknown")
-        if not users:
-            return
+            read_db.enqueue_countries([
+                user.code for user in
+                read_db.find_users_with_country("Unknown")], now)
 
-        session = requests.Session()
-        flag_pattern = re.compile(r"""
-        ABSMIDDLE
-        .*?
-        title=
-        \\?'
-        ([A-Za-z ]+)
-        \\?'
-        """, re.VERBOSE)
+        own_session = session is None
+        if own_session:
+            session = requests.Session()
+        if throttle is None:
+            throttle = HostThrottle(delay, 1)
         try:
-            for user in users:
-                country = get_country(user.code, session, flag_pattern)
-                alias = str(user.code)
-                if user.aliases:
-                    alias = user.aliases[0].name
-                print(
-                    "Updating user '{0}' ({1}) with country '{2}'".format(
-                        alias, str(user.code), country))
-                user.country = country
-
-        except ConnectionRefusedError:
-            print("Connection refused")
-            return
-        except ConnectionAbortedError as esc:
-            print("Connection problem", esc)
-            return
+            CountryEnricher(session, throttle, base_url=base_url).run(
+                read_db, now, limit)
+        finally:
+            if own_session:
+                session.close()
+
 
 # Do an update from the current fanfiction.net to our db.
 if __name__ == "__main__":
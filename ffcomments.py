@@ -6,45 +6,62 @@ Page getter for Fanfiction.net and ao3
 import sys
 import argparse
 import logging
+from sqlalchemy.exc import OperationalError
 from dyrm.eprint import eprint
 from dyrm.ffgetter import PageGetter, FanfictionGetter, FanfictionScraper
-from dyrm.readme_db import ReadMeDb, Comments, SComments, Aliases
+from dyrm.readme_db import ReadMeDb, CommentRec
 
 
-def do_comment_page(getter, scraper, read_db, sref):
-    """ Comment extraction to db """
-
+def get_new_comments(getter, scraper, sref, newest=None):
+    """
+    Comments on a story from newest back to the newest stored one.
+    Reviews are listed newest first, so paging stops at the first
+    page that reaches a stored review. Reviews stamped the same
+    second as it are kept, for the database to weed out.
+    """
+    recs = []
     link = "r/" + str(sref) + "/"
-    comment_tree = getter.get_comment_tree(link)
-
-    dates = []
-    chapters = []
-    text_comments = []
-    signers = []
-    while True:
-        mynext, dates1, chapters1, text_comments1, signers1 =\
+    while link:
+        comment_tree = getter.get_comment_tree(link)
+        link, dates, chapters, text_comments, signers = \
             scraper.get_comments(comment_tree)
-        dates = dates + dates1
-        chapters = chapters + chapters1
-        text_comments = text_comments + text_comments1
-        signers = signers + signers1
-        if mynext:
-            comment_tree = getter.get_comment_tree(mynext)
-        else:
-            break
-
-    print(len(dates), " total comments")
-    clist = [x for x in zip(dates, chapters, text_comments, signers)]
-    for date, chap, text, sign in reversed(clist):
-        print(date, chap, text, sign)
-        new_rec = Comments(
-            stamp=date, ref=sref, chapter=chap, name=sign[1], comment=text)
-        if sign[0] != 0:
-            user = read_db.get_or_create_user(sign[0], "Unknown")
-            if not user.aliases:
-                user.aliases = [Aliases(name=sign[1])]
-            new_rec.signed = [SComments(code=sign[0])]
-        read_db.session.add(new_rec)
+        for date, chap, text, sign in zip(
+                dates, chapters, text_comments, signers):
+            if newest is not None and date <= newest:
+                link = None
+                if date < newest:
+                    break
+            recs.append(CommentRec(sref, chap, date, sign[1], text, sign[0]))
+    return recs
+
+
+def do_comment_page(getter, scraper, read_db, sref, newest=None):
+    """ New comments on a story to the db, oldest first """
+
+    recs = get_new_comments(getter, scraper, sref, newest)
+    recs.reverse()
+    added = read_db.add_comments(recs)
+    print(added, " new comments")
+    for rec in recs:
+        print(rec.stamp, rec.chapter, rec.comment, (rec.code, rec.name))
+    return added
+
+
+def search_comments(read_db, query):
+    """
+    Log the stored comments that match a query, in the FTS5 syntax.
+    Returns the number found, or None for a query that is not valid.
+    """
+    logger = logging.getLogger(__name__)
+    try:
+        hits = read_db.search_comments(query)
+    except OperationalError as exc:
+        eprint("bad search query", repr(query), exc.orig)
+        return None
+    for hit in hits:
+        logger.info("{0} ch {1:d} {2:%Y-%m-%d} {3}: {4}".format(
+            hit.title, hit.chapter, hit.stamp, hit.name, hit.comment))
+    return len(hits)
 
 
 def main():
@@ -63,6 +80,11 @@ def main():
         type=str,
         default="ccc.txt",
         help="path to log file")
+    parser.add_argument(
+        "-q", "--query",
+        type=str,
+        default=None,
+        help="search the stored comments instead of fetching them")
     args = parser.parse_args()
 
     logging.basicConfig(
@@ -77,6 +99,11 @@ def main():
         logging.getLogger('').addHandler(hand)
 
     logger = logging.getLogger(__name__)
+    if args.query:
+        with ReadMeDb(echo=False) as read_db:
+            search_comments(read_db, args.query)
+        return
+
     logger.info("fanfiction.net comments for " + args.story)
 
     scraper = FanfictionScraper()
@@ -87,10 +114,12 @@ def main():
                 getter = FanfictionGetter(pgetter)
 
                 stories = read_db.get_stories()
+                stamps = read_db.get_comment_stamps()
                 for story in sorted(stories, key=lambda x: x.title):
                     print(story.title)
                     do_comment_page(
-                        getter, scraper, read_db, story.ref)
+                        getter, scraper, read_db, story.ref,
+                        stamps.get(story.ref))
 
                 pgetter.stop_sleep()
 
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+"""
+Digest of logged changes for Fanfiction.net and ao3
+"""
+import sys
+import argparse
+import logging
+from dyrm import digest
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-p", "--period",
+        choices=sorted(digest.PERIODS),
+        default="daily",
+        help="length of the digest period")
+    parser.add_argument(
+        "-s", "--story",
+        type=int,
+        default=None,
+        help="story ref to limit the digest to")
+    parser.add_argument(
+        "-t", "--top",
+        type=int,
+        default=10,
+        help="number of top movers to list")
+    parser.add_argument(
+        "-d", "--database",
+        type=str,
+        default="dbs/readme.db",
+        help="path to sqlite3 database")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        stream=sys.stdout,
+        format='%(message)s',
+        level=logging.INFO)
+
+    digest.main(
+        args.database, period=args.period, ref=args.story, top=args.top)
+
+
+# Drive the main routine
+if __name__ == "__main__":
+    main()
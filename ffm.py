@@ -2,14 +2,156 @@
 
 """
 Page getter for Fanfiction.net and ao3
+
+The dyrm subsystems (and lxml, requests and SQLAlchemy with them)
+are only imported once the options show they are needed, so --help,
+--control and short runs start quickly.
 """
+import os
 import sys
+import json
 import argparse
 import logging
-from dyrm import ffmonthly, do_you_read_ao3
 
+# Cold start of "import ffm", in microseconds, checked by the tests
+STARTUP_BUDGET = 100000
 
-def main():
+# dyrm.daemon.DEFAULT_CONTROL_PORT, without importing the daemon
+CONTROL_PORT = 8631
+
+
+def crawl_cycle(args, warm=False):
+    """
+    The crawl asked for, as a function to run once or every cycle,
+    and a function to close what it keeps. Warm, it keeps the
+    database engines and the site sessions between cycles.
+    """
+
+    # pylint: disable=import-outside-toplevel
+
+    from dyrm.readme_db import open_engine, close_engines
+    logger = logging.getLogger(__name__)
+    if args.tenants:
+        from dyrm import tenants
+        hosts = None
+        if warm:
+            hosts = tenants.SharedHosts(
+                args.timedelay, len(tenants.load_tenants(args.tenants)))
+
+        def tenants_cycle():
+            # Report paths, the memory report, metrics and profiles are
+            # per tenant or off.
+            tenants.run_tenants(
+                tenants.load_tenants(args.tenants), hosts=hosts,
+                nomonth=args.nomonth, delay=args.timedelay,
+                timeout=args.maxtime, chapter_budget=args.chapters,
+                top=args.top, detail=args.detail, countries=args.countries)
+
+        def close_tenants():
+            if hosts:
+                hosts.close()
+            close_engines()
+        return tenants_cycle, close_tenants
+
+    from dyrm import ffmonthly
+    if args.countries:
+        from dyrm import update_user_countries
+    if args.ao3:
+        from dyrm import do_you_read_ao3
+    ao3 = {}
+    site = {}
+    jar = {}
+    if args.site:
+        # A stand-in server needs no cookies
+        site = dict(base_url=args.site)
+        jar = dict(cookie_jar={})
+    # One throttle for fanfiction.net, so the country lookups keep
+    # their distance from the last monthly page too
+    from dyrm.throttle import HostThrottle
+    ffn = dict(throttle=HostThrottle(args.timedelay, 1))
+    if warm:
+        import requests
+        open_engine(args.database)
+        ffn['session'] = requests.Session()
+        ao3 = dict(session=requests.Session())
+    profiler = profile_phases(args)
+
+    def cycle():
+        logger.info("fanfiction.net")
+        ffmonthly.main(
+            args.database, nomonth=args.nomonth,
+            delay=args.timedelay, timeout=args.maxtime,
+            chapter_budget=args.chapters,
+            json_report=args.jsonreport, html_report=args.htmlreport,
+            top=args.top, detail=args.detail,
+            report_file=args.reportfile, report_stream=args.reportstream,
+            mem_report=args.memreport, metrics_file=args.metricsfile,
+            query_audit=args.queryaudit, profiler=profiler,
+            **ffn, **jar, **site)
+        if args.countries:
+            logger.info("user countries")
+            with profiler.phase("countries"):
+                update_user_countries.main(
+                    args.database, limit=args.countries,
+                    delay=args.timedelay, **ffn, **site)
+        if args.ao3:
+            logger.info("ao3")
+            with profiler.phase("ao3"):
+                do_you_read_ao3.main(
+                    args.database, metrics_file=args.metricsfile,
+                    **ao3, **jar, **site)
+
+    def close():
+        for kept in (ffn, ao3):
+            if 'session' in kept:
+                kept['session'].close()
+        close_engines()
+    return cycle, close
+
+
+def profile_phases(args):
+    """
+    The profiler the --profile options ask for, writing next to the
+    log file.
+    """
+
+    # pylint: disable=import-outside-toplevel
+
+    from dyrm.profiling import PhaseProfiler
+    if not args.profile:
+        return PhaseProfiler()
+    folder = os.path.dirname(os.path.abspath(args.logfile))
+    return PhaseProfiler(args.profile, args.profile_phase, folder)
+
+
+def import_profile(argv, top=25):
+    """
+    Print the import time of the modules the options would load,
+    slowest first, as measured by a fresh interpreter with
+    -X importtime.
+    """
+    import subprocess
+    code = "import ffm; ffm.crawl_cycle(ffm.parse_args({0!r}))".format(argv)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True, check=False)
+    rows = []
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "[us]" not in line:
+            self_us, cumulative_us, name = line[12:].split("|")
+            rows.append((int(self_us), int(cumulative_us), name.strip()))
+    rows.sort(reverse=True)
+    print("{0:>10} {1:>10}  module".format("self ms", "total ms"))
+    for self_us, cumulative_us, name in rows[:top]:
+        print("{0:10.1f} {1:10.1f}  {2}".format(
+            self_us / 1000, cumulative_us / 1000, name))
+    print("{0:10.1f} {1:>10}  all {2:d} modules".format(
+        sum(row[0] for row in rows) / 1000, "", len(rows)))
+
+
+def parse_args(argv=None):
+    """ The command line options """
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "-n", "--nomonth",
@@ -43,28 +185,154 @@ def main():
         type=float,
         default=18.0,
         help="max time to wait for page")
-    args = parser.parse_args()
+    parser.add_argument(
+        "-c", "--chapters",
+        type=int,
+        default=None,
+        help="max single-chapter pages to fetch per run")
+    parser.add_argument(
+        "--jsonreport",
+        type=str,
+        default=None,
+        help="path for the change report as JSON lines")
+    parser.add_argument(
+        "--htmlreport",
+        type=str,
+        default=None,
+        help="path for the change report as HTML tables")
+    parser.add_argument(
+        "-k", "--top",
+        type=int,
+        default=None,
+        help="summarise the top movers instead of every change")
+    parser.add_argument(
+        "--detail",
+        help="print every change as well as the top movers",
+        action="store_true")
+    parser.add_argument(
+        "--reportfile",
+        type=str,
+        default=None,
+        help="path for the streamed report segments and index")
+    parser.add_argument(
+        "--reportstream",
+        type=str,
+        default=None,
+        help="also stream the report to '-', host:port or a pipe")
+    parser.add_argument(
+        "--memreport",
+        help="log the memory use of each phase of the run",
+        action="store_true")
+    parser.add_argument(
+        "--queryaudit",
+        help="log the database statements by code location, and N+1 loops",
+        action="store_true")
+    parser.add_argument(
+        "--metricsfile",
+        type=str,
+        default=None,
+        help="write the timings of the last runs here for Prometheus")
+    parser.add_argument(
+        "--countries",
+        type=int,
+        default=None,
+        help="look up the countries of up to this many queued users")
+    parser.add_argument(
+        "--tenants",
+        type=str,
+        default=None,
+        help="path to an ini file of authors to crawl together")
+    parser.add_argument(
+        "--daemon",
+        type=float,
+        default=None,
+        help="stay up and crawl every this many seconds")
+    parser.add_argument(
+        "--controlport",
+        type=int,
+        default=CONTROL_PORT,
+        help="localhost port for daemon control commands")
+    parser.add_argument(
+        "--control",
+        type=str,
+        default=None,
+        choices=["run", "pause", "resume", "status", "stop"],
+        help="send a command to a running daemon and print the reply")
+    parser.add_argument(
+        "--site",
+        type=str,
+        default=None,
+        help="crawl a stand-in server at this url instead of the sites")
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        choices=["cpu", "mem", "sql"],
+        help="profile the crawl phases, writing next to the log file")
+    parser.add_argument(
+        "--profile-phase",
+        default=None,
+        choices=["legacy", "monthly", "ao3", "countries"],
+        action="append",
+        help="profile only this phase (repeat for more), not all")
+    parser.add_argument(
+        "--import-profile",
+        help="print the import time of each module these options load",
+        action="store_true")
+    args = parser.parse_args(argv)
+    if args.memreport and args.profile == "mem":
+        # Each resets the tracemalloc peak the other is measuring
+        parser.error("--memreport and --profile mem cannot be used together")
+    return args
+
 
+def main():
+    """ Run the crawl the options ask for, once or as a daemon """
+
+    # pylint: disable=import-outside-toplevel
+
+    args = parse_args()
+    if args.import_profile:
+        import_profile([x for x in sys.argv[1:] if x != "--import-profile"])
+        return
+    if args.control:
+        from dyrm.daemon import send_command
+        print(json.dumps(send_command(args.control, args.controlport)))
+        return
+
+    log_format = '%(message)s'
+    if args.tenants:
+        log_format = '%(threadName)s: %(message)s'
     logging.basicConfig(
         filename=args.logfile,
-        format='%(message)s',
+        format=log_format,
         level=logging.INFO)
     if args.out:
         hand = logging.StreamHandler(sys.stdout)
         hand.setLevel(logging.INFO)
-        form = logging.Formatter('%(message)s')
+        form = logging.Formatter(log_format)
         hand.setFormatter(form)
         logging.getLogger('').addHandler(hand)
 
-    logger = logging.getLogger(__name__)
-    logger.info("fanfiction.net")
+    cycle, close = crawl_cycle(args, warm=args.daemon is not None)
+    if args.daemon is None:
+        cycle()
+        close()
+        return
 
-    ffmonthly.main(
-        args.database, nomonth=args.nomonth,
-        delay=args.timedelay, timeout=args.maxtime)
-    if args.ao3:
-        logger.info("ao3")
-        do_you_read_ao3.main(args.database)
+    from dyrm import daemon
+    crawler = daemon.CrawlDaemon(cycle, interval=args.daemon)
+    daemon.install_signals(crawler)
+    server = daemon.serve_control(crawler, args.controlport)
+    logger = logging.getLogger(__name__)
+    logger.info("daemon up, control port {0:d}".format(args.controlport))
+    try:
+        crawler.serve()
+    finally:
+        server.shutdown()
+        server.server_close()
+        close()
+        logger.info("daemon stopped after {0:d} runs".format(crawler.runs))
 
 
 # Drive the main routine
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+from context import dyrm
+
+"""A synthetic author's database and stand-in site, for crawl tests."""
+import os
+import tempfile
+import unittest
+from dyrm.readme_db import ReadMeDb
+from dyrm.standin import StandinServer, AuthorPages
+from dyrm.synthetic import SyntheticAuthor, scaled
+
+
+class CrawlTestCase(unittest.TestCase):
+    """
+    A synthetic author of three months, the first two of them in a new
+    database in a temporary folder, and a stand-in server of its pages
+    for the crawl to catch up with the third.
+    """
+
+    scale = 0.1
+    seed = 5
+    serve = True
+
+    @classmethod
+    def setUpClass(cls):
+        cls.author = SyntheticAuthor(
+            scaled(cls.scale)._replace(months=3), seed=cls.seed)
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmp_dir.name, 'crawl.db')
+        with ReadMeDb(self.db_file) as read_db:
+            self.author.fill_db(read_db, months=2)
+            read_db.set_commit_flag()
+        self.standin = None
+        if self.serve:
+            self.standin = StandinServer(AuthorPages(self.author)).start()
+
+    def tearDown(self):
+        if self.standin is not None:
+            self.standin.stop()
+        self.tmp_dir.cleanup()
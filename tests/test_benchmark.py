@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+from context import dyrm
+
+"""Tests for the parser benchmark harness."""
+import os
+import json
+import tempfile
+import unittest
+from dyrm import benchmark
+
+
+class BenchmarkTestCase(unittest.TestCase):
+    """ Cases run on the saved pages, and regressions get flagged """
+
+    def test_run(self):
+        results = benchmark.run_benchmarks(
+            match="test_chapter_single", warmup=1, repeat=3)
+        self.assertEqual(
+            ['test_chapter_single.php:get_chapter_single',
+             'test_chapter_single.php:parse'],
+            sorted(results['cases']))
+        case = results['cases']['test_chapter_single.php:parse']
+        self.assertEqual(3, case['runs'])
+        self.assertLessEqual(case['min_us'], case['p50_us'])
+        self.assertLessEqual(case['p50_us'], case['p90_us'])
+        self.assertGreater(case['live_blocks'], 0)
+
+    def test_compare(self):
+        def result(**times):
+            return dict(cases=dict(
+                (name, dict(p50_us=value)) for name, value in times.items()))
+        baseline = result(a=100.0, b=100.0, c=100.0, gone=1.0)
+        current = result(a=105.0, b=125.0, c=80.0, new=1.0)
+        self.assertEqual(
+            [('a', ''), ('b', 'slower'), ('c', 'faster')],
+            [(row[0], row[4]) for row in benchmark.compare(
+                baseline, current, threshold=0.1)])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = []
+            for name, data in (('old', baseline), ('new', current)):
+                paths.append(os.path.join(tmp_dir, name + '.json'))
+                with open(paths[-1], 'w') as out_file:
+                    json.dump(data, out_file)
+            self.assertEqual(1, benchmark.main(['compare'] + paths))
+            self.assertEqual(
+                0, benchmark.main(['compare', '-t', '0.5'] + paths))
+
+
+if __name__ == '__main__':
+    unittest.main()
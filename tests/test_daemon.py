@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+from context import dyrm
+
+"""Tests for the resident crawler daemon."""
+import time
+import threading
+import os
+import tempfile
+import unittest
+from dyrm.readme_db import ReadMeDb, MStory, open_engine, close_engines
+from dyrm.daemon import CrawlDaemon, serve_control, send_command
+from dyrm.queryaudit import QueryAuditor
+from crawlcase import CrawlTestCase
+
+
+class CrawlDaemonTestCase(unittest.TestCase):
+    """ Cycles run on schedule and on command, and stop cleanly """
+
+    def setUp(self):
+        self.cycles = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def cycle(self):
+        self.gate.wait(5.0)
+        self.cycles.append(time.monotonic())
+        if len(self.cycles) == 2:
+            raise RuntimeError("site down")
+
+    def wait_for(self, test):
+        for _ in range(500):
+            if test():
+                return
+            time.sleep(0.01)
+        self.fail("timed out")
+
+    def test_control(self):
+        crawler = CrawlDaemon(self.cycle, interval=60.0)
+        server = serve_control(crawler, port=0)
+        port = server.server_address[1]
+        thread = threading.Thread(target=crawler.serve)
+        thread.start()
+        try:
+            self.wait_for(lambda: crawler.runs == 1)
+            status = send_command("status", port)
+            self.assertEqual(("idle", 1), (status['state'], status['runs']))
+            self.assertGreater(status['next_run'], 50.0)
+
+            self.assertEqual("paused", send_command("pause", port)['state'])
+            send_command("run", port)
+            self.wait_for(lambda: crawler.runs == 2)
+            status = send_command("status", port)
+            self.assertIn("site down", status['last_error'])
+            self.assertEqual("paused", status['state'])
+
+            self.gate.clear()
+            send_command("run", port)
+            self.wait_for(lambda: crawler.running)
+            self.assertEqual("stopping", send_command("stop", port)['state'])
+            self.gate.set()
+            thread.join(5.0)
+            self.assertFalse(thread.is_alive())
+            self.assertEqual(3, len(self.cycles))
+            self.assertIn('error', send_command("bogus", port))
+        finally:
+            crawler.stop()
+            self.gate.set()
+            server.shutdown()
+            server.server_close()
+
+    def test_schedule(self):
+        crawler = CrawlDaemon(self.cycle, interval=0.05)
+        thread = threading.Thread(target=crawler.serve)
+        thread.start()
+        self.wait_for(lambda: crawler.runs >= 3)
+        crawler.stop()
+        thread.join(5.0)
+        gaps = [b - a for a, b in zip(self.cycles, self.cycles[1:])]
+        self.assertGreaterEqual(min(gaps), 0.04)
+
+    def test_kept_engine(self):
+        """ Every open of a kept database shares one engine """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_file = os.path.join(tmp_dir, 'kept.db')
+            engine = open_engine(db_file)
+            with ReadMeDb(db_file) as read_db:
+                self.assertIs(engine, read_db.engine)
+            close_engines()
+            with ReadMeDb(db_file) as read_db:
+                self.assertIsNot(engine, read_db.engine)
+                read_db.engine.dispose()
+
+
+class WarmSnapshotsTestCase(CrawlTestCase):
+    """ A kept database serves its stored values from memory """
+
+    serve = False
+
+    def setUp(self):
+        super().setUp()
+        open_engine(self.db_file)
+
+    def tearDown(self):
+        close_engines()
+        super().tearDown()
+
+    def read(self, get_values):
+        """ The values, and the statements it took to get them """
+        auditor = QueryAuditor()
+        with ReadMeDb(self.db_file) as read_db, auditor.watch(read_db):
+            values = get_values(read_db)
+        return values, auditor.statements
+
+    def test_month_levels(self):
+        stories, count = self.read(lambda db: db.get_mstory_values(2))
+        self.assertEqual(self.author.month(1).stories, stories)
+        self.assertEqual(1, count)
+        self.assertEqual(
+            (stories, 0), self.read(lambda db: db.get_mstory_values(2)))
+        ref = sorted(stories)[0]
+        with ReadMeDb(self.db_file) as read_db:
+            read_db.get_or_create_mstory(2, ref).views = 12345
+            self.assertEqual(
+                12345, read_db.get_mstory_values(2)[ref][0])
+            read_db.set_commit_flag()
+        with ReadMeDb(self.db_file) as read_db:
+            # Not committed, so not kept
+            read_db.get_or_create_mstory(2, ref).views = 7
+            read_db.session.flush()
+        values, count = self.read(
+            lambda db: db.get_mstory_values(2))
+        self.assertEqual((12345, 0), (values[ref][0], count))
+        with ReadMeDb(self.db_file) as read_db:
+            self.assertEqual(
+                12345, read_db.session.get(MStory, (2, ref)).views)
+
+    def test_legacy(self):
+        legacy, count = self.read(lambda db: db.get_legacy_values())
+        self.assertEqual(len(self.author.stories), len(legacy))
+        self.assertEqual(1, count)
+        ref = sorted(legacy)[0]
+        with ReadMeDb(self.db_file) as read_db:
+            read_db.get_or_create_legacy(ref).favs += 1
+            read_db.set_commit_flag()
+        values, count = self.read(lambda db: db.get_legacy_values())
+        self.assertEqual(0, count)
+        self.assertEqual(legacy[ref]['favs'] + 1, values[ref]['favs'])
+
+
+if __name__ == '__main__':
+    unittest.main()
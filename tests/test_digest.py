@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+from context import dyrm
+
+"""Tests for the change log digests."""
+import os
+import datetime
+import unittest
+from dyrm.ffgetter import TitleRec
+from dyrm.monthdiff import Change
+from dyrm.readme_db import ReadMeDb
+from dyrm.reportgen import ReportGen
+from dyrm.digest import DigestBuilder
+
+
+def _safe_remove(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+
+class DigestTestCase(unittest.TestCase):
+    """ Log a couple of runs, then summarise them """
+
+    def setUp(self):
+        self.bogus_db = 'bogus_digest.db'
+        _safe_remove(self.bogus_db)
+        self.now = datetime.datetime(2016, 8, 20, 12, 0)
+        with ReadMeDb(self.bogus_db) as read_db:
+            read_db.batch_insert_stories([
+                TitleRec(ref=11096572, title='Axed'),
+                TitleRec(ref=10982066, title='Book Exchange')])
+
+            # An old run, outside the daily window.
+            old_report = ReportGen('All')
+            old_report.report_change(
+                'Monthly', 'country', Change('Canada', 'views', 0, 5, 5),
+                country='Canada')
+            read_db.log_changes(
+                old_report.events(),
+                started=self.now - datetime.timedelta(days=3))
+
+            report = ReportGen('All')
+            report.report_change(
+                'Axed', 'story', Change(11096572, 'views', 10, 14, 4),
+                entity='Axed', ref=11096572)
+            report.report_change(
+                'Book Exchange', 'story',
+                Change(10982066, 'views', 3, 12, 9),
+                entity='Book Exchange', ref=10982066)
+            report.report_change(
+                'Axed', 'chapter', Change(2, 'views', 1, 4, 3),
+                entity='Chapter 2', ref=11096572, chap=2)
+            for country, delta in [('Canada', 2), ('Brazil', 6)]:
+                report.report_change(
+                    'Monthly', 'country',
+                    Change(country, 'views', 0, delta, delta),
+                    country=country)
+            report.report_user(
+                'Axed', 'fav added', 'natalie1668', 'Italy', 2734390,
+                ref=11096572)
+            report.line_to_report('Axed', 'not a change')
+            read_db.log_changes(
+                report.events(),
+                started=self.now - datetime.timedelta(hours=2))
+            read_db.set_commit_flag()
+
+    def tearDown(self):
+        _safe_remove(self.bogus_db)
+
+    def test_daily_digest(self):
+        """ Only the last run counts for the daily digest """
+        with ReadMeDb(self.bogus_db) as read_db:
+            digest = DigestBuilder(read_db).build('daily', until=self.now)
+            self.assertEqual(1, digest.runs)
+            self.assertEqual(
+                ['Book Exchange', 'Axed'],
+                [x.title for x in digest.stories])
+            self.assertEqual([1, 2], [x.rank for x in digest.stories])
+            self.assertEqual(
+                [('Axed', 2, 3)],
+                [(x.title, x.chap, x.delta) for x in digest.chapters])
+            self.assertEqual(
+                ['Brazil', 'Canada'], [x.country for x in digest.countries])
+            self.assertEqual(
+                ['Brazil'], [x[0] for x in digest.new_countries])
+            self.assertEqual(
+                [('Axed', 'natalie1668')],
+                [(x.title, x.alias) for x in digest.new_favs])
+
+    def test_story_digest(self):
+        """ A weekly digest for one story """
+        with ReadMeDb(self.bogus_db) as read_db:
+            digest = DigestBuilder(read_db).build(
+                'weekly', until=self.now, ref=11096572)
+            self.assertEqual([4], [x.delta for x in digest.stories])
+            self.assertEqual(1, len(digest.new_favs))
+            self.assertEqual([], digest.countries)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+from context import dyrm
+
+"""Tests for the ao3 works crawl and update."""
+import os
+import time
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+from lxml import html
+from dyrm.do_you_read_ao3 import crawl_works, update_ao3_stories
+from dyrm.do_you_read_ao3 import Ao3Rec, Ao3Scraper
+from dyrm.readme_db import ReadMeDb
+from dyrm.reportgen import ReportGen
+
+
+def works_page(page, page_count):
+    """ A works listing page with two works and pagination links """
+    works = "".join(
+        '<li class="work blurb group" id="work_{0:d}">'
+        '<div class="header module"><h4 class="heading">'
+        '<a href="/works/{0:d}">Work {0:d}</a></h4></div>'
+        '<dl class="stats"><dd class="hits">{1:d}</dd>'
+        '<dd class="kudos">1</dd></dl></li>'.format(page * 10 + num, page)
+        for num in range(2))
+    links = "".join(
+        '<li><a href="?page={0:d}">{0:d}</a></li>'.format(num)
+        for num in range(1, page_count + 1) if num != page)
+    return html.fromstring(
+        '<html><body>{0}<ol class="pagination actions">{1}'
+        '<li><a href="?page=2">Next</a></li></ol></body></html>'.format(
+            works, links))
+
+
+class FakeGetter:
+    """ Serves listing pages, later pages faster, from many threads """
+
+    def __init__(self, page_count):
+        self.page_count = page_count
+        self.pages = []
+        self.lock = threading.Lock()
+
+    def get_page(self, page, payload=None):
+        num = (payload or {}).get("page", 1)
+        with self.lock:
+            self.pages.append(num)
+        time.sleep(0.01 * (self.page_count - num))
+        return works_page(num, self.page_count)
+
+
+BLURBS = """<html><body><ol class="work index group">
+<li class="work blurb group" id="work_11" role="article">
+  <div class="header module"><h4 class="heading">
+    <a href="/works/11">Grembert's Forgotten Tale</a>
+    by <a rel="author" href="/users/RockSunner/pseuds/RockSunner">RS</a>
+  </h4></div>
+  <dl class="stats">
+    <dt class="words">Words:</dt><dd class="words">12,345</dd>
+    <dt class="chapters">Chapters:</dt>
+    <dd class="chapters"><a href="/works/11/chapters/99">3</a>/3</dd>
+    <dt class="comments">Comments:</dt>
+    <dd class="comments"><a href="/works/11?show_comments=true">7</a></dd>
+    <dt class="kudos">Kudos:</dt><dd class="kudos"><a href="#">1,024</a></dd>
+    <dt class="hits">Hits:</dt><dd class="hits">12,001</dd>
+  </dl>
+</li>
+<li class="work blurb group" id="work_12" role="article">
+  <div class="header module"><h4 class="heading">
+    <a href="/works/12">No Stats Yet</a></h4></div>
+</li>
+<li class="work blurb group" id="work_13" role="article">
+  <div class="header module"><h4 class="heading">
+    <a href="/works/13">Oracular</a></h4></div>
+  <dl class="stats"><dd class="bookmarks"><a href="#">2</a></dd>
+    <dd class="hits">128</dd></dl>
+</li>
+</ol></body></html>"""
+
+
+class Ao3CrawlTestCase(unittest.TestCase):
+    """ Pages are fetched in parallel and merged in page order """
+
+    def test_crawl_order(self):
+        getter = FakeGetter(6)
+        recs = crawl_works(getter, "works", workers=3)
+        self.assertEqual(
+            list(range(1, 7)), sorted(getter.pages))
+        self.assertEqual(12, len(recs))
+        self.assertEqual(
+            [page * 10 + num for page in range(1, 7) for num in range(2)],
+            [rec.ref for rec in recs])
+        self.assertEqual(6, recs[-1].hits)
+
+    def test_single_page(self):
+        getter = FakeGetter(1)
+        recs = crawl_works(getter, "works")
+        self.assertEqual([1], getter.pages)
+        self.assertEqual(2, len(recs))
+
+
+class Ao3ScraperTestCase(unittest.TestCase):
+    """ Each blurb is parsed on its own """
+
+    def test_blurbs(self):
+        recs = Ao3Scraper().parse_tree(html.fromstring(BLURBS), [])
+        self.assertEqual([
+            Ao3Rec(11, "Grembert's Forgotten Tale", 12001, 1024, 7, 0),
+            Ao3Rec(12, "No Stats Yet", 0, 0, 0, 0),
+            Ao3Rec(13, "Oracular", 128, 0, 0, 2)], recs)
+
+
+class Ao3UpdateTestCase(unittest.TestCase):
+    """ Old title-keyed works are migrated and matched up by title """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmp_dir.name, 'ao3.db')
+        shutil.copy('readme.db', self.db_file)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_migrate_and_update(self):
+        recs = [
+            Ao3Rec(501, "Oracular", 130, 3, 0, 0),
+            Ao3Rec(502, "Gravmanji", 163, 5, 0, 2),
+            Ao3Rec(503, "Brand New", 1, 0, 0, 0)]
+        report_gen = ReportGen("A03")
+        with ReadMeDb(self.db_file) as read_db:
+            stored = read_db.get_ao3_values()
+            self.assertEqual(54, len(stored))
+            self.assertTrue(all(ref < 0 for ref in stored))
+            changes = update_ao3_stories(recs, read_db, report_gen)
+            read_db.set_commit_flag()
+        self.assertEqual(
+            [(501, 'hits', 128, 130), (503, 'hits', 0, 1)],
+            [(x.key, x.field, x.old, x.new) for x in changes])
+
+        recs[1] = Ao3Rec(502, "Gravmanji Redux", 163, 6, 0, 2)
+        with ReadMeDb(self.db_file) as read_db:
+            stored = read_db.get_ao3_values()
+            self.assertEqual(("Brand New", 1, 0, 0, 0), stored[503])
+            self.assertEqual(54 + 1, len(stored))
+            changes = update_ao3_stories(recs, read_db, ReportGen("A03"))
+            self.assertEqual(
+                ("Gravmanji Redux", 163, 6, 0, 2),
+                read_db.get_ao3_values()[502])
+        self.assertEqual(['kudos'], [x.field for x in changes])
+
+    def update(self, db_file, recs):
+        """ Update the works, and the stored (ref, title) after """
+        with ReadMeDb(db_file) as read_db:
+            update_ao3_stories(recs, read_db, ReportGen("A03"))
+            read_db.set_commit_flag()
+        with ReadMeDb(db_file) as read_db:
+            return sorted(
+                (ref, values[0])
+                for ref, values in read_db.get_ao3_values().items())
+
+    def test_same_title(self):
+        """ Two works may share a title """
+        db_file = os.path.join(self.tmp_dir.name, 'same.db')
+        self.assertEqual(
+            [(601, "Twins"), (602, "Twins")],
+            self.update(db_file, [
+                Ao3Rec(601, "Twins", 1, 0, 0, 0),
+                Ao3Rec(602, "Twins", 2, 0, 0, 0)]))
+
+    def test_title_swap(self):
+        """ Two works may swap their titles in one update """
+        db_file = os.path.join(self.tmp_dir.name, 'swap.db')
+        self.update(db_file, [
+            Ao3Rec(601, "First", 1, 0, 0, 0),
+            Ao3Rec(602, "Second", 2, 0, 0, 0)])
+        self.assertEqual(
+            [(601, "Second"), (602, "First")],
+            self.update(db_file, [
+                Ao3Rec(601, "Second", 1, 0, 0, 0),
+                Ao3Rec(602, "First", 2, 0, 0, 0)]))
+
+    def test_migrate_same_title(self):
+        """ Migrating keeps both works of a shared title """
+        db_file = os.path.join(self.tmp_dir.name, 'old.db')
+        conn = sqlite3.connect(db_file)
+        with conn:
+            conn.execute(
+                "CREATE TABLE ao3stories (ref INTEGER, title VARCHAR, "
+                "hits INTEGER, kudos INTEGER, comments INTEGER, "
+                "bookmarks INTEGER)")
+            conn.executemany(
+                "INSERT INTO ao3stories VALUES (?, ?, 0, 0, 0, 0)",
+                [(601, "Twins"), (602, "Twins")])
+        conn.close()
+        self.assertEqual(
+            [(601, "Twins"), (602, "Twins")], self.update(db_file, []))
+
+    def test_unique_titles_migrated(self):
+        """ A table keyed by work id loses its unique title index """
+        db_file = os.path.join(self.tmp_dir.name, 'unique.db')
+        self.update(db_file, [])
+        conn = sqlite3.connect(db_file)
+        with conn:
+            conn.execute("DROP INDEX ao3_title")
+            conn.execute(
+                "CREATE UNIQUE INDEX ao3_title ON ao3stories (title)")
+        conn.close()
+        self.assertEqual(
+            [(601, "Twins"), (602, "Twins")],
+            self.update(db_file, [
+                Ao3Rec(601, "Twins", 1, 0, 0, 0),
+                Ao3Rec(602, "Twins", 2, 0, 0, 0)]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,6 +4,8 @@ from context import dyrm
 
 """Tests for Do You Read Me."""
 import os
+import shutil
+import tempfile
 import unittest
 from mock import patch, MagicMock
 from dyrm.readme_db import ReadMeDb
@@ -14,13 +16,6 @@ import requests
 from requests import Session, Response
 
 
-def _safe_remove(filename):
-    try:
-        os.remove(filename)
-    except OSError:
-        pass
-
-
 def file_to_string(filename):
     """ file contents into a string """
     data = ""
@@ -39,9 +34,12 @@ class DoYouReadMeTestCase(unittest.TestCase):
         self.cjar = MagicMock()
         self.legacy_text = file_to_string("test_story.php")
         self.part_favs_text = file_to_string("part_favs.php")
+        # Opening the fixture migrates it, so work on a copy, and keep
+        # new databases out of the tree too
+        self.tmp_dir = tempfile.TemporaryDirectory()
 
     def tearDown(self):
-        pass
+        self.tmp_dir.cleanup()
 
     @patch('requests.Response', autospec=Response)
     @patch('requests.Session', autospec=Session)
@@ -53,8 +51,7 @@ class DoYouReadMeTestCase(unittest.TestCase):
         mock_session.get.return_value = mock_response
         with PageGetter(mock_session, cookie_jar=self.cjar, delay=0.1) as pgetter:
             getter = FanfictionGetter(pgetter)
-            bogus_db = 'bogus2.db'
-            _safe_remove(bogus_db)
+            bogus_db = os.path.join(self.tmp_dir.name, 'bogus2.db')
             with ReadMeDb(bogus_db) as read_db:
                 repgen = ReportGen('Legacy', silent=True)
                 do_you_read_me.do_legacy_story_page(
@@ -73,7 +70,8 @@ class DoYouReadMeTestCase(unittest.TestCase):
         follows_to_update = []
         with PageGetter(mock_session, cookie_jar=self.cjar, delay=0.1) as pgetter:
             getter = FanfictionGetter(pgetter)
-            bogus_db = 'readme.db'
+            bogus_db = os.path.join(self.tmp_dir.name, 'readme.db')
+            shutil.copy('readme.db', bogus_db)
             with ReadMeDb(bogus_db) as read_db:
                 repgen = ReportGen('Legacy', silent=False)
                 do_you_read_me.check_fav_follow_changes(
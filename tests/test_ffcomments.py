@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+from context import dyrm
+
+"""Tests for the incremental comment sync."""
+import io
+import os
+import sqlite3
+import datetime
+import contextlib
+import tempfile
+import unittest
+from sqlalchemy import text
+from dyrm.ffgetter import TitleRec
+from dyrm.readme_db import ReadMeDb, CommentRec, Comments, SComments
+from ffcomments import get_new_comments, do_comment_page, search_comments
+
+
+def stamp(day):
+    return datetime.datetime(2020, 1, day, 12, 0)
+
+
+class FakeCommentPages:
+    """ Review pages, newest first, two reviews a page """
+
+    def __init__(self, days):
+        self.days = sorted(days, reverse=True)
+        self.links = []
+
+    def get_comment_tree(self, link):
+        self.links.append(link)
+        return len(self.links) - 1
+
+    def get_comments(self, page):
+        days = self.days[page * 2:page * 2 + 2]
+        mynext = None
+        if len(self.days) > page * 2 + 2:
+            mynext = "r/7/0/{0:d}/".format(page + 2)
+        return (
+            mynext, [stamp(day) for day in days], [1] * len(days),
+            ["review {0:d}".format(day) for day in days],
+            [(day % 2 * 100, "name {0:d}".format(day)) for day in days])
+
+
+class CommentSyncTestCase(unittest.TestCase):
+    """ Only new reviews are fetched and stored """
+
+    def test_stop_at_stored(self):
+        pages = FakeCommentPages(range(1, 10))
+        recs = get_new_comments(pages, pages, 7, newest=stamp(6))
+        self.assertEqual(["r/7/", "r/7/0/2/"], pages.links)
+        self.assertEqual([9, 8, 7, 6], [rec.stamp.day for rec in recs])
+
+        pages = FakeCommentPages(range(1, 6))
+        recs = get_new_comments(pages, pages, 7)
+        self.assertEqual(3, len(pages.links))
+        self.assertEqual(5, len(recs))
+
+    def test_store_once(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_file = os.path.join(tmp_dir, 'comments.db')
+            with ReadMeDb(db_file) as read_db:
+                read_db.batch_insert_stories([TitleRec(7, 'Seven')])
+                pages = FakeCommentPages(range(1, 4))
+                self.assertEqual(
+                    3, do_comment_page(pages, pages, read_db, 7))
+                stamps = read_db.get_comment_stamps()
+                self.assertEqual({7: stamp(3)}, stamps)
+                pages = FakeCommentPages(range(1, 5))
+                self.assertEqual(1, do_comment_page(
+                    pages, pages, read_db, 7, stamps[7]))
+                self.assertEqual(0, read_db.add_comments([
+                    CommentRec(7, 1, stamp(2), "name 2", "again", 0)]))
+                read_db.set_commit_flag()
+            with ReadMeDb(db_file) as read_db:
+                self.assertEqual(
+                    {7: stamp(4)}, read_db.get_comment_stamps())
+                signed = read_db.session.query(SComments).all()
+                self.assertEqual([100, 100], [x.code for x in signed])
+                self.assertEqual(
+                    ["name 1", "name 3"],
+                    sorted(x.name for x in signed[0].user.aliases))
+
+    def test_migrate_repeats(self):
+        """ An old database loses its repeated comments, and says so """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_file = os.path.join(tmp_dir, 'old.db')
+            with ReadMeDb(db_file) as read_db:
+                read_db.batch_insert_stories([TitleRec(7, 'Seven')])
+                read_db.set_commit_flag()
+            conn = sqlite3.connect(db_file)
+            with conn:
+                conn.execute("DROP INDEX comment_key")
+                conn.executemany(
+                    "INSERT INTO comments (num, ref, chapter, name, "
+                    "comment, stamp) VALUES (?, 7, 1, 'Mabel', 'Hi', "
+                    "'2020-01-01 12:00:00.000000')", [(1,), (2,), (3,)])
+                conn.execute("INSERT INTO scomments VALUES (2, 5)")
+            conn.close()
+            with self.assertLogs('dyrm.readme_db', 'WARNING') as logs, \
+                    ReadMeDb(db_file) as read_db:
+                self.assertEqual(
+                    [1], [x.num for x in read_db.session.query(Comments)])
+                self.assertEqual(0, read_db.session.query(SComments).count())
+            self.assertIn(
+                "Removed 2 repeated comments (and 1 of their signed rows)",
+                logs.output[0])
+
+
+class CommentSearchTestCase(unittest.TestCase):
+    """ Comments are found by words and by reviewer names """
+
+    def test_search(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_file = os.path.join(tmp_dir, 'search.db')
+            with ReadMeDb(db_file) as read_db:
+                read_db.batch_insert_stories(
+                    [TitleRec(7, 'Seven'), TitleRec(8, 'Eight')])
+                read_db.add_comments([
+                    CommentRec(7, 1, stamp(1), "Mabel", "Loved the llama", 5),
+                    CommentRec(7, 2, stamp(2), "guest", "Llama llama!", 0),
+                    CommentRec(8, 1, stamp(3), "Ford", "Where is Bill?", 6)])
+                read_db.add_comments([
+                    CommentRec(8, 3, stamp(4), "Shooting Star",
+                               "Café scene", 5)])
+                read_db.set_commit_flag()
+            with ReadMeDb(db_file) as read_db:
+                hits = read_db.search_comments("llama")
+                self.assertEqual([2, 1], [hit.chapter for hit in hits])
+                self.assertEqual('Seven', hits[0].title)
+                self.assertEqual(stamp(2), hits[0].stamp)
+                self.assertLessEqual(hits[0].rank, hits[1].rank)
+                self.assertEqual(
+                    [1], [x.chapter for x in read_db.search_comments(
+                        "llama", ref=7, chapter=1)])
+                self.assertEqual(
+                    [(8, 'Café scene')], [
+                        (x.ref, x.comment) for x in
+                        read_db.search_comments("cafe")])
+                self.assertEqual(
+                    {1, 3}, set(x.chapter for x in read_db.search_comments(
+                        'aliases: "shooting star"')))
+                for table in ('scomments', 'comments'):
+                    read_db.session.execute(text(
+                        "DELETE FROM {0} WHERE num IN (SELECT num FROM "
+                        "comments WHERE ref = 8 AND chapter = 1)".format(
+                            table)))
+                self.assertEqual([], read_db.search_comments("bill"))
+
+    def test_bad_query(self):
+        """ A query FTS5 cannot parse is reported, not raised """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_file = os.path.join(tmp_dir, 'search.db')
+            with ReadMeDb(db_file) as read_db:
+                read_db.batch_insert_stories([TitleRec(7, 'Seven')])
+                read_db.add_comments([
+                    CommentRec(7, 1, stamp(1), "Mabel", "Don't stop", 5)])
+                errors = io.StringIO()
+                with contextlib.redirect_stderr(errors):
+                    for query in ("don't", '"unclosed', "foo:"):
+                        self.assertIsNone(search_comments(read_db, query))
+                self.assertEqual(
+                    3, errors.getvalue().count("bad search query"))
+                self.assertEqual(1, search_comments(read_db, "stop"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,8 +3,13 @@
 from context import dyrm
 
 """Tests for Do You Read Me."""
+import time
+import threading
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from mock import patch
 from dyrm.ffgetter import FanfictionScraper, VisCounter
+from dyrm.throttle import HostThrottle
 from dyrm.ffgetter import TitleRec, MonthlyChapterRec
 from lxml import html
 
@@ -359,5 +364,69 @@ class FanfictionGetterTestCase(unittest.TestCase):
             self.assertEqual(by_country[i].visitors, item.visitors)
 
 
+class HostThrottleTestCase(unittest.TestCase):
+    """ Request starts are spaced out and concurrency is capped """
+
+    def test_spacing_and_cap(self):
+        throttle = HostThrottle(min_interval=0.02, max_concurrent=2)
+        starts = []
+        busy = []
+
+        def request(_):
+            with throttle:
+                starts.append(time.monotonic())
+                busy.append(1)
+                self.assertLessEqual(len(busy), 2)
+                time.sleep(0.05)
+                busy.pop()
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            list(pool.map(request, range(6)))
+        starts.sort()
+        gaps = [b - a for a, b in zip(starts, starts[1:])]
+        self.assertEqual(6, len(starts))
+        self.assertGreaterEqual(min(gaps), 0.015)
+
+    def test_round_robin(self):
+        """ A tenant with a queue takes turns with one that arrives later """
+        throttle = HostThrottle(min_interval=0.0, max_concurrent=1)
+        order = []
+
+        def request(name):
+            with throttle.tenant(name):
+                order.append(name)
+
+        def queue_up(name, count):
+            for _ in range(count):
+                threading.Thread(target=request, args=(name,)).start()
+            while len(throttle.waiting.get(name, ())) < count:
+                time.sleep(0.001)
+
+        throttle.acquire("holder")
+        queue_up("a", 3)
+        queue_up("b", 1)
+        throttle.release()
+        while len(order) < 4:
+            time.sleep(0.001)
+        self.assertEqual(["a", "b", "a", "a"], order)
+        self.assertEqual({}, throttle.waiting)
+
+    def test_interrupted_wait(self):
+        """ A request interrupted while waiting does not block the rest """
+        throttle = HostThrottle(min_interval=0.0, max_concurrent=1)
+        throttle.acquire("holder")
+        with patch.object(
+                throttle.ready, 'wait', side_effect=KeyboardInterrupt):
+            self.assertRaises(KeyboardInterrupt, throttle.acquire, "a")
+        self.assertEqual(({}, []), (throttle.waiting, list(throttle.turns)))
+        done = []
+        waiter = threading.Thread(
+            target=lambda: (throttle.acquire("b"), done.append(1)))
+        waiter.start()
+        throttle.release()
+        waiter.join(2.0)
+        self.assertEqual([1], done)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -10,7 +10,8 @@ from dyrm.readme_db import ReadMeDb
 from dyrm.ffgetter import PageGetter, FanfictionGetter, FanfictionScraper
 from dyrm.ffgetter import MonthCaption, TitleRec
 # import dyrm.ffmonthly
-from dyrm.ffmonthly import MonthlyDataTree, MonthlySetup
+from dyrm.ffmonthly import MonthlyDataTree, MonthlySetup, ChapterQueue
+from dyrm.ffgetter import MonthlyChapterRec, VisCounter
 import requests
 import types
 from requests import Session, Response
@@ -323,6 +324,82 @@ class FFMonthlyTestCase(unittest.TestCase):
         mcap_report = mtree.get_monthly_report()
         self.assertEqual(1, mcap_report.get_report_len())
 
+    def test_story_updates(self):
+        """ Changed stories get a chapter check and a report line """
+        scraper = FanfictionScraper()
+        content = self.eyes_text.encode("utf-8")
+        tree = html.fromstring(content)
+        story_rows = scraper.get_month_story_rows(tree)
+        getter = MagicMock(autospec=FanfictionGetter)
+        read_db = MagicMock(autospec=ReadMeDb)
+        # The second story has hits and no stored record yet.
+        read_db.get_mstory_values.return_value = dict(
+            (x.ref, (x.views, x.visitors))
+            for pos, x in enumerate(story_rows) if pos != 1)
+        my_date = types.SimpleNamespace(mid=1, month=8, year=2016)
+        mtree = MonthlyDataTree(getter, my_date, eyes_tree=tree)
+        mtree.check_story_updates(story_rows, read_db)
+        self.assertEqual(
+            {story_rows[1].title}, mtree.get_changed_story_set())
+        read_db.set_check_pending.assert_called_once_with(story_rows[1].ref)
+        read_db.get_or_create_mstory.assert_called_once_with(
+            1, story_rows[1].ref)
+        self.assertEqual(1, mtree.get_report().get_report_len())
+
+    def test_country_signatures(self):
+        """ Unchanged countries are never read or written again """
+        read_db = MagicMock(autospec=ReadMeDb)
+        cache = {}
+        read_db.get_signatures.side_effect = cache.get
+        read_db.set_signatures.side_effect = (
+            lambda scope, digest, sigs: cache.update({scope: (digest, sigs)}))
+        read_db.get_mctry_values.return_value = {'Canada': (3, 2)}
+        by_country = [
+            VisCounter(cat='Canada', views=3, visitors=2),
+            VisCounter(cat='Peru', views=1, visitors=1)]
+        my_date = types.SimpleNamespace(mid=1, month=8, year=2016)
+        mtree = MonthlyDataTree(MagicMock(), my_date, eyes_tree=MagicMock())
+        mtree.check_country_updates(by_country, read_db)
+        read_db.get_mctry_values.assert_called_once_with(1, None)
+        read_db.get_or_create_mctry.assert_called_once_with(1, 'Peru')
+
+        # Same values again: nothing read, nothing created.
+        read_db.reset_mock()
+        mtree.check_country_updates(by_country, read_db)
+        self.assertFalse(read_db.get_mctry_values.called)
+        self.assertFalse(read_db.get_or_create_mctry.called)
+        self.assertFalse(read_db.set_signatures.called)
+
+        # One country moved: only its stored row is read.
+        by_country[1] = VisCounter(cat='Peru', views=2, visitors=1)
+        read_db.get_mctry_values.return_value = {'Peru': (1, 1)}
+        mtree.check_country_updates(by_country, read_db)
+        read_db.get_mctry_values.assert_called_once_with(1, ['Peru'])
+        read_db.get_or_create_mctry.assert_called_once_with(1, 'Peru')
+        self.assertEqual(
+            3, len(list(mtree.get_monthly_report().events())))
+
+    def test_chapter_queue_budget(self):
+        """ The biggest and stalest chapter changes get fetched first """
+        chapters = [
+            MonthlyChapterRec(
+                ch_ref=100 + num, num=num, title="Chapter %d" % num,
+                words=1000, views=0, visitors=0) for num in range(1, 5)]
+        queue = ChapterQueue(budget=2)
+        queue.add(1, "Story", chapters[0], 3)
+        queue.add(1, "Story", chapters[1], 20)
+        queue.add(1, "Story", chapters[2], 1, deferred=4)
+        queue.add(1, "Story", chapters[3], 2, latest=True)
+        queue.add(1, "Story", chapters[0], 2)
+        now, later = queue.split()
+        self.assertEqual([3, 2], [x.chapter.num for x in now])
+        self.assertEqual([4, 1], [x.chapter.num for x in later])
+        self.assertEqual(5, later[1].delta)
+        queue.add(2, "Other", chapters[0], 50)
+        now, later = queue.split()
+        self.assertEqual([], now)
+        self.assertEqual(1, len(later))
+
     # def test_monthly_updates_on_empty(self):
     #     """ Want to know if I can drive monthly data directly,
     #         when the database access is cleanly factored out.
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+from context import dyrm
+
+"""Tests for the run instruments."""
+import io
+import os
+import datetime
+import unittest
+import contextlib
+from crawlcase import CrawlTestCase
+from dyrm.instruments import Instruments, BUCKETS, current, endpoint
+from dyrm.instruments import statement_group, quantile, prometheus_text
+from dyrm.instruments import label_value
+from dyrm.readme_db import ReadMeDb
+from dyrm import ffmonthly
+
+
+class InstrumentsTestCase(unittest.TestCase):
+    """ Histograms, keys and the text format """
+
+    def test_histogram(self):
+        instruments = Instruments()
+        for seconds in (0.0001, 0.002, 0.002, 0.3, 40.0):
+            instruments.observe('parse', 'call', seconds)
+        instruments.add('page_bytes', '/a', 100)
+        instruments.add('page_bytes', '/a', 50)
+        rows = dict(((x[0], x[1]), x[2:]) for x in instruments.rows())
+        count, total, peak, buckets = rows[('parse', 'call')]
+        self.assertEqual(5, count)
+        self.assertAlmostEqual(40.3041, total)
+        self.assertEqual(40.0, peak)
+        self.assertEqual(len(BUCKETS) + 1, len(buckets))
+        self.assertEqual([1, 1, 3], buckets[:3])
+        self.assertEqual(4, buckets[-2])
+        self.assertEqual(5, buckets[-1])
+        self.assertEqual(150, rows[('page_bytes', '/a')][0])
+        self.assertLessEqual(quantile(buckets, count, 0.5, peak), 0.0025)
+        self.assertEqual(40.0, quantile(buckets, count, 1.0, peak))
+
+    def test_disabled(self):
+        instruments = Instruments(enabled=False)
+        with instruments.phase('any'):
+            instruments.page('http://x/a', 0, 0, 0, 10, 200)
+        self.assertEqual([], instruments.rows())
+        self.assertFalse(current().enabled)
+        with Instruments().active() as active:
+            self.assertIs(active, current())
+        self.assertFalse(current().enabled)
+
+    def test_keys(self):
+        self.assertEqual(
+            "/stats/story_eyes.php",
+            endpoint("https://www.fanfiction.net/stats/story_eyes.php"))
+        self.assertEqual("/u/{id}", endpoint("http://127.0.0.1:80/u/1234"))
+        self.assertEqual(
+            "/users/{user}/works", endpoint("http://x/users/Someone/works"))
+        self.assertEqual(
+            "select mstory",
+            statement_group("SELECT mstory.ref FROM mstory WHERE x = ?"))
+        self.assertEqual(
+            "insert changes",
+            statement_group("INSERT INTO changes (run) VALUES (?)"))
+        self.assertEqual("pragma", statement_group("PRAGMA foreign_keys"))
+
+    def test_prometheus(self):
+        instruments = Instruments()
+        instruments.page('http://x/u/1', 0.1, 0.2, 0.01, 300, 200)
+        instruments.page('http://x/u/2', 0.1, 0.2, 0.01, 0, 'timeout')
+        text = prometheus_text([
+            ('fanfiction', datetime.datetime(2020, 1, 1),
+             instruments.rows())])
+        self.assertIn(
+            'dyrm_page_ttfb_seconds_count{source="fanfiction",'
+            'endpoint="/u/{id}"} 2', text)
+        self.assertIn(
+            'dyrm_page_responses_total{source="fanfiction",'
+            'endpoint="/u/{id}",status="timeout"} 1', text)
+        self.assertIn(
+            'dyrm_page_bytes_total{source="fanfiction",'
+            'endpoint="/u/{id}"} 300', text)
+
+    def test_label_escapes(self):
+        self.assertEqual(r'"a\"b\\c\nd"', label_value('a"b\\c\nd'))
+        instruments = Instruments()
+        instruments.observe('parse', 'say "hi"', 0.1)
+        instruments.add('page_bytes', '/a\\b', 10)
+        text = prometheus_text([
+            ('ten"ant', datetime.datetime(2020, 1, 1), instruments.rows())])
+        self.assertIn(
+            'dyrm_parse_seconds_count{source="ten\\"ant",'
+            'call="say \\"hi\\""} 1', text)
+        self.assertIn(
+            'dyrm_page_bytes_total{source="ten\\"ant",'
+            'endpoint="/a\\\\b"} 10', text)
+        self.assertIn('dyrm_run_started_seconds{source="ten\\"ant"}', text)
+
+
+class InstrumentedCrawlTestCase(CrawlTestCase):
+    """ A crawl of the stand-in saves and exports its timings """
+
+    def test_crawl_metrics(self):
+        prom_file = os.path.join(self.tmp_dir.name, 'dyrm.prom')
+        with contextlib.redirect_stdout(io.StringIO()):
+            ffmonthly.main(
+                self.db_file, delay=0, cookie_jar={},
+                base_url=self.standin.url, metrics_file=prom_file)
+        with ReadMeDb(self.db_file) as read_db:
+            (source, _, rows), = read_db.get_latest_run_metrics()
+        self.assertEqual("fanfiction", source)
+        series = dict(((x[0], x[1]), x[2]) for x in rows)
+        paths = self.standin.stats()['paths']
+        self.assertEqual(
+            paths['/stats/story_eyes_story.php'],
+            series[('page_ttfb', '/stats/story_eyes_story.php')])
+        self.assertEqual(
+            paths['/stats/story_eyes_story.php'],
+            series[('page_responses', '/stats/story_eyes_story.php 200')])
+        self.assertEqual(
+            sum(paths.values()), series[('parse', 'html')])
+        self.assertIn(('parse', 'get_chapters_rows'), series)
+        self.assertIn(('db_query', 'select mstory'), series)
+        self.assertIn(('db_flush', 'flush'), series)
+        self.assertEqual(1, series[('phase', 'legacy')])
+        with open(prom_file) as prom:
+            text = prom.read()
+        self.assertIn('dyrm_phase_seconds_count{source="fanfiction",'
+                      'phase="legacy"} 1', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+from context import dyrm
+
+"""Tests for the per-phase memory report."""
+import tracemalloc
+import unittest
+from lxml import html
+from dyrm.ffgetter import FanfictionScraper
+from dyrm.memreport import PhaseMemory
+
+
+class PhaseMemoryTestCase(unittest.TestCase):
+    """ Phases record their memory use, pages get let go """
+
+    def test_phases(self):
+        """ Peak covers what a phase allocated, even if freed """
+        memory = PhaseMemory()
+        with memory.phase("big"):
+            block = bytearray(2 * 1024 * 1024)
+            del block
+        with memory.phase("small"):
+            pass
+        memory.report()
+        memory.stop()
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertEqual(["big", "small"], [x.phase for x in memory.phases])
+        big = memory.phases[0]
+        self.assertGreaterEqual(big.peak - big.start, 2 * 1024 * 1024)
+        self.assertLess(memory.phases[1].peak - big.start, 1024 * 1024)
+
+    def test_disabled(self):
+        """ A disabled collector measures nothing """
+        memory = PhaseMemory(enabled=False)
+        with memory.phase("none"):
+            pass
+        self.assertEqual([], memory.phases)
+
+    def test_scraper_release(self):
+        """ The parsers hold no elements of the last page """
+        with open('test_story_eyes.php', 'r') as eyes_file:
+            tree = html.fromstring(eyes_file.read().encode("utf-8"))
+        scraper = FanfictionScraper()
+        story_rows = scraper.get_month_story_rows(tree)
+        self.assertTrue(scraper.month_story_rows_parser.story_rows)
+        scraper.release()
+        self.assertEqual([], scraper.month_story_rows_parser.story_rows)
+        self.assertTrue(story_rows)
+
+
+if __name__ == '__main__':
+    unittest.main()
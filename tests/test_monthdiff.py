@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+from context import dyrm
+
+"""Tests for the monthly snapshot differ."""
+import types
+import unittest
+from dyrm.ffgetter import VisCounter
+from dyrm.monthdiff import diff_snapshot, Change
+from dyrm.monthdiff import key_signatures, level_digest, moved_keys
+
+
+class MonthDiffTestCase(unittest.TestCase):
+    """ Diff scraped records against stored values """
+
+    def setUp(self):
+        self.current = dict((x.cat, x) for x in [
+            VisCounter(cat='United States', views=10, visitors=5),
+            VisCounter(cat='Canada', views=3, visitors=2),
+            VisCounter(cat='Brazil', views=1, visitors=1)])
+
+    def test_no_changes(self):
+        """ Identical values give an empty change set """
+        stored = {
+            'United States': (10, 5), 'Canada': (3, 2), 'Brazil': (1, 1)}
+        changes = diff_snapshot(self.current, stored)
+        self.assertFalse(changes)
+        self.assertEqual([], changes.changed_keys())
+
+    def test_changes_in_scraped_order(self):
+        """ Changes come out by key, views before visitors """
+        stored = {'United States': (8, 4), 'Canada': (3, 2)}
+        changes = diff_snapshot(self.current, stored)
+        self.assertEqual([
+            Change('United States', 'views', 8, 10, 2),
+            Change('United States', 'visitors', 4, 5, 1),
+            Change('Brazil', 'views', 0, 1, 1),
+            Change('Brazil', 'visitors', 0, 1, 1)], list(changes))
+        self.assertEqual(['United States', 'Brazil'], changes.changed_keys())
+
+    def test_apply_only_changed(self):
+        """ The writer only sees keys that moved """
+        stored = {
+            'United States': (10, 4), 'Canada': (3, 2), 'Brazil': (1, 1)}
+        recs = {}
+
+        def get_rec(key):
+            recs[key] = types.SimpleNamespace(views=0, visitors=0)
+            return recs[key]
+
+        diff_snapshot(self.current, stored).apply(get_rec)
+        self.assertEqual(['United States'], list(recs))
+        self.assertEqual(5, recs['United States'].visitors)
+
+    def test_signatures(self):
+        """ Only keys whose values changed get a new signature """
+        signatures = key_signatures(self.current)
+        digest = level_digest(signatures)
+        self.current['Canada'] = VisCounter(
+            cat='Canada', views=4, visitors=2)
+        new_signatures = key_signatures(self.current)
+        self.assertNotEqual(digest, level_digest(new_signatures))
+        self.assertEqual(
+            ['Canada'],
+            moved_keys(self.current, new_signatures, signatures))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+from context import dyrm
+
+"""Tests for the phase profiles."""
+import io
+import os
+import pstats
+import tempfile
+import unittest
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from crawlcase import CrawlTestCase
+from dyrm.profiling import PhaseProfiler
+from dyrm.readme_db import ReadMeDb
+from dyrm import ffmonthly
+import ffm
+
+
+class PhaseProfilerTestCase(unittest.TestCase):
+    """ Each kind of profile writes its files for the chosen phases """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.folder = self.tmp_dir.name
+        self.db_file = os.path.join(self.folder, 'profile.db')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def work(self):
+        with ReadMeDb(self.db_file) as read_db:
+            for _ in range(5):
+                read_db.get_last_mid()
+            read_db.set_commit_flag()
+        return [bytes(1000) for _ in range(100)]
+
+    def test_cpu(self):
+        profiler = PhaseProfiler('cpu', ['monthly'], self.folder)
+        with profiler.phase('legacy'):
+            self.work()
+        self.assertEqual([], profiler.artifacts)
+        with profiler.phase('monthly'):
+            self.work()
+        prof, text = profiler.artifacts
+        self.assertTrue(prof.endswith('-monthly.cpu.prof'))
+        self.assertIn('work', str(pstats.Stats(prof).stats))
+        with open(text) as text_file:
+            self.assertIn('cumulative', text_file.read())
+
+    def test_cpu_workers(self):
+        def worker_only():
+            return sum(range(1000))
+
+        profiler = PhaseProfiler('cpu', None, self.folder)
+        with profiler.phase('ao3'):
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                list(pool.map(lambda _: worker_only(), range(4)))
+        prof, text = profiler.artifacts
+        self.assertIn('worker_only', str(pstats.Stats(prof).stats))
+        with open(text) as text_file:
+            self.assertRegex(text_file.read(), 'with [12] worker threads')
+
+    def test_mem(self):
+        profiler = PhaseProfiler('mem', None, self.folder)
+        with profiler.phase('ao3'):
+            kept = self.work()
+        with open(profiler.artifacts[0]) as text_file:
+            text = text_file.read()
+        self.assertTrue(text.startswith('traced'))
+        self.assertIn('test_profiling.py', text)
+        self.assertEqual(100, len(kept))
+
+    def test_sql(self):
+        profiler = PhaseProfiler('sql', None, self.folder)
+        with profiler.phase('legacy'):
+            self.work()
+        self.work()
+        with open(profiler.artifacts[0]) as text_file:
+            lines = text_file.read().splitlines()
+        mid = [x for x in lines if 'FROM months ORDER BY' in x]
+        self.assertEqual(1, len(mid))
+        self.assertEqual('5', mid[0].split()[0])
+
+    def test_options(self):
+        args = ffm.parse_args(
+            ['--profile', 'sql', '--profile-phase', 'ao3',
+             '--profile-phase', 'monthly',
+             '-l', os.path.join(self.folder, 'ooo.txt')])
+        profiler = ffm.profile_phases(args)
+        self.assertEqual('sql', profiler.kind)
+        self.assertEqual({'ao3', 'monthly'}, profiler.phases)
+        self.assertEqual(self.folder, profiler.folder)
+        self.assertIsNone(ffm.profile_phases(ffm.parse_args([])).kind)
+        with contextlib.redirect_stderr(io.StringIO()), \
+                self.assertRaises(SystemExit):
+            ffm.parse_args(['--profile', 'mem', '--memreport'])
+
+
+class ProfiledCrawlTestCase(CrawlTestCase):
+    """ A crawl of the stand-in, with its monthly phase profiled """
+
+    def test_monthly_sql(self):
+        profiler = PhaseProfiler('sql', ['monthly'], self.tmp_dir.name)
+        with contextlib.redirect_stdout(io.StringIO()):
+            ffmonthly.main(
+                self.db_file, delay=0, cookie_jar={},
+                base_url=self.standin.url, profiler=profiler)
+        path, = profiler.artifacts
+        self.assertIn('-monthly.sql.txt', path)
+        with open(path) as text_file:
+            self.assertIn('INSERT INTO mstory', text_file.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
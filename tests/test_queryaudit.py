@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+from context import dyrm
+
+"""Tests for the query auditor and the statement budgets."""
+import io
+import unittest
+import contextlib
+from crawlcase import CrawlTestCase
+from lxml import html
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from dyrm.queryaudit import QueryAuditor, statement_shape
+from dyrm.instruments import Instruments
+from dyrm.statements import timed_statements
+from dyrm.readme_db import ReadMeDb, Favs
+from dyrm.reportgen import ReportGen
+from dyrm.ffgetter import PageGetter, FanfictionGetter, FanfictionScraper
+from dyrm.ffmonthly import MonthlyDataTree
+import dyrm.do_you_read_me as doyouread
+
+# Statements allowed for each story or user that changed
+STORY_BUDGET = 4
+USER_BUDGET = 4
+
+
+class QueryAuditorTestCase(CrawlTestCase):
+    """ Statement counts of a synthetic author's database """
+
+    scale = 0.2
+
+    def test_shape(self):
+        self.assertEqual(
+            "SELECT x FROM t WHERE a = ? AND b IN (?...) AND c = ?",
+            statement_shape(
+                "SELECT x FROM t\n WHERE a = 12 AND b IN (?, ?, ?)"
+                " AND c = 'it''s'"))
+
+    def test_repeats(self):
+        auditor = QueryAuditor(threshold=3)
+        with ReadMeDb(self.db_file) as read_db, auditor.watch(read_db):
+            with auditor.phase("users"):
+                for user in self.author.users[:4]:
+                    read_db.get_or_create_user(user[0], "Unknown")
+            read_db.get_last_mid()
+        self.assertEqual(5, auditor.statements)
+        suspect, = auditor.suspects()
+        self.assertEqual(("users", 4), (suspect.phase, suspect.count))
+        self.assertIn("FROM users", suspect.shape)
+        location, count = suspect.locations[0]
+        self.assertIn("get_or_create_user", location)
+        self.assertEqual(4, count)
+        self.assertIn("likely N+1:", auditor.report_lines())
+
+    def test_disabled(self):
+        auditor = QueryAuditor(enabled=False)
+        with ReadMeDb(self.db_file) as read_db, auditor.watch(read_db):
+            read_db.get_last_mid()
+        self.assertEqual(0, auditor.statements)
+
+    def test_shared_timer(self):
+        """ One timer for every watcher, and no start left by a failure """
+        auditor, instruments = QueryAuditor(), Instruments()
+        timed = []
+        with ReadMeDb(self.db_file) as read_db, auditor.watch(read_db), \
+                instruments.watch(read_db):
+            with timed_statements(
+                    read_db.engine, lambda *args: timed.append(args)) \
+                    as timer:
+                self.assertEqual(3, len(timer.subscribers))
+                with self.assertRaises(OperationalError):
+                    read_db.session.execute(text("SELECT * FROM nowhere"))
+                conn = read_db.session.connection()
+                self.assertEqual([], conn.info[timer.start_key])
+        self.assertEqual([], timed)
+        self.assertEqual(0, auditor.statements)
+        self.assertEqual([], instruments.rows())
+
+    def test_budget(self):
+        auditor = QueryAuditor()
+        with ReadMeDb(self.db_file) as read_db, auditor.watch(read_db):
+            with self.assertRaisesRegex(AssertionError, "budget of 1"):
+                with auditor.budget(1):
+                    read_db.get_last_mid()
+                    read_db.get_last_mid()
+
+    def test_story_updates_budget(self):
+        """ A new month changes every story; no query per story more """
+        tree = html.fromstring(self.author.story_eyes_page(2))
+        story_rows = FanfictionScraper().get_month_story_rows(tree)
+        auditor = QueryAuditor()
+        with ReadMeDb(self.db_file) as read_db:
+            mtree = MonthlyDataTree(None, read_db.get_last_month())
+            with auditor.watch(read_db), contextlib.redirect_stdout(
+                    io.StringIO()), auditor.budget(
+                        2 + STORY_BUDGET * len(story_rows)):
+                mtree.check_story_updates(story_rows, read_db)
+                pending = read_db.get_checks_pending()
+        self.assertEqual(len(story_rows), len(pending))
+
+    def test_fav_follow_budget(self):
+        """ Favs gone from the database are found and added back """
+        ref = self.author.stories[0][0]
+        with ReadMeDb(self.db_file) as read_db:
+            favs = read_db.session.query(Favs).filter_by(ref=ref).all()
+            for fav in favs[:6]:
+                read_db.session.delete(fav)
+            read_db.set_commit_flag()
+        auditor = QueryAuditor()
+        with PageGetter(delay=0) as pgetter, \
+                ReadMeDb(self.db_file) as read_db:
+            getter = FanfictionGetter(pgetter, self.standin.url)
+            with auditor.watch(read_db), contextlib.redirect_stdout(
+                    io.StringIO()), auditor.budget(3 + USER_BUDGET * 6):
+                doyouread.check_fav_follow_changes(
+                    [ref], [], read_db, getter, ReportGen("Favs"))
+                read_db.session.flush()
+            self.assertEqual(
+                len(favs), len(read_db.get_favs_for_story(ref)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+from context import dyrm
+
+"""Tests for loading the Firefox cookies."""
+import os
+import sqlite3
+import tempfile
+import unittest
+from dyrm.read_firefox_cookies import get_cookie_jar
+
+COOKIES = [
+    (".fanfiction.net", "/", 1, 4102444800, "funn", "1"),
+    ("www.fanfiction.net", "/", 1, 4102444800, "xcookie", "2"),
+    ("archiveofourown.org", "/", 1, 4102444800, "_otwarchive", "3"),
+    (".example.com", "/", 0, 4102444800, "tracker", "4"),
+    ("notfanfiction.net", "/", 0, 4102444800, "lookalike", "5")]
+
+
+class CookieJarTestCase(unittest.TestCase):
+    """ Only our hosts' cookies, cached until the store changes """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.sql_file = os.path.join(self.tmp_dir.name, 'cookies.sqlite')
+        con = sqlite3.connect(self.sql_file)
+        con.execute(
+            "CREATE TABLE moz_cookies (id INTEGER PRIMARY KEY, "
+            "host TEXT, path TEXT, isSecure INTEGER, expiry INTEGER, "
+            "name TEXT, value TEXT)")
+        con.executemany(
+            "INSERT INTO moz_cookies "
+            "(host, path, isSecure, expiry, name, value) "
+            "VALUES (?, ?, ?, ?, ?, ?)", COOKIES)
+        con.commit()
+        con.close()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_hosts(self):
+        jar = get_cookie_jar(self.tmp_dir.name)
+        self.assertEqual(
+            ['_otwarchive', 'funn', 'xcookie'],
+            sorted(cookie.name for cookie in jar))
+        funn = [cookie for cookie in jar if cookie.name == 'funn'][0]
+        self.assertTrue(funn.domain_specified)
+        self.assertTrue(funn.secure)
+        self.assertIs(jar, get_cookie_jar(self.tmp_dir.name))
+        self.assertFalse(get_cookie_jar(
+            os.path.join(self.tmp_dir.name, 'missing')))
+
+    def test_fresh_login(self):
+        """ A change still in Firefox's write-ahead log is picked up """
+        jar = get_cookie_jar(self.tmp_dir.name)
+        con = sqlite3.connect(self.sql_file)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute(
+            "INSERT INTO moz_cookies "
+            "(host, path, isSecure, expiry, name, value) "
+            "VALUES ('archiveofourown.org', '/', 1, 4102444800, "
+            "'user_credentials', '6')")
+        con.commit()
+        try:
+            fresh = get_cookie_jar(self.tmp_dir.name)
+        finally:
+            con.close()
+        self.assertIsNot(jar, fresh)
+        self.assertIn('user_credentials', [cookie.name for cookie in fresh])
+
+
+if __name__ == '__main__':
+    unittest.main()
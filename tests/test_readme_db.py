@@ -303,6 +303,21 @@ class ReadMeDbTestCase(unittest.TestCase):
     #         self.assertTrue("m_stories" in rec)
     #         self.assertTrue(not rec["m_stories"])
 
+    def test_get_mstory_values(self):
+        """ Stored monthly story totals come back in one dictionary """
+        bogus_db = 'bogus.db'
+        _safe_remove(bogus_db)
+        with ReadMeDb(bogus_db) as read_db:
+            read_db.batch_insert_stories(self.titles[:2])
+            read_db.get_or_create_month(month=8, year=2016, mid=1)
+            rec = read_db.get_or_create_mstory(1, self.titles[0].ref)
+            rec.views = 7
+            rec.visitors = 3
+            values = read_db.get_mstory_values(1)
+            self.assertEqual({self.titles[0].ref: (7, 3)}, values)
+            self.assertEqual({}, read_db.get_mstory_values(2))
+        _safe_remove(bogus_db)
+
     def test_set_commit(self):
         """ Want to know if we can get a commit """
         bogus_db = 'bogus2.db'
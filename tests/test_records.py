@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+from context import dyrm
+
+"""Tests for the compact record tables."""
+import unittest
+from dyrm.ffgetter import VisCounter
+from dyrm.monthdiff import diff_snapshot
+from dyrm.records import RecordTable
+
+
+class RecordTableTestCase(unittest.TestCase):
+    """ Rows kept as columns, handed out as records """
+
+    def setUp(self):
+        self.table = RecordTable(VisCounter, text_fields=('cat',))
+        self.table.append('United States', 10, 5)
+        self.table.append(cat='Canada', views=3, visitors=2)
+        self.table.append('Brazil', 1, 1)
+
+    def test_rows(self):
+        """ Rows come back as the namedtuple record """
+        self.assertEqual(3, len(self.table))
+        self.assertEqual(VisCounter('Canada', 3, 2), self.table[1])
+        self.assertEqual('Brazil', self.table[-1].cat)
+        self.assertEqual(['United States', 'Canada'], [
+            rec.cat for rec in self.table[:2]])
+        self.assertEqual(list(self.table), self.table)
+
+    def test_keyed_columns(self):
+        """ Keyed views share the table's columns """
+        current = self.table.keyed('cat')
+        self.assertIs(self.table.column('views'), current.column('views'))
+        self.assertEqual(2, current['Canada'].visitors)
+        self.table.append('Canada', 4, 3)
+        current = self.table.keyed('cat')
+        self.assertEqual(3, len(current))
+        self.assertEqual([10, 4, 1], current.column('views'))
+
+    def test_diff_table(self):
+        """ The differ reads the columns of a keyed table """
+        stored = {'United States': (10, 5), 'Canada': (2, 2)}
+        changes = diff_snapshot(self.table.keyed('cat'), stored)
+        self.assertEqual(['Canada', 'Brazil'], changes.changed_keys())
+        self.assertEqual(3, len(changes))
+
+
+if __name__ == '__main__':
+    unittest.main()
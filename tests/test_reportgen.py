@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+from context import dyrm
+
+"""Tests for the change report generator."""
+import io
+import json
+import unittest
+from mock import patch
+from dyrm.monthdiff import Change
+from dyrm.reportgen import ReportGen
+
+
+class ReportGenTestCase(unittest.TestCase):
+    """ Events in, text, JSON and HTML out """
+
+    def setUp(self):
+        self.report = ReportGen('Test')
+        self.report.report_change(
+            'Axed', 'chapter', Change(3, 'views', 4, 9, 5),
+            entity='Chapter 3', ref=11096572, chap=3)
+        self.report.report_change(
+            'Axed', 'chapter_country', Change('Canada', 'visitors', 1, 2, 1),
+            entity='Chapter 3', ref=11096572, chap=3, country='Canada')
+        self.report.report_user(
+            'Axed', 'fav added', 'natalie1668', 'Italy', 2734390,
+            ref=11096572)
+        self.report.line_to_report('Me', 'Test line')
+
+    def test_text_lines(self):
+        """ Text keeps the old report line formats """
+        self.assertEqual([
+            "chapter 3: 'Chapter 3' views 4 to 9 (delta 5)",
+            "chapter 3: 'Chapter 3' for 'Canada' visitors 1 to 2 (delta 1)",
+            "'Axed' fav added 'natalie1668' from 'Italy' (2734390)"],
+            self.report.text_lines('Axed'))
+        self.assertEqual(['Test line'], self.report.text_lines('Me'))
+        self.assertEqual(2, self.report.get_report_len())
+
+    def test_json_lines(self):
+        """ One JSON object per event, with the delta filled in """
+        stream = io.StringIO()
+        self.report.write_json_lines(stream)
+        events = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual(4, len(events))
+        self.assertEqual('chapter', events[0]['level'])
+        self.assertEqual(5, events[0]['delta'])
+        self.assertEqual(11096572, events[0]['ref'])
+
+    def test_html(self):
+        """ One table per section """
+        stream = io.StringIO()
+        self.report.write_html(stream)
+        html_text = stream.getvalue()
+        self.assertEqual(2, html_text.count('<table>'))
+        self.assertIn('<td>Canada</td>', html_text)
+
+    def test_silent_formats_nothing(self):
+        """ A silent report never renders its events """
+        report = ReportGen('Silent', silent=True)
+        report.report_change('Axed', 'story', Change(1, 'views', 0, 1, 1))
+        with patch('dyrm.reportgen.event_text') as mock_text:
+            report.print_report()
+            self.assertFalse(mock_text.called)
+
+    def test_top_movers(self):
+        """ Only the top few deltas per category are kept """
+        report = ReportGen('Summary', top=2, detail=False)
+        monthly = report.sibling('Monthly')
+        for ref, delta in enumerate([5, 40, 3, 40, 12], start=1):
+            report.report_change(
+                'Story %d' % ref, 'story',
+                Change(ref, 'views', 0, delta, delta),
+                entity='Story %d' % ref, ref=ref)
+        report.report_change(
+            'Story 2', 'chapter', Change(2, 'views', 7, 9, 2),
+            entity='Second', ref=2, chap=2)
+        monthly.report_change(
+            'Monthly', 'country', Change('Peru', 'views', 1, 8, 7),
+            country='Peru')
+        monthly.report_change(
+            'Monthly', 'country', Change('Peru', 'visitors', 1, 9, 8),
+            country='Peru')
+        self.assertEqual(
+            ['Story 2', 'Story 4'],
+            [label[0] for _, label in report.movers.ranked('stories')])
+        self.assertEqual([
+            "Top 2 stories",
+            "'Story 2' views +40",
+            "'Story 4' views +40",
+            "Top 1 chapters",
+            "'Story 2' chapter 2: 'Second' views +2",
+            "Top 1 countries",
+            "country 'Peru' views +7"], report.summary_lines())
+        with patch('dyrm.reportgen.event_text') as mock_text:
+            report.print_report()
+            monthly.print_report()
+            self.assertFalse(mock_text.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+from context import dyrm
+
+"""Tests for the streaming report sink."""
+import io
+import os
+import tempfile
+import unittest
+from dyrm.monthdiff import Change
+from dyrm.reportgen import ReportGen
+from dyrm.reportsink import ReportSink
+
+
+class ReportSinkTestCase(unittest.TestCase):
+    """ Sections go out as they are printed and come back sorted """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'report.jsonl')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def add_story(self, report, title, views):
+        report.report_change(
+            title, 'story', Change(1, 'views', 0, views, views),
+            entity=title, ref=views)
+
+    def test_flush_and_read_back(self):
+        """ A printed section leaves memory but not the report """
+        stream = io.StringIO()
+        with ReportSink(self.path, stream=stream) as sink:
+            report = ReportGen('All', sink=sink)
+            self.add_story(report, 'Zed', 3)
+            self.add_story(report, 'Axed', 5)
+            report.print_keyed_section('Zed')
+            self.assertNotIn('Zed', report.report)
+            self.assertEqual(2, report.get_report_len())
+            report.print_report()
+            self.assertEqual(0, len(report.report))
+            self.assertEqual(
+                ['Axed', 'Zed'], [event.key for event in report.events()])
+            self.assertEqual(2, len(stream.getvalue().splitlines()))
+
+            entries = [entry for entry, _ in sink.sorted_sections('All')]
+            self.assertEqual(['Axed', 'Zed'], [e.key for e in entries])
+
+    def test_rotation(self):
+        """
+        Full segments roll over; the oldest are dropped, with their
+        index entries, by the next run's sink
+        """
+        with ReportSink(self.path, max_bytes=1, backups=2) as sink:
+            report = ReportGen('All', sink=sink)
+            for views, title in enumerate(['A', 'B', 'C', 'D'], start=1):
+                self.add_story(report, title, views)
+                report.print_keyed_section(title)
+            self.assertEqual([1, 2, 3, 4], sink.segments())
+            self.assertEqual(
+                ['A', 'B', 'C', 'D'],
+                [event.key for event in report.events()])
+        with ReportSink(self.path, max_bytes=1, backups=2) as sink:
+            report = ReportGen('All', sink=sink)
+            self.add_story(report, 'E', 5)
+            report.print_keyed_section('E')
+            self.assertEqual([4, 5], sink.segments())
+            self.assertEqual(
+                ['D', 'E'], [entry.key for entry in sink.read_index()])
+            self.assertEqual(
+                [5], [event.delta for event in report.events('E')])
+        with open(self.path + ".idx", encoding='utf-8') as index:
+            self.assertEqual(2, len(index.readlines()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+from context import dyrm
+
+"""Tests for the stand-in site server."""
+import io
+import os
+import time
+import unittest
+import contextlib
+from mock import patch
+from crawlcase import CrawlTestCase
+from dyrm.ffgetter import PageGetter, FanfictionGetter, FanfictionScraper
+from dyrm.throttle import HostThrottle
+from dyrm.readme_db import ReadMeDb, ChapPend
+from dyrm.standin import StandinServer, FixturePages, NO_FAULTS
+from dyrm import ffmonthly, do_you_read_ao3, update_user_countries
+import ffm
+
+PAGES_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class StandinFaultsTestCase(unittest.TestCase):
+    """ The saved pages, slowed down or broken """
+
+    def setUp(self):
+        self.standin = StandinServer(FixturePages(PAGES_DIR)).start()
+
+    def tearDown(self):
+        self.standin.stop()
+
+    def get_eyes(self, timeout=5.0):
+        with PageGetter(delay=0, timeout=timeout) as pgetter:
+            getter = FanfictionGetter(pgetter, self.standin.url)
+            return getter.get_story_eyes_tree()
+
+    def test_fixture_pages(self):
+        tree = self.get_eyes()
+        mcap = FanfictionScraper().get_month_caption(tree)
+        self.assertEqual(('2016', '08'), (mcap.year, mcap.month))
+        self.assertEqual(
+            {'/stats/story_eyes.php': 1}, self.standin.stats()['paths'])
+
+    def test_errors(self):
+        self.standin.faults = NO_FAULTS._replace(error_rate=1.0)
+        self.assertRaises(ConnectionRefusedError, self.get_eyes)
+        self.standin.faults = NO_FAULTS._replace(logout_rate=1.0)
+        with self.assertRaisesRegex(ConnectionRefusedError, 'logged in'):
+            self.get_eyes()
+        self.assertEqual(
+            {'200': 1, '503': 1}, self.standin.stats()['statuses'])
+
+    def test_hang(self):
+        self.standin.faults = NO_FAULTS._replace(hang_rate=1.0, hang=1.0)
+        with self.assertRaisesRegex(ConnectionAbortedError, 'Timeout'):
+            self.get_eyes(timeout=0.2)
+
+    def test_slow(self):
+        size = os.path.getsize(os.path.join(PAGES_DIR, 'test_story_eyes.php'))
+        self.standin.faults = NO_FAULTS._replace(
+            latency=0.1, bandwidth=size * 4)
+        start = time.monotonic()
+        self.get_eyes()
+        self.assertGreater(time.monotonic() - start, 0.3)
+
+
+class StandinCrawlTestCase(CrawlTestCase):
+    """ A whole crawl of a synthetic author, over HTTP """
+
+    def test_new_month(self):
+        """ The crawl catches up with the month the site has moved on to """
+        with contextlib.redirect_stdout(io.StringIO()):
+            ffmonthly.main(
+                self.db_file, delay=0, cookie_jar={},
+                base_url=self.standin.url)
+        month = self.author.month(2)
+        with ReadMeDb(self.db_file) as read_db:
+            self.assertEqual(3, read_db.get_last_mid())
+            self.assertEqual(month.stories, read_db.get_mstory_values(3))
+        paths = self.standin.stats()['paths']
+        self.assertEqual(2, paths['/stats/story_eyes.php'])
+        self.assertEqual(
+            len(self.author.stories), paths['/stats/story_eyes_story.php'])
+
+    def test_closed_month_chapters(self):
+        """ Chapters put off in a month that has closed are dropped """
+        ref = self.author.stories[0][0]
+        ch_ref, num, _, _ = self.author.chapters[ref][0]
+        with ReadMeDb(self.db_file) as read_db:
+            for mid in (1, 2):
+                read_db.set_chapter_pending(mid, ref, num, ch_ref, 5, 0)
+            read_db.set_commit_flag()
+        with contextlib.redirect_stdout(io.StringIO()):
+            ffmonthly.main(
+                self.db_file, delay=0, cookie_jar={},
+                base_url=self.standin.url, chapter_budget=0)
+        with ReadMeDb(self.db_file) as read_db:
+            mids = set(
+                pending.mid for pending in read_db.session.query(ChapPend))
+        self.assertEqual({3}, mids)
+
+    def test_ao3_and_countries(self):
+        code = self.author.users[0][0]
+        with contextlib.redirect_stdout(io.StringIO()):
+            do_you_read_ao3.main(
+                self.db_file, cookie_jar={}, throttle=HostThrottle(0, 3),
+                base_url=self.standin.url)
+            update_user_countries.main(
+                self.db_file, userid=code, throttle=HostThrottle(0, 1),
+                base_url=self.standin.url)
+        with ReadMeDb(self.db_file) as read_db:
+            self.assertEqual(
+                len(self.author.stories), len(read_db.get_ao3_values()))
+            self.assertEqual(
+                self.author.users[0][2],
+                read_db.find_users_with_code(code)[0].country)
+        self.assertEqual(
+            1, self.standin.stats()['paths']['/u/{0:d}'.format(code)])
+
+    def test_one_throttle(self):
+        """ A one-shot run spaces the country lookups from ffmonthly """
+        args = ffm.parse_args([
+            '-d', self.db_file, '-t', '0', '--countries', '2',
+            '--site', self.standin.url])
+        cycle, close = ffm.crawl_cycle(args)
+        with patch.object(
+                ffmonthly, 'main', wraps=ffmonthly.main) as monthly, \
+                patch.object(
+                    update_user_countries, 'main',
+                    wraps=update_user_countries.main) as countries, \
+                contextlib.redirect_stdout(io.StringIO()):
+            cycle()
+        close()
+        throttle = monthly.call_args.kwargs['throttle']
+        self.assertIsInstance(throttle, HostThrottle)
+        self.assertIs(throttle, countries.call_args.kwargs['throttle'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+from context import dyrm
+
+"""Start-up cost of the ffm.py entry point."""
+import os
+import sys
+import subprocess
+import unittest
+import ffm
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+HEAVY = ('lxml', 'requests', 'sqlalchemy')
+
+
+def import_times(code):
+    """ Cumulative import times in microseconds, by module """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], cwd=ROOT,
+        capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "[us]" not in line:
+            _, cumulative_us, name = line[12:].split("|")
+            times[name.strip()] = int(cumulative_us)
+    return times
+
+
+class StartupTestCase(unittest.TestCase):
+    """ The entry point loads the subsystems only when asked to """
+
+    def test_budget(self):
+        best = min(
+            import_times("import ffm")['ffm'] for _ in range(3))
+        self.assertLess(best, ffm.STARTUP_BUDGET)
+
+    def test_lazy(self):
+        times = import_times(
+            "import ffm; ffm.parse_args(['--control', 'status'])")
+        self.assertFalse([name for name in times if name in HEAVY])
+        times = import_times(
+            "import ffm; ffm.crawl_cycle(ffm.parse_args(['-n']))")
+        self.assertIn('sqlalchemy', times)
+        self.assertNotIn('dyrm.do_you_read_ao3', times)
+        self.assertNotIn('dyrm.daemon', times)
+
+    def test_countries_light(self):
+        """ user_cntry.py's module needs no page parsers """
+        times = import_times("import dyrm.update_user_countries")
+        self.assertIn('dyrm.update_user_countries', times)
+        self.assertNotIn('lxml', times)
+        self.assertNotIn('dyrm.ffgetter', times)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+from context import dyrm
+
+"""Tests for the synthetic author data."""
+import io
+import os
+import random
+import tempfile
+import unittest
+import contextlib
+from lxml import html
+from dyrm.ffgetter import FanfictionScraper
+from dyrm.monthdiff import diff_snapshot
+from dyrm.readme_db import ReadMeDb
+from dyrm.synthetic import SyntheticAuthor, scaled, allocate, BASE_SCALE
+from dyrm.synthetic import main
+
+
+class SyntheticAuthorTestCase(unittest.TestCase):
+    """ The made up database and pages agree with each other """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.author = SyntheticAuthor(scaled(0.2)._replace(months=3), seed=7)
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.db_file = os.path.join(cls.tmp_dir.name, 'synthetic.db')
+        with ReadMeDb(cls.db_file) as read_db:
+            cls.author.fill_db(read_db)
+            read_db.set_commit_flag()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def setUp(self):
+        self.scraper = FanfictionScraper()
+
+    def test_scale(self):
+        scale = scaled(10)
+        self.assertEqual(BASE_SCALE.stories * 10, scale.stories)
+        self.assertEqual(BASE_SCALE.chapters, scale.chapters)
+        author = self.author
+        self.assertEqual(21, len(author.stories))
+        self.assertEqual(220, len(author.users))
+        self.assertEqual(260, len(author.favs))
+        self.assertEqual(
+            len(author.favs), len(set(x[:2] for x in author.favs)))
+
+    def test_skew(self):
+        """ The most popular story outdoes the median one many times """
+        views = sorted(
+            (x[0] for x in self.author.month(0).stories.values()),
+            reverse=True)
+        self.assertGreater(views[0], 4 * views[len(views) // 2])
+
+    def test_repeatable(self):
+        again = SyntheticAuthor(self.author.scale, seed=7)
+        self.assertEqual(self.author.stories, again.stories)
+        self.assertEqual(self.author.month(1), again.month(1))
+        self.assertNotEqual(
+            self.author.stories, SyntheticAuthor(self.author.scale).stories)
+
+    def test_allocate(self):
+        rng = random.Random(1)
+        self.assertEqual(100, sum(allocate(100, [3, 2, 1], rng)))
+        self.assertEqual(2, sum(allocate(2, [1] * 10, rng)))
+        self.assertEqual([0, 0], allocate(0, [1, 1], rng))
+
+    def test_story_eyes(self):
+        """ The latest month's page has the stored totals """
+        tree = html.fromstring(self.author.story_eyes_page())
+        mcap = self.scraper.get_month_caption(tree)
+        with ReadMeDb(self.db_file) as read_db:
+            mid = read_db.get_last_mid()
+            mtop = read_db.get_last_mtop()
+            self.assertEqual(3, mid)
+            self.assertEqual(
+                (mtop.views, mtop.visitors), (mcap.views, mcap.visitors))
+            rows = self.scraper.get_month_story_rows(tree)
+            self.assertEqual(21, len(rows))
+            changes = diff_snapshot(
+                rows.keyed('ref'), read_db.get_mstory_values(mid))
+            self.assertEqual(0, len(changes))
+            _, by_country = self.scraper.get_monthly_visits(tree)
+            changes = diff_snapshot(
+                by_country.keyed('cat'), read_db.get_mctry_values(mid))
+            self.assertEqual(0, len(changes))
+        self.assertEqual(
+            ['03', '2016'], list(self.scraper.get_month_latest(tree)))
+
+    def test_chapters(self):
+        """ A story's chapter rows and a chapter's countries """
+        ref = self.author.stories[0][0]
+        tree = html.fromstring(self.author.story_chapters_page(ref, 1))
+        rows = self.scraper.get_chapters_rows(tree)
+        self.assertEqual(len(self.author.chapters[ref]), len(rows))
+        with ReadMeDb(self.db_file) as read_db:
+            self.assertEqual(
+                set(x.ch_ref for x in rows),
+                set(read_db.get_chapters_dict(ref)))
+            changes = diff_snapshot(
+                rows.keyed('num'), read_db.get_mchap_values(2, ref))
+            self.assertEqual(0, len(changes))
+            tree = html.fromstring(
+                self.author.chapter_single_page(rows[0].ch_ref, 1))
+            by_country = self.scraper.get_chapter_single(tree)
+            changes = diff_snapshot(
+                by_country.keyed('cat'),
+                read_db.get_chapctry_values(2, ref, 1))
+            self.assertEqual(0, len(changes))
+        self.assertEqual(rows[0].views, sum(x.views for x in by_country))
+
+    def test_legacy_and_parts(self):
+        tree = html.fromstring(self.author.legacy_page())
+        legacy = dict((x.ref, x) for x in self.scraper.get_legacy(tree))
+        ref = self.author.stories[0][0]
+        favs = self.scraper.get_legacy_part(html.fromstring(
+            self.author.part_page(ref, "favs")))
+        self.assertEqual(legacy[ref].favs, len(favs))
+        with ReadMeDb(self.db_file) as read_db:
+            self.assertEqual(
+                sorted(x.id for x in favs),
+                sorted(x.code for x in read_db.get_favs_for_story(ref)))
+        code = favs[0].id
+        country = self.scraper.get_user_country(html.fromstring(
+            self.author.profile_page(code)))
+        self.assertEqual(self.author.user_codes[code][2], country)
+
+    def test_write_pages(self):
+        folder = os.path.join(self.tmp_dir.name, 'pages')
+        count = self.author.write_pages(folder)
+        self.assertEqual(count, len(os.listdir(folder)))
+        self.assertTrue(
+            os.path.exists(os.path.join(folder, 'story_eyes.php')))
+
+    def test_main_months(self):
+        """ The pages written are of the last month filled in """
+        folder = os.path.join(self.tmp_dir.name, 'main')
+        db_file = os.path.join(self.tmp_dir.name, 'main.db')
+        with contextlib.redirect_stdout(io.StringIO()):
+            main([db_file, '-s', '0.05', '-m', '2', '-p', folder])
+        author = SyntheticAuthor(scaled(0.05))
+        with open(os.path.join(folder, 'story_eyes.php'),
+                  encoding='utf-8') as page_file:
+            self.assertEqual(author.story_eyes_page(1), page_file.read())
+        with ReadMeDb(db_file) as read_db:
+            self.assertEqual(2, read_db.get_last_mid())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+from context import dyrm
+
+"""Tests for running several authors in one process."""
+import os
+import tempfile
+import unittest
+from mock import patch
+from dyrm import tenants
+from dyrm.tenants import Tenant, SharedHosts, load_tenants, run_tenants
+
+TENANTS = """[DEFAULT]
+fanfiction = yes
+
+[RockSunner]
+db = dbs/readme.db
+profile = /profiles/rock
+ao3 = RockSunner
+jsonreport = logs/rock.jsonl
+
+[Quill]
+fanfiction = no
+ao3 = QuillPen
+"""
+
+
+class TenantsTestCase(unittest.TestCase):
+    """ The tenants file and the resources the tenants share """
+
+    def test_load(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'tenants.ini')
+            with open(path, 'w') as tenants_file:
+                tenants_file.write(TENANTS)
+            loaded = load_tenants(path)
+        self.assertEqual([
+            Tenant('RockSunner', 'dbs/readme.db', '/profiles/rock', True,
+                   'RockSunner', 'logs/rock.jsonl', None, None),
+            Tenant('Quill', 'dbs/Quill.db', None, False,
+                   'QuillPen', None, None, None)], loaded)
+
+    def test_shared_hosts(self):
+        """ Own sessions and cookies, one pool and one throttle a host """
+        hosts = SharedHosts(delay=2.0, tenant_count=2)
+        first, second = hosts.session(), hosts.session()
+        self.assertIsNot(first.cookies, second.cookies)
+        self.assertIs(
+            first.get_adapter('https://www.fanfiction.net/'),
+            second.get_adapter('https://archiveofourown.org/'))
+        rock = Tenant('Rock', 'a.db', None, True, None, None, None, None)
+        quill = Tenant('Quill', 'b.db', None, True, None, None, None, None)
+        self.assertIs(
+            hosts.throttle(tenants.FFN_HOST, rock).throttle,
+            hosts.throttle(tenants.FFN_HOST, quill).throttle)
+        self.assertEqual(
+            2.0, hosts.throttles[tenants.FFN_HOST].min_interval)
+        hosts.close()
+
+    @patch('dyrm.do_you_read_ao3.main')
+    @patch('dyrm.ffmonthly.main')
+    @patch('dyrm.read_firefox_cookies.get_cookie_jar')
+    def test_run(self, get_cookie_jar, ffn_main, ao3_main):
+        """ Each tenant runs its own sites; a failure stays its own """
+        get_cookie_jar.side_effect = lambda profile: {'profile': profile}
+        ffn_main.side_effect = [RuntimeError("down")]
+        run_tenants([
+            Tenant('Rock', 'a.db', 'rock', True, None, None, None, None),
+            Tenant('Quill', 'b.db', 'quill', False, 'QuillPen',
+                   None, None, None)], delay=0.0, nomonth=True)
+        self.assertEqual('a.db', ffn_main.call_args[0][0])
+        self.assertTrue(ffn_main.call_args[1]['nomonth'])
+        self.assertEqual(
+            {'profile': 'rock'}, ffn_main.call_args[1]['cookie_jar'])
+        self.assertEqual('QuillPen', ao3_main.call_args[1]['user'])
+        self.assertEqual(
+            'Quill', ao3_main.call_args[1]['throttle'].tenant)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+from context import dyrm
+
+"""Tests for the queued country lookups."""
+import os
+import datetime
+import tempfile
+import unittest
+from dyrm.readme_db import ReadMeDb, Users
+from dyrm.reportgen import ReportGen
+from dyrm.do_you_read_me import report_ff_change
+from dyrm.ffgetter import TitleRec
+from dyrm.throttle import HostThrottle
+from dyrm import update_user_countries
+from dyrm.update_user_countries import CountryEnricher, next_lookup
+
+NOW = datetime.datetime(2020, 6, 1)
+
+
+class FakeEnricher(CountryEnricher):
+    """ Countries from a table; a missing user fails to look up """
+
+    def __init__(self, countries):
+        CountryEnricher.__init__(
+            self, None, HostThrottle(0.0, 2), workers=2, batch=2)
+        self.countries = countries
+        self.looked_up = []
+
+    def lookup(self, code):
+        self.looked_up.append(code)
+        return self.countries.get(code)
+
+
+class CountryQueueTestCase(unittest.TestCase):
+    """ New users are queued, looked up once and cached """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmp_dir.name, 'users.db')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_next_lookup(self):
+        """ Found and flagless results age out; failures back off """
+        self.assertEqual(
+            NOW + update_user_countries.COUNTRY_TTL,
+            next_lookup(1, "Chile", 3, NOW).due)
+        self.assertEqual(
+            NOW + update_user_countries.NO_COUNTRY_TTL,
+            next_lookup(1, "", 0, NOW).due)
+        failed = next_lookup(1, None, 2, NOW)
+        self.assertEqual(
+            (NOW + datetime.timedelta(hours=4), 3),
+            (failed.due, failed.attempts))
+        self.assertEqual(
+            NOW + update_user_countries.NO_COUNTRY_TTL,
+            next_lookup(1, None, 20, NOW).due)
+
+    def test_enrich(self):
+        """ Fav reports queue users; each lookup is stored till due """
+        now = datetime.datetime.now() + datetime.timedelta(minutes=1)
+        with ReadMeDb(self.db_file) as read_db:
+            read_db.batch_insert_stories([TitleRec(7, 'Seven')])
+            report_ff_change(
+                "Seven", "fav added", {101, 102, 103}, ReportGen('Me'),
+                read_db, 7, {101: "one", 102: "two", 103: "three"})
+            read_db.enqueue_countries(
+                [101], now + datetime.timedelta(days=1))
+            self.assertEqual(
+                [101, 102, 103],
+                sorted(code for code, _ in read_db.get_countries_due(now)))
+
+            enricher = FakeEnricher({101: "Chile", 102: ""})
+            self.assertEqual(3, enricher.run(read_db, now))
+            self.assertEqual([101, 102, 103], sorted(enricher.looked_up))
+            self.assertEqual([], read_db.get_countries_due(now))
+            later = now + datetime.timedelta(days=40)
+            self.assertEqual(
+                [(103, 1), (102, 0)], read_db.get_countries_due(later))
+            read_db.enqueue_countries([101], now, force=True)
+            self.assertEqual(
+                [(101, 0)], read_db.get_countries_due(now, limit=1))
+            read_db.set_commit_flag()
+
+        with ReadMeDb(self.db_file) as read_db:
+            self.assertEqual(
+                ["Chile", "", "Unknown"],
+                [read_db.session.get(Users, code).country
+                 for code in (101, 102, 103)])
+
+
+if __name__ == '__main__':
+    unittest.main()